@@ -1,5 +1,10 @@
-import rand_bin
-import make_qc_oracle
-import set_service
-import write_results
-import save_job
\ No newline at end of file
+# Modules are imported when first used (e.g. `package.run_bv`) so that importing the package stays fast.
+# qiskit, qiskit_ibm_runtime and matplotlib are only loaded by the modules and code paths that need them.
+import importlib
+
+MODULES = ["rand_bin", "make_qc_oracle", "set_service", "write_results", "save_job"]
+
+def __getattr__(name):
+    if name in MODULES:
+        return importlib.import_module(name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
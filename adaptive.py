@@ -0,0 +1,128 @@
+# Adaptive shot allocation for runs on quantum computers.
+# Instead of spending the full number of shots on every secret, each secret is first run with a small number of shots.
+# After each round the counts of every secret are combined with its earlier rounds and a confidence bound is computed:
+# a secret is finished once its most common outcome is known with the target confidence (the lower Wilson bound of its
+# probability is above the upper bound of the next most common outcome) and, if a `width` is given, once the Wilson
+# interval of its accuracy is narrower than `width`. Only unfinished secrets are run again, with the total shots
+# multiplied by `growth` each round, until they run out of shots.
+#
+# The combined counts of each secret are kept in the job ledger (save_job.RoundData) after every round, and each
+# secret's result is saved once it is finished, with all of its shots. Runs can not be resumed: if the process stops,
+# the counts of the finished rounds stay in the ledger but unfinished secrets have to be run again.
+
+import time
+import uuid
+from statistics import NormalDist
+
+import analytics
+import tracing
+from load_results import call_with_retry, job_failed
+from save_job import JobData, RoundData, save_job_datas, save_round_datas, set_job_state, INGESTED, FAILED
+from write_results import save_result, ResultData
+
+FIRST_SHOTS = 250   # Shots for every secret in the first round
+CONFIDENCE = 0.999  # Confidence that the most common outcome really is the most likely one
+GROWTH = 2          # Total shots of unfinished secrets are multiplied by this each round
+POLL = 5.0          # Seconds between checks for a round's jobs finishing
+
+# When to stop running a secret
+class ShotPolicy:
+    def __init__(self, max_shots:int=4000, first_shots:int=FIRST_SHOTS, confidence:float=CONFIDENCE, growth:float=GROWTH, width:float=None):
+        self.max_shots = max_shots
+        self.first_shots = min(first_shots, max_shots)
+        self.confidence = confidence
+        self.growth = growth
+        self.width = width
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    # Returns True if the counts identify the most common outcome (and the accuracy, if a width is set) with enough confidence
+    def confident(self, secret:str, counts:dict, shots:int)->bool:
+        if shots == 0:
+            return False
+        ranked = sorted(counts.values(), reverse=True) + [0, 0]
+        if analytics.wilson(ranked[0], shots, self.z)[0] <= analytics.wilson(ranked[1], shots, self.z)[1]:
+            return False
+        if self.width != None:
+            low, high = analytics.wilson(counts.get(secret, 0), shots, self.z)
+            return high - low <= self.width
+        return True
+
+    # Shots to run in the next round for a secret that has had `shots` so far (0 if it is out of shots)
+    def next_shots(self, shots:int)->int:
+        if shots == 0:
+            return self.first_shots
+        return max(0, min(int(shots * (self.growth - 1)), self.max_shots - shots))
+
+# Runs the transpiled circuits for the secrets on the backend in rounds until every secret is finished (see above)
+# Blocks until all rounds are done, checking on jobs every `poll` seconds. Returns the finished results in order of
+# the secrets (secrets whose jobs failed are left out).
+def run_adaptive(backend, secrets:list[str], qcs:list, transpiled_qcs:list, policy:ShotPolicy, tag:str="", batch_size:int=1, poll:float=POLL)->list[ResultData]:
+    run_id = str(uuid.uuid4())
+    tallies = [RoundData(run_id, i, backend.name, secret, tag) for i, secret in enumerate(secrets)]
+    save_round_datas(tallies)
+    print("Adaptive run", run_id)
+
+    active = list(range(len(secrets)))
+    results = {}
+    while len(active) > 0:
+        # Unfinished secrets have all had the same shots so they can share jobs
+        shots = policy.next_shots(tallies[active[0]].shots)
+        print("Round " + str(tallies[active[0]].rounds + 1) + ": " + str(len(active)) + " secrets with " + str(shots) + " shots")
+        with tracing.span("adaptive.round", secrets=len(active), shots=shots):
+            jobs = [submit_round(backend, [secrets[i] for i in group], [transpiled_qcs[i] for i in group], shots, tag) + (group,)
+                    for group in (active[k:k+batch_size] for k in range(0, len(active), batch_size))]
+            for job, job_datas, group in jobs:
+                wait_for_job(job, poll)
+                if call_with_retry(lambda: job_failed(job)):
+                    print("Job " + job.job_id() + " failed")
+                    set_job_state(job_datas, FAILED)
+                    for i in group:
+                        tallies[i].state = FAILED
+                    continue
+                result = call_with_retry(job.result)
+                for k, i in enumerate(group):
+                    tallies[i].add_round(job.job_id(), result.get_counts(k))
+                set_job_state(job_datas, INGESTED) # The counts are kept in the round tallies from now on
+
+        still_active = []
+        for i in active:
+            tally = tallies[i]
+            if tally.state == FAILED:
+                continue
+            if policy.confident(tally.secret, tally.counts, tally.shots) or policy.next_shots(tally.shots) == 0:
+                tally.state = INGESTED
+                results[i] = ResultData(backend.name, tally.secret, tally.shots, dict(tally.counts), qcs[i], transpiled_qcs[i], id=run_id + "_" + str(i), tag=tag)
+                low, high = analytics.wilson(tally.counts.get(tally.secret, 0), tally.shots, policy.z)
+                print(backend.name + "(" + tally.secret + ") finished after " + str(tally.shots) + " shots with accuracy " +
+                      str(results[i].accuracy()) + " [" + str(round(low, 4)) + ", " + str(round(high, 4)) + "]")
+            else:
+                still_active.append(i)
+        save_round_datas([tallies[i] for i in active])
+        for i in active:
+            if i in results:
+                save_result(results[i])
+        active = still_active
+
+    used = sum(t.shots for t in tallies)
+    print("Used " + str(used) + " shots of " + str(policy.max_shots * len(secrets)) + " (" + str(round(100 * used / max(1, policy.max_shots * len(secrets)), 1)) + "%)")
+    return [results[i] for i in sorted(results)]
+
+# Submits one round of circuits as a single job and records it in the job ledger
+# Returns the job and its job data
+def submit_round(backend, secrets:list[str], transpiled_qcs:list, shots:int, tag:str="")->tuple:
+    from run_bv import get_job_tags # Imported here as run_bv imports this module
+    with tracing.span("backend.run", circuits=len(secrets)):
+        job = backend.run(transpiled_qcs, shots=shots)
+    tracing.count("jobs")
+    tracing.count("shots", shots*len(secrets))
+    job.update_tags(get_job_tags(secrets, tag))
+    print("Job ID:", job.job_id())
+    job_datas = [JobData(job.job_id(), backend.name, secret, shots, tag, None if len(secrets) == 1 else i) for i, secret in enumerate(secrets)]
+    save_job_datas(job_datas)
+    return job, job_datas
+
+# Waits until the job is done or has failed
+def wait_for_job(job, poll:float=POLL):
+    with tracing.span("adaptive.wait"):
+        while not call_with_retry(job.done) and not call_with_retry(lambda: job_failed(job)):
+            time.sleep(poll)
@@ -0,0 +1,301 @@
+# Incremental accuracy statistics for the results in results_accuracy.csv.
+# Statistics are kept for each (backend, size, tag, Hamming weight of the secret) group and updated as each result
+# is appended by write_results.write_to_gen_csv, so summaries never need the full history to be re-read.
+# A snapshot is saved to results/accuracy_stats.json along with how much of the csv it covers, so rows added
+# by other processes (or before this module existed) are read once when the snapshot is next loaded.
+#
+# Usage: python analytics.py [-n <size>] [-b <backend>] [-t <tag>] [-w <weight>] [--by <columns>] [--bootstrap] [--rebuild]
+
+import os
+import csv
+import json
+import math
+import random
+import atexit
+from sys import argv
+
+FOLDER = "results" # Same as write_results.FOLDER
+ACCURACY_CSV = "results_accuracy.csv" # Written by write_results.write_to_gen_csv
+SNAPSHOT_FILE = "accuracy_stats.json"
+GROUP_COLUMNS = ["backend", "size", "tag", "weight"]
+
+Z = 1.959964 # 95% confidence
+RESERVOIR_SIZE = 256 # Accuracies kept per group for bootstrap intervals
+BOOTSTRAP_SAMPLES = 2000
+DEFAULT_SHOTS = 4000 # Shots assumed for csv rows written before the csv recorded shots
+SNAPSHOT_VERSION = 3 # Snapshots from other versions are rebuilt from the csv
+
+# Wilson score interval of a probability from `hits` successes in `shots` trials
+def wilson(hits:float, shots:int, z:float=Z)->tuple[float, float]:
+    if shots == 0:
+        return (0.0, 1.0)
+    p = hits / shots
+    denominator = 1 + z*z / shots
+    centre = (p + z*z / (2*shots)) / denominator
+    spread = z * math.sqrt(p*(1 - p) / shots + z*z / (4*shots*shots)) / denominator
+    return (max(0.0, centre - spread), min(1.0, centre + spread))
+
+# Running statistics of the accuracies in one group. Each update is O(1).
+# Mean and variance use Welford's method, the Wilson interval pools the shots of all results in the group,
+# and a reservoir sample of accuracies is kept for bootstrap intervals.
+class Aggregate:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0       # Sum of squared differences from the mean
+        self.min = None
+        self.max = None
+        self.shots = 0      # Total shots
+        self.hits = 0.0     # Total shots that gave the secret
+        self.reservoir = []
+
+    def add(self, accuracy:float, shots:int=DEFAULT_SHOTS, rng:random.Random=random):
+        self.count += 1
+        delta = accuracy - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (accuracy - self.mean)
+        self.min = accuracy if self.min == None else min(self.min, accuracy)
+        self.max = accuracy if self.max == None else max(self.max, accuracy)
+        self.shots += shots
+        self.hits += accuracy * shots
+        if len(self.reservoir) < RESERVOIR_SIZE:
+            self.reservoir.append(accuracy)
+        else:
+            i = rng.randrange(self.count)
+            if i < RESERVOIR_SIZE:
+                self.reservoir[i] = accuracy
+
+    # Combines another group into this one (used to answer queries over several groups)
+    def merge(self, other:"Aggregate", rng:random.Random=random):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.min = other.min if self.min == None else min(self.min, other.min)
+        self.max = other.max if self.max == None else max(self.max, other.max)
+        self.shots += other.shots
+        self.hits += other.hits
+        # Keep a reservoir where each result is equally likely to be included
+        weighted = [(a, self.count / len(self.reservoir)) for a in self.reservoir] + [(a, other.count / len(other.reservoir)) for a in other.reservoir]
+        if len(weighted) <= RESERVOIR_SIZE:
+            self.reservoir = [a for a, _ in weighted]
+        else:
+            self.reservoir = rng.choices([a for a, _ in weighted], weights=[w for _, w in weighted], k=RESERVOIR_SIZE)
+        self.count = count
+
+    def variance(self)->float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    # Wilson score interval of the probability that a shot gives the secret
+    def wilson(self, z:float=Z)->tuple[float, float]:
+        return wilson(self.hits, self.shots, z)
+
+    # Percentile bootstrap interval of the mean accuracy of the group's results
+    def bootstrap(self, samples:int=BOOTSTRAP_SAMPLES, level:float=0.95, seed=0)->tuple[float, float]:
+        if self.count == 0:
+            return (0.0, 1.0)
+        import numpy as np
+        values = np.array(self.reservoir)
+        rng = np.random.default_rng(seed)
+        means = values[rng.integers(0, len(values), size=(samples, len(values)))].mean(axis=1)
+        return (float(np.quantile(means, (1 - level) / 2)), float(np.quantile(means, (1 + level) / 2)))
+
+    def to_dict(self)->dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data:dict)->"Aggregate":
+        agg = cls()
+        agg.__dict__.update(data)
+        return agg
+
+# Aggregates for every group, along with how many bytes of results_accuracy.csv they include
+class AccuracyStats:
+    def __init__(self, folder:str=FOLDER):
+        self.folder = os.path.abspath(folder) # The snapshot is saved at exit, after the working folder may have changed
+        self.groups = {} # (backend, size, tag, weight) -> Aggregate
+        self.offset = 0
+        self.changed = False
+        self.rng = random.Random(0)
+
+    def csv_path(self)->str:
+        return os.path.join(self.folder, ACCURACY_CSV)
+
+    def snapshot_path(self)->str:
+        return os.path.join(self.folder, SNAPSHOT_FILE)
+
+    # Adds one result. `offset` is the size of the csv after the result was written, if it was
+    def add(self, backend:str, secret:str, accuracy:float, tag:str="", shots:int=DEFAULT_SHOTS, offset:int=None):
+        key = (backend, len(secret), tag, secret.count('1'))
+        agg = self.groups.get(key)
+        if agg == None:
+            agg = self.groups[key] = Aggregate()
+        agg.add(accuracy, shots, self.rng)
+        if offset != None:
+            self.offset = offset
+        self.changed = True
+
+    # Reads any rows added to the csv since the aggregates were last updated
+    def sync(self):
+        filename = self.csv_path()
+        if not os.path.isfile(filename):
+            return
+        size = os.path.getsize(filename)
+        if size < self.offset:
+            # The csv was replaced, start again
+            self.groups = {}
+            self.offset = 0
+        if size == self.offset:
+            return
+        with open(filename, mode='rb') as file:
+            file.seek(self.offset)
+            data = file.read()
+        data = data[:data.rfind(b"\n") + 1] # Leave any row that is still being written
+        for row in csv.reader(data.decode("UTF8").splitlines()):
+            if len(row) < 5 or row[0] == "backend":
+                continue # Header
+            backend, secret, accuracy, _, tag = row[:5]
+            shots = int(row[5]) if len(row) > 5 and row[5] != "" else DEFAULT_SHOTS
+            self.add(backend, secret[2:], float(accuracy), tag, shots)
+        self.offset += len(data)
+        self.changed = True
+
+    # Returns the combined aggregate of all groups matching the filters (None matches anything)
+    def summary(self, backend:str=None, size:int=None, tag:str=None, weight:int=None)->Aggregate:
+        return self.grouped([], backend, size, tag, weight).get((), Aggregate())
+
+    # Returns aggregates for the groups matching the filters combined by the given columns (from GROUP_COLUMNS)
+    def grouped(self, by:list[str]=None, backend:str=None, size:int=None, tag:str=None, weight:int=None)->dict:
+        by = GROUP_COLUMNS if by == None else by
+        positions = [GROUP_COLUMNS.index(column) for column in by]
+        filters = (backend, size, tag, weight)
+        combined = {}
+        for key in sorted(self.groups, key=str):
+            if any(f != None and f != k for f, k in zip(filters, key)):
+                continue
+            out_key = tuple(key[p] for p in positions)
+            if out_key not in combined:
+                combined[out_key] = Aggregate()
+            combined[out_key].merge(self.groups[key], self.rng)
+        return combined
+
+    def save(self):
+        if not self.changed or not os.path.isdir(os.path.dirname(self.folder)):
+            return # Nothing new, or the working folder has been removed (e.g. a temporary folder)
+        if not os.path.isdir(self.folder):
+            os.mkdir(self.folder)
+        data = {"version": SNAPSHOT_VERSION, "offset": self.offset, "groups": [list(key) + [agg.to_dict()] for key, agg in self.groups.items()]}
+        temp = self.snapshot_path() + ".tmp"
+        with open(temp, "w") as file:
+            json.dump(data, file)
+        os.replace(temp, self.snapshot_path())
+        self.changed = False
+
+    @classmethod
+    def load(cls, folder:str=FOLDER)->"AccuracyStats":
+        stats = cls(folder)
+        if os.path.isfile(stats.snapshot_path()):
+            with open(stats.snapshot_path(), "r") as file:
+                data = json.load(file)
+            if data.get("version") == SNAPSHOT_VERSION:
+                stats.offset = data["offset"]
+                for backend, size, tag, weight, agg in data["groups"]:
+                    stats.groups[(backend, size, tag, weight)] = Aggregate.from_dict(agg)
+            else:
+                stats.changed = True # Rebuilt from the csv below and saved in the new version
+        stats.sync()
+        return stats
+
+_stats = None # Statistics shared by all writers in this process
+
+# Returns the statistics for results/results_accuracy.csv, loading the snapshot on first use
+def get_stats()->AccuracyStats:
+    global _stats
+    if _stats == None:
+        _stats = AccuracyStats.load()
+        atexit.register(_stats.save)
+    return _stats
+
+# Called by write_results.write_to_gen_csv after a result's row is appended to the csv between `start` and `end`
+def add_result(result, start:int, end:int):
+    stats = get_stats()
+    if stats.offset != start:
+        # Rows were written by someone else since the last sync, read them (including this one) from the csv
+        stats.sync()
+    else:
+        stats.add(result.backend, result.secret, result.accuracy(), result.tag, result.shots, end)
+
+def print_summary(stats:AccuracyStats, by:list[str], bootstrap:bool=False, **filters):
+    columns = by + ["count", "mean", "std", "min", "max", "wilson_low", "wilson_high"]
+    if bootstrap:
+        columns += ["boot_low", "boot_high"]
+    print(", ".join(columns))
+    for key, agg in stats.grouped(by, **filters).items():
+        row = list(key) + [agg.count, round(agg.mean, 4), round(math.sqrt(agg.variance()), 4), agg.min, agg.max]
+        row += [round(v, 4) for v in agg.wilson()]
+        if bootstrap:
+            row += [round(v, 4) for v in agg.bootstrap()]
+        print(*row, sep=", ")
+
+def print_instructions():
+    print("Usage: ", argv[0]," <options>")
+    print(" ")
+    print("Options:")
+    print("-h \t\t\t View Instructions")
+    print("-n <int> \t\tNumber of bits\t\t[Default = any]")
+    print("-b <backend_name> \tSpecify quantum backend\t[Default = any]")
+    print("-t <tag> \t\tSpecify a tag that the results should have\t[Default = any]")
+    print("-w <int> \t\tHamming weight of the secrets\t[Default = any]")
+    print("--by <columns> \t\tComma separated columns to group by from backend,size,tag,weight\t[Default = backend,size]")
+    print("--bootstrap \t\tAlso print bootstrap confidence intervals")
+    print("--rebuild \t\tRebuild the statistics from results_accuracy.csv")
+
+if __name__ == "__main__":
+    filters = {"backend": None, "size": None, "tag": None, "weight": None}
+    by = ["backend", "size"]
+    bootstrap = False
+    rebuild = False
+    help_flag = False
+    # Process arguments
+    skip_flag = False
+    for i in range(1, len(argv)):
+        if skip_flag:
+            skip_flag =False
+            continue
+        opt = argv[i]
+        if opt == "-h" or opt == "--help":
+            print_instructions()
+            help_flag = True
+            break
+        elif opt == "-n":
+            filters["size"] = int(argv[i+1])
+            skip_flag = True
+        elif opt == "-b" or opt == "--backend":
+            filters["backend"] = argv[i+1]
+            skip_flag = True
+        elif opt == "-t" or opt == "--tag":
+            filters["tag"] = argv[i+1]
+            skip_flag = True
+        elif opt == "-w" or opt == "--weight":
+            filters["weight"] = int(argv[i+1])
+            skip_flag = True
+        elif opt == "--by":
+            by = argv[i+1].split(',')
+            skip_flag = True
+        elif opt == "--bootstrap":
+            bootstrap = True
+        elif opt == "--rebuild":
+            rebuild = True
+        else:
+            print("Option ", opt, " is not defined.")
+            help_flag = True
+    if not help_flag:
+        if rebuild:
+            stats = AccuracyStats()
+            stats.sync()
+            stats.save()
+        else:
+            stats = get_stats()
+        print_summary(stats, by, bootstrap, **filters)
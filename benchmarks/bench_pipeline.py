@@ -0,0 +1,291 @@
+# Benchmarks each stage of the BV pipeline over a sweep of secret sizes and secret counts.
+# Runs offline: circuits are transpiled for a qiskit fake device and all files are written to a temporary folder.
+# Reports the time (best of several repeats) and peak Python memory of each case as JSON and compares them
+# with a stored baseline, exiting with a non-zero status if any case is slower than the baseline allows.
+# Cases with no baseline are listed so that new stages are not left out of the check; record them with
+# --save-baseline (and --stage <stage> to leave the baseline of the other stages untouched).
+#
+# Usage: python benchmarks/bench_pipeline.py [--quick] [-r <repeats>] [--json <output-file>]
+#                                            [--baseline <file>] [--save-baseline] [--tolerance <factor>]
+#                                            [--stage <stage>]...
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import tracemalloc
+from sys import argv
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+REPEATS = 3
+TOLERANCE = 2.0 # A case fails if it takes longer than this many times its baseline time
+
+# Sweeps used for each stage, the quick sweep is a subset for fast checks
+SWEEPS = {
+    "full": {
+        "oracle_n": [64, 1024, 4096],
+        "packed_n": [1024, 16384, 10**5, 10**6],
+        "dj_n": [8, 12, 16],
+        "dj_packed_n": [16, 20, 24],
+        "qc_n": [4, 8, 16, 32],
+        "sim_n": [8, 64, 512, 2048],
+        "basic_sim_n": [4, 8, 12],
+        "counts": [1, 10, 100],
+        "ledger_sizes": [10, 100, 1000, 10**4, 10**5],
+        "noisy_sim_n": [8, 64, 512],
+        "cache_sizes": [100, 10**4, 10**5],
+        "summary_n": [16, 128, 1024],
+    },
+    "quick": {
+        "oracle_n": [64, 1024],
+        "packed_n": [1024, 10**5],
+        "dj_n": [8, 12],
+        "dj_packed_n": [16],
+        "qc_n": [4, 16],
+        "sim_n": [8, 512],
+        "basic_sim_n": [4, 8],
+        "counts": [1, 10],
+        "ledger_sizes": [10, 1000],
+        "noisy_sim_n": [8, 64],
+        "cache_sizes": [100, 10**4],
+        "summary_n": [16, 128],
+    },
+}
+
+def rand_secret(n:int)->str:
+    return ''.join(random.choice('01') for _ in range(n))
+
+# Returns the best time of `repeats` calls of fn(), and the peak memory of one extra call
+# setup() is called (untimed) before each call if given
+def measure(fn, setup=None, repeats:int=REPEATS):
+    times = []
+    for _ in range(repeats):
+        if setup != None:
+            setup()
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+
+    if setup != None:
+        setup()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+# Yields (stage, params, fn, setup) for every case in the sweep
+def cases(sweep:dict):
+    import numpy as np
+    import classical
+    import make_qc_oracle
+    import run_bv
+    import write_results
+    import save_job
+    import render_queue
+    import noisy_sim
+    import result_cache
+    from qiskit import transpile
+    from qiskit_ibm_runtime.fake_provider import FakeKolkataV2
+
+    for n in sweep["oracle_n"]:
+        ora = classical.Oracle(rand_secret(n))
+        x = rand_secret(n)
+        yield "oracle_query", {"n": n}, lambda ora=ora, x=x: ora.query(x), None
+        yield "bv_find", {"n": n}, lambda ora=ora: classical.bv_find(ora), None
+
+    for n in sweep["packed_n"]:
+        ora = classical.PackedOracle(rand_secret(n))
+        xs = np.random.randint(0, 2, size=(64, n), dtype=np.uint8)
+        yield "packed_query_many", {"n": n, "inputs": 64}, lambda ora=ora, xs=xs: ora.query_many(xs), None
+        yield "packed_bv_find", {"n": n}, lambda ora=ora: classical.bv_find(ora), None
+
+    # Constant oracles are the worst case for DJ
+    for n in sweep["dj_n"]:
+        ora = classical.Oracle(rand_secret(n), constant=True)
+        yield "dj_find_constant", {"n": n}, lambda ora=ora: classical.dj_find_constant(ora), None
+    for n in sweep["dj_packed_n"]:
+        ora = classical.PackedOracle(rand_secret(n), constant=True)
+        yield "packed_dj_find_constant", {"n": n}, lambda ora=ora: classical.dj_find_constant(ora), None
+
+    backend = FakeKolkataV2()
+    for n in sweep["qc_n"]:
+        for count in sweep["counts"]:
+            secrets = [rand_secret(n) for _ in range(count)]
+            params = {"n": n, "secrets": count}
+            yield "secret_test_qc", params, lambda secrets=secrets: make_qc_oracle.secret_test_qcs(secrets), None
+            if n < backend.num_qubits:
+                qcs = make_qc_oracle.secret_test_qcs(secrets)
+                yield "transpile", params, lambda qcs=qcs: transpile(qcs, backend, seed_transpiler=0), None
+
+    for n in sweep["sim_n"]:
+        secret = rand_secret(n)
+        qc = make_qc_oracle.secret_test_qc(secret)
+        yield "run_local_sim", {"n": n, "method": "stabilizer"}, lambda qc=qc, s=secret: run_bv.run_local_sim(qc, s, 4000, "stabilizer"), None
+    for n in sweep["basic_sim_n"]:
+        secret = rand_secret(n)
+        qc = make_qc_oracle.secret_test_qc(secret)
+        yield "run_local_sim", {"n": n, "method": "basic"}, lambda qc=qc, s=secret: run_bv.run_local_sim(qc, s, 4000, "basic"), None
+
+    # Figures are queued rather than drawn so that only the writers are measured
+    render_queue.MODE = render_queue.LATER
+    for n in sweep["qc_n"]:
+        for count in sweep["counts"]:
+            results = []
+            for _ in range(count):
+                secret = rand_secret(n)
+                counts = {secret: 3900, rand_secret(n): 60, rand_secret(n): 40}
+                results.append(write_results.ResultData("fake_kolkata", secret, 4000, counts, tag="bench"))
+            params = {"n": n, "secrets": count}
+            yield "save_results", params, lambda results=results: write_results.save_results(results), None
+            yield "write_to_csv", params, lambda results=results: [write_results.write_to_csv(r) for r in results], None
+            yield "write_to_gen_csv", params, lambda results=results: [write_results.write_to_gen_csv(r) for r in results], None
+
+    for size in sweep["ledger_sizes"]:
+        job_datas = [save_job.JobData("job" + str(i), "fake_kolkata", rand_secret(4), 4000, "bench") for i in range(size)]
+        yield "save_job_datas", {"jobs": size}, lambda jds=job_datas: save_job.save_job_datas(jds), reset_ledger
+        yield "load_job_datas", {"jobs": size}, lambda: save_job.load_job_datas(query_tag="bench"), None
+        yield "load_job_datas_pending", {"jobs": size}, lambda: save_job.load_job_datas(states=save_job.PENDING), None
+
+    # Stages added after the cases above go at the end so that the secrets of the earlier cases do not change
+    noise_model = noisy_sim.NoiseModel(readout_error=0.02, cx_error=0.01)
+    for n in sweep["noisy_sim_n"]:
+        secret = rand_secret(n)
+        qc = make_qc_oracle.secret_test_qc(secret)
+        yield "run_noisy_sim", {"n": n}, lambda qc=qc, s=secret: run_bv.run_noisy_sim(qc, s, noise_model, 4000, seed=0), None
+
+    # Up to half of the looked up secrets are in the cache
+    for size in sweep["cache_sizes"]:
+        cache = result_cache.ResultCache("cache_" + str(size) + ".db")
+        cached = [rand_secret(32) for _ in range(size)]
+        cache.add_sims([write_results.ResultData("bench_sim", secret, 4000, {secret: 4000}) for secret in cached], "bench")
+        secrets = cached[:500]
+        secrets += [rand_secret(32) for _ in range(1000 - len(secrets))]
+        params = {"entries": size, "secrets": len(secrets)}
+        yield "cache_lookup", params, lambda cache=cache, secrets=secrets: cache.lookup(result_cache.SIM, secrets, "bench", result_cache.SIM_BACKEND, 4000), None
+
+    # Results with many distinct outputs, like a noisy run of a long secret
+    for n in sweep["summary_n"]:
+        secret = rand_secret(n)
+        counts = {secret: 10000}
+        while len(counts) < 5000:
+            counts.setdefault(rand_secret(n), 2)
+        result = write_results.ResultData("fake_kolkata", secret, sum(counts.values()), counts, tag="bench")
+        params = {"n": n, "outputs": len(counts)}
+        yield "result_summary", params, lambda result=result: result.summary(), None
+        yield "write_to_summary", params, lambda result=result: write_results.write_to_summary(result), None
+
+# Starts a new empty job ledger
+def reset_ledger():
+    import shutil
+    import save_job
+    if save_job._ledger != None:
+        save_job._ledger.close()
+        save_job._ledger = None
+    if os.path.isdir(save_job.JOB_FOLDER):
+        shutil.rmtree(save_job.JOB_FOLDER)
+
+def case_key(stage:str, params:dict)->str:
+    return stage + "(" + ",".join(k + "=" + str(v) for k, v in params.items()) + ")"
+
+# Runs every case in a temporary folder and returns a list of records
+# If `stages` is given only the cases of those stages are run (the other cases are still made so that secrets match)
+def run_benchmark(sweep_name:str="full", repeats:int=REPEATS, stages:list=None)->list[dict]:
+    random.seed(0)
+    records = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for stage, params, fn, setup in cases(SWEEPS[sweep_name]):
+                if stages != None and stage not in stages:
+                    continue
+                seconds, peak = measure(fn, setup, repeats)
+                records.append({"case": case_key(stage, params), "stage": stage, "params": params, "seconds": seconds, "peak_bytes": peak})
+                print(f"{records[-1]['case']:50s} {seconds*1000:10.3f} ms {peak/1024:10.1f} KiB")
+        finally:
+            os.chdir(cwd)
+    return records
+
+# Compares records with the baseline, returns a list of (case, seconds, baseline seconds) for regressions
+def compare(records:list[dict], baseline:dict, tolerance:float=TOLERANCE)->list[tuple]:
+    regressions = []
+    for record in records:
+        base = baseline.get(record["case"])
+        if base != None and record["seconds"] > base["seconds"] * tolerance:
+            regressions.append((record["case"], record["seconds"], base["seconds"]))
+    return regressions
+
+# Cases of the records that have no baseline
+def missing_cases(records:list[dict], baseline:dict)->list[str]:
+    return [record["case"] for record in records if record["case"] not in baseline]
+
+if __name__ == "__main__":
+    sweep_name = "full"
+    repeats = REPEATS
+    json_file = None
+    baseline_file = BASELINE_FILE
+    save_baseline = False
+    tolerance = TOLERANCE
+    stages = None
+    skip_flag = False
+    for i in range(1, len(argv)):
+        if skip_flag:
+            skip_flag = False
+            continue
+        opt = argv[i]
+        if opt == "--quick":
+            sweep_name = "quick"
+        elif opt == "-r":
+            repeats = int(argv[i+1])
+            skip_flag = True
+        elif opt == "--json":
+            json_file = argv[i+1]
+            skip_flag = True
+        elif opt == "--baseline":
+            baseline_file = argv[i+1]
+            skip_flag = True
+        elif opt == "--save-baseline":
+            save_baseline = True
+        elif opt == "--tolerance":
+            tolerance = float(argv[i+1])
+            skip_flag = True
+        elif opt == "--stage":
+            stages = (stages or []) + [argv[i+1]]
+            skip_flag = True
+        else:
+            print("Option ", opt, " is not defined.")
+            sys.exit(2)
+
+    records = run_benchmark(sweep_name, repeats, stages)
+
+    if json_file != None:
+        with open(json_file, "w") as file:
+            json.dump(records, file, indent=4)
+
+    if save_baseline:
+        baseline = {}
+        if os.path.isfile(baseline_file):
+            with open(baseline_file, "r") as file:
+                baseline = json.load(file)
+        baseline.update({r["case"]: {"seconds": r["seconds"], "peak_bytes": r["peak_bytes"]} for r in records})
+        with open(baseline_file, "w") as file:
+            json.dump(baseline, file, indent=4, sort_keys=True)
+        print("Baseline saved to", baseline_file)
+    elif os.path.isfile(baseline_file):
+        with open(baseline_file, "r") as file:
+            baseline = json.load(file)
+        regressions = compare(records, baseline, tolerance)
+        for case in missing_cases(records, baseline):
+            print(f"NO BASELINE {case}")
+        for case, seconds, base in regressions:
+            print(f"REGRESSION {case}: {seconds*1000:.3f} ms (baseline {base*1000:.3f} ms)")
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("No regressions against", baseline_file)
@@ -0,0 +1,75 @@
+# Measures the cold start import time of each entry point script and checks it against the budgets in import_budgets.json.
+# Each import is timed in a fresh python process, and modules that should only be loaded later (e.g. qiskit_ibm_runtime)
+# are checked to make sure the entry point does not import them.
+# Exits with a non-zero status if any entry point is over budget.
+#
+# Usage: python benchmarks/import_time.py [-r <repeats>] [--json <output-file>]
+
+import os
+import json
+import subprocess
+import sys
+from statistics import median
+from sys import argv
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BUDGET_FILE = os.path.join(BENCH_DIR, "import_budgets.json")
+REPEATS = 5
+
+# Run in a new process: prints import time and the top level packages that were loaded
+TIMER = """
+import sys, time, json
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+print(json.dumps({{"seconds": t, "modules": sorted(set(m.split('.')[0] for m in sys.modules))}}))
+"""
+
+# Returns the median import time (seconds) of the module and the top level packages it loaded
+def time_import(module:str, repeats:int=REPEATS):
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", TIMER.format(module=module)], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+        data = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(data["seconds"])
+    return median(times), data["modules"]
+
+# Times every entry point and returns a report with the result of each check
+def run_benchmark(repeats:int=REPEATS)->dict:
+    with open(BUDGET_FILE, "r") as file:
+        budgets = json.load(file)
+
+    report = {}
+    for module, budget in budgets.items():
+        seconds, modules = time_import(module, repeats)
+        loaded = [m for m in budget.get("forbidden", []) if m in modules]
+        report[module] = {
+            "seconds": seconds,
+            "max_seconds": budget["max_seconds"],
+            "forbidden_loaded": loaded,
+            "ok": seconds <= budget["max_seconds"] and len(loaded) == 0,
+        }
+    return report
+
+if __name__ == "__main__":
+    repeats = REPEATS
+    json_file = None
+    for i in range(1, len(argv)):
+        if argv[i] == "-r":
+            repeats = int(argv[i+1])
+        elif argv[i] == "--json":
+            json_file = argv[i+1]
+
+    report = run_benchmark(repeats)
+    for module, res in report.items():
+        status = "ok" if res["ok"] else "FAIL"
+        extra = "" if len(res["forbidden_loaded"]) == 0 else " (imports " + ", ".join(res["forbidden_loaded"]) + ")"
+        print(f"{module:20s} {res['seconds']:7.3f}s / {res['max_seconds']:.3f}s  {status}{extra}")
+
+    if json_file != None:
+        with open(json_file, "w") as file:
+            json.dump(report, file, indent=4)
+
+    if not all(res["ok"] for res in report.values()):
+        sys.exit(1)
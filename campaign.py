@@ -0,0 +1,341 @@
+# Long running campaigns of BV jobs on a quantum computer that can be stopped and resumed.
+# A campaign's secrets are written to disk when it is created. Running the campaign then works as a pipeline:
+# a builder thread builds, validates and transpiles batches of circuits a few batches ahead of submission, and the
+# main thread submits them while keeping at most `max_in_flight` jobs queued on the backend, and loads the results of
+# finished jobs as they come in. The builder waits when it is far enough ahead and nothing is submitted while the
+# backend has `max_in_flight` jobs, so neither the queue on the backend nor the circuits in memory grow without limit.
+#
+# Progress is kept in the job ledger (see save_job.py): every job is saved as soon as it is submitted, tagged with
+# the campaign, and marked ingested once its results are saved. A campaign that is stopped (or crashes) is resumed
+# by running it again; secrets already submitted are skipped and jobs still in flight are waited for.
+#
+# Usage: python campaign.py <name> [<options>]
+
+import os
+import json
+import time
+import queue
+import threading
+from sys import argv
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+import render_queue
+import parallel_sim
+import result_cache
+from make_qc_oracle import LINEAR, VARIANTS
+from save_job import JOB_FOLDER, JobData, load_job_datas, set_job_state, PENDING, DONE, INGESTED, FAILED
+from load_results import fetch_job, job_result_data, get_call_executor, WORKERS
+from write_results import save_results
+from run_bv import oracle_test_qc, run_local_sim, transpile_qcs, submit_batch, secret_iter, BEST_ORACLE
+
+CAMPAIGN_FOLDER = "campaigns"   # Inside save_job.JOB_FOLDER
+TAG_PREFIX = "campaign_"        # Jobs of a campaign are tagged with this followed by the campaign name
+MAX_IN_FLIGHT = 5               # Jobs queued on the backend at a time
+AHEAD = 2                       # Batches built and transpiled ahead of submission
+POLL = 10.0                     # Seconds between checks on jobs in flight when there is nothing else to do
+
+# Settings and secrets of a campaign
+class Campaign:
+    def __init__(self, name:str, backend_name:str=None, shots:int=4000, batch_size:int=1, max_in_flight:int=MAX_IN_FLIGHT, oracle:str=LINEAR, sim:bool=True, total:int=0):
+        self.name = name
+        self.backend_name = backend_name
+        self.shots = shots
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.oracle = oracle
+        self.sim = sim
+        self.total = total # Number of secrets
+        self.tag = TAG_PREFIX + name
+
+    def path(self, extension:str)->str:
+        return os.path.join(JOB_FOLDER, CAMPAIGN_FOLDER, self.name + extension)
+
+    def save(self):
+        data = {k: v for k, v in self.__dict__.items() if k != "tag"}
+        with open(self.path(".json.tmp"), "w") as file:
+            json.dump(data, file)
+        os.replace(self.path(".json.tmp"), self.path(".json"))
+
+    @classmethod
+    def load(cls, name:str)->"Campaign":
+        with open(os.path.join(JOB_FOLDER, CAMPAIGN_FOLDER, name + ".json"), "r") as file:
+            return cls(**json.load(file))
+
+    @classmethod
+    def exists(cls, name:str)->bool:
+        return os.path.isfile(os.path.join(JOB_FOLDER, CAMPAIGN_FOLDER, name + ".json"))
+
+    # Creates a campaign, writing its secrets (any iterable) to disk one line each
+    @classmethod
+    def create(cls, name:str, secrets, **settings)->"Campaign":
+        campaign = cls(name, **settings)
+        os.makedirs(os.path.join(JOB_FOLDER, CAMPAIGN_FOLDER), exist_ok=True)
+        with open(campaign.path(".txt"), "w") as file:
+            for secret in secrets:
+                file.write(secret + "\n")
+                campaign.total += 1
+        campaign.save()
+        return campaign
+
+    # Yields the campaign's secrets, starting from the secret at position `start`
+    def secrets(self, start:int=0):
+        with open(self.path(".txt"), "r") as file:
+            for line in islice(file, start, None):
+                yield line.strip()
+
+    # Returns the job data of every secret submitted so far, in order of submission
+    def job_datas(self)->list[JobData]:
+        return load_job_datas(query_tag=self.tag)
+
+    # Returns (secrets submitted, secrets in flight, secrets ingested, secrets whose jobs failed)
+    def progress(self)->tuple:
+        job_datas = self.job_datas()
+        return (len(job_datas), sum(1 for d in job_datas if d.state in PENDING),
+                sum(1 for d in job_datas if d.state == INGESTED), sum(1 for d in job_datas if d.state == FAILED))
+
+# Runs (or resumes) a campaign until every secret has been submitted and every job has finished
+# `service` can be given to use something other than the saved IBM account (e.g. fake_service.FakeService)
+# Job lookups are spread over `workers` threads and jobs are checked every `poll` seconds while waiting
+def run_campaign(campaign:Campaign, service=None, poll:float=POLL, workers:int=WORKERS):
+    if service == None:
+        from set_service import get_service # Only imported when needed as qiskit_ibm_runtime is slow to import
+        service = get_service()
+
+    if campaign.backend_name == None:
+        # Chosen once, so a resumed campaign keeps running on the same backend
+        n_max = max(len(secret) for secret in campaign.secrets()) + 1
+        campaign.backend_name = service.least_busy(simulator=False, operational=True, min_num_qubits=n_max).name
+        campaign.save()
+    backend = service.get_backend(campaign.backend_name)
+
+    # Every submitted secret is in the ledger, in order, so the campaign carries on from the next one
+    job_datas = campaign.job_datas()
+    in_flight = {} # job id -> job data of the job's secrets
+    for job_data in job_datas:
+        if job_data.state in PENDING:
+            in_flight.setdefault(job_data.job_id, []).append(job_data)
+    print("Campaign " + campaign.name + " on " + backend.name + ": " + str(len(job_datas)) + " of " + str(campaign.total) +
+          " secrets submitted, " + str(len(in_flight)) + " jobs in flight")
+
+    batches = queue.Queue(maxsize=AHEAD)
+    builder = threading.Thread(target=build_batches, args=(campaign, backend, len(job_datas), batches), daemon=True)
+    builder.start()
+    building = True
+    get_call_executor(workers) # Every worker can be waiting on a call to the service at once
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while building or len(in_flight) > 0:
+            progressed = False
+            if len(in_flight) > 0:
+                progressed = collect_results(service, in_flight, pool) > 0
+
+            # Submit while there is room on the backend, only waiting for the builder if nothing is in flight
+            while building and len(in_flight) < campaign.max_in_flight:
+                try:
+                    batch = batches.get(block=len(in_flight) == 0)
+                except queue.Empty:
+                    break
+                if batch == None:
+                    building = False
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                secrets, qcs, transpiled_qcs = batch
+                job = submit_batch(backend, secrets, qcs, transpiled_qcs, campaign.shots, campaign.tag)
+                in_flight[job.job_id()] = [JobData(job.job_id(), backend.name, secret, campaign.shots, campaign.tag, None if len(secrets) == 1 else i)
+                                           for i, secret in enumerate(secrets)]
+                progressed = True
+
+            if not progressed and len(in_flight) > 0:
+                time.sleep(poll)
+
+    _, _, ingested, failed = campaign.progress()
+    print("Campaign " + campaign.name + " finished: " + str(ingested) + " results saved, " + str(failed) + " failed")
+
+# Builds, validates and transpiles the campaign's secrets from position `start` in batches of the campaign's batch size,
+# putting (secrets, circuits, transpiled circuits) on `batches`, then None once all are built (or the error if one is raised)
+def build_batches(campaign:Campaign, backend, start:int, batches:queue.Queue):
+    try:
+        secrets = campaign.secrets(start)
+        if campaign.sim and campaign.oracle == LINEAR:
+            checked = parallel_sim.simulate_secrets(secrets, campaign.shots)
+        else:
+            checked = ((secret, None) for secret in secrets)
+        batch = []
+        for secret, data in checked:
+            with tracing.span("secret_test_qc"):
+                qc, layout = oracle_test_qc(secret, campaign.oracle, backend)
+            if campaign.sim and campaign.oracle != LINEAR:
+                data = run_local_sim(qc, secret, campaign.shots)
+            if data != None and data.accuracy() != 1.0:
+                raise parallel_sim.ValidationError("Simulation did not find secret " + secret + ", the campaign was stopped")
+            batch.append((secret, qc, layout))
+            if len(batch) == campaign.batch_size:
+                batches.put(transpile_batch(batch, backend))
+                batch = []
+        if len(batch) > 0:
+            batches.put(transpile_batch(batch, backend))
+        batches.put(None)
+    except Exception as e:
+        batches.put(e)
+
+def transpile_batch(batch:list[tuple], backend)->tuple:
+    secrets, qcs, layouts = zip(*batch)
+    return list(secrets), list(qcs), transpile_qcs(list(qcs), backend, list(layouts))
+
+# Checks every job in flight, saving the results of finished jobs and removing them (and failed jobs) from `in_flight`
+# Returns the number of jobs that finished
+def collect_results(service, in_flight:dict, pool:ThreadPoolExecutor)->int:
+    job_ids = list(in_flight)
+    result_datas = []
+    ingested = []
+    failed = []
+    for job_id, (job, state, result) in zip(job_ids, pool.map(lambda job_id: fetch_job(service, job_id), job_ids)):
+        if state == DONE:
+            for job_data in in_flight.pop(job_id):
+                result_data = job_result_data(job_data, result)
+                print(result_data.backend + "(" + result_data.secret + ") ran with accuracy " + str(result_data.accuracy()))
+                result_datas.append(result_data)
+                ingested.append(job_data)
+        elif state == FAILED:
+            print("Job " + job_id + " failed")
+            failed += in_flight.pop(job_id)
+        # Jobs that are still queued, or could not be looked up, are checked again next time
+
+    # Jobs are marked done first so a failure while saving leaves them to be loaded again
+    set_job_state(ingested, DONE)
+    save_results(result_datas)
+    set_job_state(ingested, INGESTED)
+    set_job_state(failed, FAILED)
+    result_cache.drop_failed_jobs([job_data.job_id for job_data in failed])
+    return len(job_ids) - len(in_flight)
+
+def print_instructions():
+    print("Usage: ", argv[0]," <name> <options>")
+    print(" ")
+    print("Creates the campaign <name> from the secret options and runs it, or resumes it if it already exists")
+    print(" ")
+    print("Options:")
+    print("-h \t\t\t\t View Instructions")
+    print("-n <number-of-bits> \t\t Secret length(s) in comma seperated list [Default = 4]")
+    print("-i <number-of-secrets> \t\t Number of random secrets of each length [Default = 1]")
+    print("--seed <int> \t\t\t Seed for random secrets")
+    print("--unique \t\t\t Do not repeat random secrets")
+    print("--weight <number-of-ones> \t Only secrets with this many 1s (all of them if -i is not given)")
+    print("--all \t\t\t\t Every secret of the given size(s)")
+    print("-s <binary-secrets> \t\t Secrets to use in a comma seperated list")
+    print("-b <backend-name> \t\t Backend [Default = least busy]")
+    print("--shots <number-of-shots> \t Number of shots [default=4000]")
+    print("--batch <number-of-circuits> \t Circuits in each job [default=1]")
+    print("-k <number-of-jobs> \t\t Most jobs queued on the backend at a time [default=" + str(MAX_IN_FLIGHT) + "]")
+    print("--oracle <variant> \t\t Oracle construction: linear, tree, coupling or best [default=linear]")
+    print("--no-sim \t\t\t Do not validate circuits by simulation")
+    print("--poll <seconds> \t\t Time between checks on jobs in flight [default=" + str(POLL) + "]")
+    print("--status \t\t\t Print the campaign's progress and exit")
+    print("--render <sync|background|later>  Draw figures now, in background processes, or later with render_queue.py [default=sync]")
+    print("--trace <file> \t\t\t Time each stage and save a trace")
+
+if __name__ == "__main__":
+    ns = [4]
+    iters = 1
+    iters_given = False
+    secrets = None
+    seed = None
+    unique = False
+    weight = None
+    every = False
+    settings = {}
+    poll = POLL
+    status = False
+    help_flag = len(argv) < 2 or argv[1].startswith("-")
+    if help_flag:
+        print_instructions()
+    # Process arguments
+    skip_flag = False
+    for i in range(2, len(argv)):
+        if help_flag:
+            break
+        if skip_flag:
+            skip_flag =False
+            continue
+        opt = argv[i]
+        if opt == "-h" or opt == "--help":
+            print_instructions()
+            help_flag = True
+        elif opt == "-n":
+            ns = [int(n) for n in argv[i+1].split(',')]
+            skip_flag = True
+        elif opt == "-i":
+            iters = int(argv[i+1])
+            iters_given = True
+            skip_flag = True
+        elif opt == "--seed":
+            seed = int(argv[i+1])
+            skip_flag = True
+        elif opt == "--unique":
+            unique = True
+        elif opt == "--weight":
+            weight = int(argv[i+1])
+            skip_flag = True
+        elif opt == "--all":
+            every = True
+        elif opt == "-s" or opt == "--secrets":
+            secrets = argv[i+1].split(',')
+            skip_flag = True
+        elif opt == "-b" or opt == "--backend":
+            settings["backend_name"] = argv[i+1]
+            skip_flag = True
+        elif opt == "--shots":
+            settings["shots"] = int(argv[i+1])
+            skip_flag = True
+        elif opt == "--batch":
+            settings["batch_size"] = int(argv[i+1])
+            skip_flag = True
+        elif opt == "-k":
+            settings["max_in_flight"] = int(argv[i+1])
+            skip_flag = True
+        elif opt == "--oracle":
+            settings["oracle"] = argv[i+1]
+            if argv[i+1] not in VARIANTS + [BEST_ORACLE]:
+                print("Oracle ", argv[i+1], " is not defined.")
+                help_flag = True
+            skip_flag = True
+        elif opt == "--no-sim":
+            settings["sim"] = False
+        elif opt == "--poll":
+            poll = float(argv[i+1])
+            skip_flag = True
+        elif opt == "--status":
+            status = True
+        elif opt == "--render":
+            render_queue.MODE = argv[i+1]
+            skip_flag = True
+        elif opt == "--trace":
+            tracing.enable(argv[i+1])
+            skip_flag = True
+        else:
+            print("Option ", opt, " is not defined.")
+            help_flag = True
+    if not help_flag:
+        name = argv[1]
+        if Campaign.exists(name):
+            campaign = Campaign.load(name)
+            if "max_in_flight" in settings:
+                campaign.max_in_flight = settings["max_in_flight"] # The only setting that can change between runs
+                campaign.save()
+        elif status:
+            print("No campaign named", name)
+            campaign = None
+        else:
+            if secrets == None:
+                secrets = chain.from_iterable(secret_iter(n, iters if iters_given or weight == None else None, False, False, every, weight, seed, unique) for n in ns)
+            campaign = Campaign.create(name, secrets, **settings)
+            print("Created campaign " + name + " with " + str(campaign.total) + " secrets")
+        if campaign != None:
+            if status:
+                submitted, flying, ingested, failed = campaign.progress()
+                print(name + ": " + str(campaign.total) + " secrets, " + str(submitted) + " submitted, " + str(flying) + " in flight, " +
+                      str(ingested) + " saved, " + str(failed) + " failed")
+            else:
+                run_campaign(campaign, poll=poll)
@@ -1,5 +1,14 @@
 # This script contains classical implementations of the BV and DJ algorithms.
 
+import numpy as np
+
+WORD_BITS = 64 # Number of secret bits held in each word of a packed oracle
+BV_BLOCK_WORDS = 64 # Number of words probed per vectorised query when finding a packed secret
+DJ_CHUNK = 2**20 # Number of candidate inputs queried per block in the DJ search
+
+# Number of set bits in each possible byte, used when numpy does not provide bitwise_count
+_POPCOUNT_8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
 # An oracle that will give a 1-bit output when queried with an n-bit input.
 # Output is either constant or calculated using (input dot `a`) mod 2 where `a` is a bainry secret (represented by a string of 1's and 0's)
 class Oracle:
@@ -24,10 +33,88 @@ class Oracle:
     
     def len(self):
         return len(self.__a)
-    
+
+    # Returns a PackedOracle giving the same outputs, so that many inputs can be queried in one vectorised call
+    def packed(self)->"PackedOracle":
+        packed = PackedOracle(self.__a, self._constant)
+        packed._const_val = int(self._const_val)
+        return packed
+
+
+# Counts the number of set bits in each element of a uint64 array
+def popcount64(words:np.ndarray)->np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    return _POPCOUNT_8[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+# Converts a binary string into an array of 0/1 values (one per character)
+def bits_from_str(x:str)->np.ndarray:
+    return np.frombuffer(x.encode("ascii"), dtype=np.uint8) - ord('0')
+
+# Packs a matrix of 0/1 values (one big endian n-bit input per row) into rows of uint64 words
+# Word 0 holds the least significant 64 bits so that the words line up with int(x, 2)
+def pack_bits(bits:np.ndarray)->np.ndarray:
+    bits = np.atleast_2d(np.asarray(bits, dtype=np.uint8))
+    k, n = bits.shape
+    n_words = max(1, -(-n // WORD_BITS))
+    padded = np.zeros((k, n_words*WORD_BITS), dtype=np.uint8)
+    padded[:, n_words*WORD_BITS-n:] = bits
+    words = np.packbits(padded, axis=1).view('>u8').astype(np.uint64)
+    return np.ascontiguousarray(words[:, ::-1])
+
+# An oracle with the same behaviour as `Oracle` but with the secret packed into an array of uint64 words.
+# Parity is found by popcount so queries take O(n/64) operations and many inputs can be queried in one call.
+class PackedOracle:
+    def __init__(self, a:str, constant=False):
+        self.__n = len(a)
+        self.__words = pack_bits(bits_from_str(a))[0]
+        self._constant = constant
+        self._const_val = int(a[0] == '1') # Take 1st char of secret string to be constant if constant set
+
+    # Performs binary operation `a` dot `x` mod 2
+    # x may be given as a binary string (like `Oracle`) or as the equivalent int
+    def query(self, x):
+        if self._constant:
+            return self._const_val
+
+        if isinstance(x, str):
+            assert(len(x) == self.__n)
+            words = pack_bits(bits_from_str(x))[0]
+        else:
+            assert(0 <= x < 2**self.__n)
+            words = np.frombuffer(x.to_bytes(self.n_words()*8, byteorder='little'), dtype='<u8').astype(np.uint64)
+        return int(popcount64(words & self.__words).sum() & 1)
+
+    # Queries the oracle with every row of `xs` in one vectorised call and returns an array of outputs
+    # `xs` is either a (k, n) matrix of 0/1 values or, if its dtype is uint64, a (k, m) matrix of packed words.
+    # Packed rows cover words [word_offset, word_offset+m) of the input, all other input bits are taken to be 0.
+    def query_many(self, xs:np.ndarray, word_offset:int=0)->np.ndarray:
+        xs = np.atleast_2d(np.asarray(xs))
+        if self._constant:
+            return np.full(xs.shape[0], self._const_val, dtype=np.uint8)
+
+        if xs.dtype != np.uint64:
+            assert(xs.shape[1] == self.__n)
+            xs = pack_bits(xs)
+            word_offset = 0
+        assert(0 <= word_offset and word_offset + xs.shape[1] <= self.n_words())
+
+        window = self.__words[word_offset:word_offset+xs.shape[1]]
+        return (popcount64(xs & window).sum(axis=1) & 1).astype(np.uint8)
+
+    def len(self):
+        return self.__n
+
+    def n_words(self):
+        return len(self.__words)
+
 
 # Finds the secret control string, `a,`` for the given oracle. [Oracle should not be constant]
 def bv_find(ora:Oracle):
+    if isinstance(ora, PackedOracle):
+        return bv_find_packed(ora)
+
     l = ora.len()
     a = ""
     for i in range(l):
@@ -43,17 +130,88 @@ def bv_find(ora:Oracle):
 
     return a, l
 
+# Finds the secret of a packed oracle with the same n single-bit queries as `bv_find`.
+# Each query has only one non-zero word, so queries are made in blocks of words with vectorised calls.
+def bv_find_packed(ora:PackedOracle):
+    l = ora.len()
+    n_words = ora.n_words()
+    bits = np.zeros(n_words*WORD_BITS, dtype=np.uint8) # Secret bits, least significant first
+
+    word_probes = np.uint64(1) << np.arange(WORD_BITS, dtype=np.uint64)
+    for start in range(0, n_words, BV_BLOCK_WORDS):
+        m = min(BV_BLOCK_WORDS, n_words - start)
+        # Query x with a single 1 in bit position p for every p in the block (no queries on padding bits)
+        k = min(m*WORD_BITS, l - start*WORD_BITS)
+        rows = np.arange(k)
+        xs = np.zeros((k, m), dtype=np.uint64)
+        xs[rows, rows // WORD_BITS] = word_probes[rows % WORD_BITS]
+        bits[start*WORD_BITS:start*WORD_BITS+k] = ora.query_many(xs, word_offset=start)
+
+    a = (bits[:l][::-1] + ord('0')).tobytes().decode("ascii")
+    return a, l
+
 # Checks to see if the oracle is balanced or constant, returns true if constant 
 # Also returns number of cycles taken to find if constant or not
-def dj_find_constant(ora:Oracle):
+# Candidates are queried in blocks of `chunk` inputs so memory stays bounded, stopping at the first block with a mismatch.
+# If `samples` is given, only that many random inputs are checked instead (see `dj_sample_constant`).
+# String oracles are converted to packed oracles so that every block is queried in one vectorised call.
+def dj_find_constant(ora:Oracle, chunk:int=DJ_CHUNK, samples:int=None, seed=None):
+    if isinstance(ora, Oracle):
+        ora = ora.packed()
+    if samples != None:
+        is_constant, queries, _ = dj_sample_constant(ora, samples, chunk=chunk, seed=seed)
+        return is_constant, queries
+
     l = ora.len()
-    half_vals = int(((2**l)/2)) + 1 # Must check at least half all posibe values plus 1 more to detemrine if function is constant
-    ref = ora.query('0' * l)
-    for i in range(1, half_vals):
-        # Construct query string 
-        x = bin(i)[2:].zfill(l)
-        if ora.query(x) != ref:
+    half_vals = 2**(l-1) + 1 # Must check at least half all posibe values plus 1 more to detemrine if function is constant
+    ref = query_ints(ora, 0, 1)[0]
+    for start in range(1, half_vals, chunk):
+        stop = min(start + chunk, half_vals)
+        mismatches = np.flatnonzero(query_ints(ora, start, stop) != ref)
+        if len(mismatches) > 0:
+            i = start + int(mismatches[0])
             return False, i+1
     
     # No alternate value has been found, function cannot be balanced so must be constant
-    return True, half_vals
\ No newline at end of file
+    return True, half_vals
+
+# Randomised version of `dj_find_constant` that compares `k` uniformly sampled inputs against the all 0 input.
+# Returns (is_constant, queries, error_bound) where error_bound is the highest possible probability that
+# a balanced oracle was reported as constant (2^-k). A balanced result is always correct so its bound is 0.
+def dj_sample_constant(ora:Oracle, k:int, chunk:int=DJ_CHUNK, seed=None):
+    if isinstance(ora, Oracle):
+        ora = ora.packed()
+    rng = np.random.default_rng(seed)
+    ref = query_ints(ora, 0, 1)[0]
+    for start in range(0, k, chunk):
+        m = min(chunk, k - start)
+        mismatches = np.flatnonzero(query_random(ora, rng, m) != ref)
+        if len(mismatches) > 0:
+            return False, start + int(mismatches[0]) + 2, 0.0
+    
+    # Each sample of a balanced oracle matches the reference with probability 1/2
+    return True, k+1, 0.5**k
+
+# Queries the oracle with every int in [start, stop) (big endian like bin(i)) and returns an array of outputs
+def query_ints(ora:Oracle, start:int, stop:int)->np.ndarray:
+    if isinstance(ora, PackedOracle) and stop <= 2**WORD_BITS:
+        xs = np.arange(start, stop, dtype=np.uint64).reshape(-1, 1)
+        return ora.query_many(xs)
+    if isinstance(ora, PackedOracle):
+        return np.array([ora.query(i) for i in range(start, stop)], dtype=np.uint8)
+
+    l = ora.len()
+    return np.array([ora.query(bin(i)[2:].zfill(l)) for i in range(start, stop)], dtype=np.uint8)
+
+# Queries the oracle with `m` uniformly random inputs and returns an array of outputs
+def query_random(ora:Oracle, rng:np.random.Generator, m:int)->np.ndarray:
+    l = ora.len()
+    if isinstance(ora, PackedOracle):
+        xs = rng.integers(0, 2**WORD_BITS, size=(m, ora.n_words()), dtype=np.uint64, endpoint=False)
+        # Clear the padding bits above the most significant bit of the input
+        top_bits = l - (ora.n_words()-1)*WORD_BITS
+        xs[:, -1] &= np.uint64(2**top_bits - 1)
+        return ora.query_many(xs)
+
+    xs = rng.integers(0, 2, size=(m, l), dtype=np.uint8)
+    return np.array([ora.query((x + ord('0')).tobytes().decode("ascii")) for x in xs], dtype=np.uint8)
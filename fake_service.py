@@ -0,0 +1,153 @@
+# Local stand in for QiskitRuntimeService so that job submission and result loading can be run and tested offline.
+# Backends are qiskit fake devices (real coupling maps and basis gates) and circuits are run on the BasicSimulator.
+# Each backend can be given a simulated queue (FakeQueue) so that pending job counts and job turnaround behave like a
+# shared device, e.g. to test the scheduler (scheduler.py).
+
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from qiskit import QuantumCircuit
+from qiskit.circuit import Qubit
+from qiskit.converters import circuit_to_dag, dag_to_circuit
+from qiskit.providers.basic_provider import BasicSimulator
+from qiskit_ibm_runtime.fake_provider import FakeManilaV2, FakeNairobiV2, FakeGuadalupeV2, FakeKolkataV2
+
+# Job returned by a fake backend, with the parts of the RuntimeJob interface used by this project
+# The job is reported as running until the time `ready` (seconds since the epoch) when it leaves the backend's queue
+class FakeJob:
+    def __init__(self, job, backend_name:str, ready:float=0.0):
+        self._job = job
+        self.backend_name = backend_name
+        self.ready = ready
+        self.tags = []
+        self.creation_date = datetime.now()
+
+    def job_id(self):
+        return self._job.job_id()
+
+    def update_tags(self, tags:list[str]):
+        self.tags = list(tags)
+
+    def done(self):
+        return time.time() >= self.ready and self._job.done()
+
+    def status(self):
+        if time.time() < self.ready:
+            return "QUEUED"
+        return self._job.status()
+
+    def result(self):
+        time.sleep(max(0.0, self.ready - time.time()))
+        return self._job.result()
+
+    # Timestamps in the same form as RuntimeJob.metrics(), the job finishes when it leaves the queue
+    def metrics(self)->dict:
+        finished = max(self.ready, self.creation_date.timestamp())
+        return {"timestamps": {"created": self.creation_date.astimezone(timezone.utc).isoformat(),
+                               "finished": datetime.fromtimestamp(finished, timezone.utc).isoformat() if self.done() else None}}
+
+# Simulated queue of a shared backend: `pending` jobs from other users are already waiting and every job takes
+# `job_seconds` to run, so jobs submitted to a busy queue finish later. Setting `operational` to False makes the
+# backend report that it is down, e.g. for maintenance
+class FakeQueue:
+    def __init__(self, pending:int=0, job_seconds:float=0.0, operational:bool=True):
+        self.operational = operational
+        self.set(pending, job_seconds)
+
+    # Replaces the queue with `pending` waiting jobs, e.g. to test how the scheduler reacts to a queue changing
+    def set(self, pending:int, job_seconds:float=None):
+        if job_seconds != None:
+            self.job_seconds = job_seconds
+        self.free = time.time() + pending * self.job_seconds   # When the last job in the queue finishes
+
+    # Adds a job to the end of the queue, returns the time it finishes
+    def add(self)->float:
+        self.free = max(time.time(), self.free) + self.job_seconds
+        return self.free
+
+    # Jobs waiting or running, including this project's
+    def pending_jobs(self)->int:
+        if self.job_seconds <= 0:
+            return 0
+        return max(0, math.ceil((self.free - time.time()) / self.job_seconds))
+
+# The parts of the backend status used by this project
+class FakeStatus:
+    def __init__(self, backend_name:str, pending_jobs:int, operational:bool=True):
+        self.backend_name = backend_name
+        self.pending_jobs = pending_jobs
+        self.operational = operational
+        self.status_msg = "active" if operational else "maintenance"
+
+# Wraps a qiskit fake device so that jobs are recorded by the service and only the used qubits are simulated
+class FakeBackend:
+    def __init__(self, backend, service, queue:FakeQueue=None):
+        self._backend = backend
+        self._service = service
+        self.queue = queue or FakeQueue()
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+    def __str__(self):
+        return "<FakeBackend('" + self._backend.name + "')>"
+
+    def status(self)->FakeStatus:
+        return FakeStatus(self._backend.name, self.queue.pending_jobs(), self.queue.operational)
+
+    def run(self, circuits, shots:int=4000):
+        if isinstance(circuits, QuantumCircuit):
+            circuits = [circuits]
+        circuits = [strip_idle_qubits(qc) for qc in circuits]
+        job = FakeJob(BasicSimulator().run(circuits, shots=shots), self._backend.name, self.queue.add())
+        self._service.add_job(job)
+        return job
+
+# Offline replacement for QiskitRuntimeService (see set_service.get_service)
+# `latency` adds a delay (in seconds) to each job lookup to stand in for network round trips
+# `failures` is the number of job lookups that raise an error before lookups succeed, to test retries
+# `queues` maps backend names to their simulated queues (backends left out have no queue and run jobs straight away)
+class FakeService:
+    def __init__(self, backends:list=None, latency:float=0.0, failures:int=0, queues:dict=None):
+        if backends == None:
+            backends = [FakeManilaV2(), FakeNairobiV2(), FakeGuadalupeV2(), FakeKolkataV2()]
+        queues = queues or {}
+        self._backends = {b.name: FakeBackend(b, self, queues.get(b.name)) for b in backends}
+        self._jobs = {}
+        self.latency = latency
+        self.failures = failures
+        self._lock = threading.Lock()
+
+    def add_job(self, job:FakeJob):
+        self._jobs[job.job_id()] = job
+
+    def backends(self, simulator:bool=False, operational:bool=True, min_num_qubits:int=0, **kwargs):
+        return [b for b in self._backends.values() if b.num_qubits >= min_num_qubits]
+
+    def backend(self, name:str):
+        return self._backends[name]
+
+    def get_backend(self, name:str):
+        return self.backend(name)
+
+    # The device with the fewest pending jobs, ties go to the smallest device with enough qubits
+    def least_busy(self, simulator:bool=False, operational:bool=True, min_num_qubits:int=0, **kwargs):
+        return min(self.backends(min_num_qubits=min_num_qubits), key=lambda b: (b.queue.pending_jobs(), b.num_qubits))
+
+    def job(self, job_id:str)->FakeJob:
+        time.sleep(self.latency)
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("Fake service lookup failed")
+        return self._jobs[job_id]
+
+# Removes qubits with no operations from a (transpiled) circuit so it can be simulated on a small dense simulator
+def strip_idle_qubits(qc:QuantumCircuit)->QuantumCircuit:
+    dag = circuit_to_dag(qc)
+    dag.remove_all_ops_named("barrier")
+    idle = [wire for wire in dag.idle_wires() if isinstance(wire, Qubit)]
+    dag.remove_qubits(*idle)
+    return dag_to_circuit(dag)
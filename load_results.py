@@ -1,40 +1,171 @@
 # Script used to load and display results from runs on quantum computers
+import time
+from datetime import datetime
 from sys import argv
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 from set_service import get_service
-from save_job import load_job_datas
-from write_results import save_result, write_to_csv, ResultData
+import render_queue
+import tracing
+import result_cache
+from save_job import load_job_datas, set_job_state, unfinished_placements, save_placements_finished, JobData, PENDING, QUEUED, DONE, INGESTED, FAILED
+from write_results import save_results, ResultData
+
+FAILED_STATUSES = ["ERROR", "CANCELLED", "FAILED"] # Job statuses that will never give results
+WORKERS = 8         # Number of jobs polled and downloaded at the same time
+CALL_TIMEOUT = 120  # Seconds to wait for a single call to the service
+RETRIES = 3         # Number of times a failed or timed out call is retried
+BACKOFF = 1.0       # Seconds to wait before the first retry, doubled for each retry after that
+CALL_WORKERS = 32   # Fewest threads shared by all calls to the service (a call that hangs keeps its thread until it returns)
 
 # Retrieves jobs from qiskit and writes data for all results
-def save_loaded_results(n:int = None, backend:str = None, tag:str = None):
+# Only jobs whose results have not been saved yet are loaded unless `reload` is True
+# Jobs are polled and downloaded by `workers` threads but results are saved in order by this thread only
+# `service` can be given to use something other than the saved IBM account (e.g. fake_service.FakeService)
+def save_loaded_results(n:int = None, backend:str = None, tag:str = None, service = None, reload:bool = False, workers:int = WORKERS):
 
-    # Load job datas from local file
-    job_datas = load_job_datas(n,backend,tag)
+    # Load job datas from the job ledger
+    states = None if reload else PENDING
+    job_datas = load_job_datas(n,backend,tag,states)
 
     if len(job_datas) == 0:
-        print("No jobs found.")
+        print("No jobs found." if reload else "No new jobs found.")
         return
 
     # Load credentials
-    service = get_service()
-    print("Credentials loaded.")
+    if service == None:
+        service = get_service()
+        print("Credentials loaded.")
     
+    # Jobs with several circuits only need to be loaded once
+    job_groups = {}
     for job_data in job_datas:
+        job_groups.setdefault(job_data.job_id, []).append(job_data)
 
-        # Load job from IBM qiksit
-        job = service.job(job_data.job_id)
+    result_datas = [] # Saved together at the end in one batch
+    ingested = []
+    failed = []
+    done_jobs = []
+    get_call_executor(workers) # Every worker can be waiting on a call at once
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        fetched = pool.map(lambda job_id: fetch_job(service, job_id), job_groups.keys())
+        for (job_id, group), (job, state, result) in zip(job_groups.items(), fetched):
+            if state == DONE:
+                done_jobs.append(job)
+            for job_data in group:
+                if state == None:
+                    print(job_data.backend + "(" + job_data.secret + ") could not be loaded: " + str(result))
+                elif state == FAILED:
+                    print(job_data.backend + "(" + job_data.secret + ") created: " + str(job.creation_date) + " failed.")
+                    failed.append(job_data)
+                elif state == DONE:
+                    # Save result data
+                    result_data = job_result_data(job_data, result)
 
-        if job.done():
-            # Save result data
-            counts = job.result().get_counts()
-            result_data = ResultData(job_data.backend, job_data.secret, job_data.shots, counts, tag=job_data.tag)
+                    # Print output for user feedback
+                    print(result_data.backend + "(" + result_data.secret + ") created: " + str(job.creation_date) + " ran with accuracy " + str(result_data.accuracy()))
+                    result_datas.append(result_data)
+                    ingested.append(job_data)
+                    tracing.count("results")
+                    tracing.count("shots_loaded", job_data.shots)
+                else:
+                    print(job_data.backend + "(" + job_data.secret + ") created: " + str(job.creation_date) + " is not done.")
+        save_finished_times(done_jobs, pool)
 
-            # Print output for user feedback
-            print(result_data.backend + "(" + result_data.secret + ") created: " + str(job.creation_date) + " ran with accuracy " + str(result_data.accuracy()))
-            save_result(result_data)
-            print("Saved results.\n")
-        else:
-            print(job_data.backend + "(" + job_data.secret + ") created: " + str(job.creation_date) + " is not done.")
+    # Jobs are marked done first so a failure while saving leaves them to be loaded again next time
+    set_job_state(ingested, DONE)
+    save_results(result_datas)
+    set_job_state(ingested, INGESTED)
+    set_job_state(failed, FAILED)
+    result_cache.drop_failed_jobs([job_data.job_id for job_data in failed])
+    print("Saved " + str(len(result_datas)) + " results.")
+
+# Records when jobs placed by the scheduler (see scheduler.py) finished on their backend, to estimate its throughput
+def save_finished_times(jobs:list, pool:ThreadPoolExecutor):
+    placed = unfinished_placements([job.job_id() for job in jobs])
+    jobs = [job for job in jobs if job.job_id() in placed]
+    finished = pool.map(job_finished_time, jobs)
+    save_placements_finished([(job.job_id(), when) for job, when in zip(jobs, finished) if when != None])
+
+# Returns when the job finished running (seconds since the epoch) from the job's metrics, None if they can not be read
+def job_finished_time(job)->float:
+    try:
+        finished = call_with_retry(job.metrics)["timestamps"]["finished"]
+        return datetime.fromisoformat(finished.replace("Z", "+00:00")).timestamp()
+    except Exception:
+        return None
+
+# Returns the result of the job's secret from the job's result
+def job_result_data(job_data:JobData, result)->ResultData:
+    if job_data.index == None:
+        counts = result.get_counts()
+    else:
+        counts = result.get_counts(job_data.index)
+    result_id = job_data.job_id if job_data.index == None else job_data.job_id + "_" + str(job_data.index)
+    if job_data.slot != None:
+        # Several secrets were packed in the circuit, keep only this secret's register
+        from packing import split_counts # Only imported when needed as it imports the transpiler
+        counts = split_counts(counts, job_data.slot)
+        result_id += "_c" + str(job_data.slot)
+    result_cache.add_loaded_counts(job_data.job_id, job_data.secret, counts)
+    return ResultData(job_data.backend, job_data.secret, job_data.shots, counts, id=result_id, tag=job_data.tag)
+
+# Loads a job from the service and downloads its result if it is done
+# Returns (job, state, result) where state is DONE, FAILED, QUEUED or None if the service could not be reached
+# (in which case result is the error)
+@tracing.timed()
+def fetch_job(service, job_id:str):
+    try:
+        with tracing.span("service.job"):
+            job = call_with_retry(lambda: service.job(job_id))
+        with tracing.span("job.status"):
+            if call_with_retry(lambda: job_failed(job)):
+                return job, FAILED, None
+            if not call_with_retry(job.done):
+                return job, QUEUED, None
+        with tracing.span("job.result"):
+            result = call_with_retry(job.result)
+        tracing.count("jobs_downloaded")
+        return job, DONE, result
+    except Exception as e:
+        return None, None, e
+
+_calls = None       # Executor running calls to the service, shared by every thread
+_call_workers = 0   # Threads of _calls
+_calls_lock = Lock()
+
+# Returns the executor for calls to the service, replacing it with a larger one if it has fewer than `workers` threads
+# (calls already running on the old executor carry on). Call with the number of threads that will make calls at once
+# before starting them.
+def get_call_executor(workers:int = CALL_WORKERS)->ThreadPoolExecutor:
+    global _calls, _call_workers
+    with _calls_lock:
+        if _calls == None or _call_workers < workers:
+            if _calls != None:
+                _calls.shutdown(wait=False)
+            _call_workers = max(CALL_WORKERS, workers)
+            _calls = ThreadPoolExecutor(max_workers=_call_workers, thread_name_prefix="service_call")
+    return _calls
+
+# Calls fn, retrying with exponential backoff if it raises an error or takes longer than `timeout` seconds
+def call_with_retry(fn, timeout:float = CALL_TIMEOUT, retries:int = RETRIES, backoff:float = BACKOFF):
+    for attempt in range(retries+1):
+        # Run the call on another thread so that a call that hangs can be abandoned
+        future = get_call_executor().submit(fn)
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            future.cancel() # Only stops calls that have not started yet
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt)
+
+# Returns True if the job failed or was cancelled
+def job_failed(job)->bool:
+    status = job.status()
+    status = getattr(status, "name", str(status)).upper()
+    return status in FAILED_STATUSES
 
 def print_instructions():
     print("Usage: ", argv[0]," <options>")
@@ -44,12 +175,18 @@ def print_instructions():
     print("-n <int> \t\tNumber of bits\t\t[Default = any]")
     print("-b <backend_name> \tSpecify quantum backend\t[Default = any]")
     print("-t <tag> \tSpecify a tag that the jobs should have\t[Default = any]")
+    print("-w <int> \t\tNumber of jobs to load at the same time\t[Default = " + str(WORKERS) + "]")
+    print("--render <mode> \tDraw figures now (sync), in background processes, or later with render_queue.py\t[Default = sync]")
+    print("-a, --all \t\tReload results for all matching jobs, not only new ones")
+    print("--trace <file> \tTime each stage and save a trace (Chrome format, or one JSON object per line for .jsonl files)")
 
 if __name__ == "__main__":
     n = None
     backend = None
     help_flag = False
     tags = None
+    reload = False
+    workers = WORKERS
     # Process arguments
     skip_flag = False
     for i in range(1, len(argv)):
@@ -65,6 +202,17 @@ if __name__ == "__main__":
             print("Version 1.0")
             help_flag = True
             break
+        elif opt == "-a" or opt == "--all":
+            reload = True
+        elif opt == "--trace":
+            tracing.enable(argv[i+1])
+            skip_flag = True
+        elif opt == "--render":
+            render_queue.MODE = argv[i+1]
+            skip_flag = True
+        elif opt == "-w" or opt == "--workers":
+            workers = int(argv[i+1])
+            skip_flag = True
         elif opt == "-n":
             n = int(argv[i+1])
             skip_flag = True
@@ -78,8 +226,8 @@ if __name__ == "__main__":
             print("Option ", opt, " is not defined.")
     if not help_flag:
         if tags == None:
-            save_loaded_results(n=n,backend=backend)
+            save_loaded_results(n=n,backend=backend,reload=reload,workers=workers)
         else:
             for tag in tags:
-                save_loaded_results(n=n,backend=backend,tag=tag)
+                save_loaded_results(n=n,backend=backend,tag=tag,reload=reload,workers=workers)
 
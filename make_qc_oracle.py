@@ -1,46 +1,230 @@
 # Contains code to create a qiskit quantum circuit object for and oracle to be used in bv (or dj) testing
 # Code was written with reference to the IBM repo: https://github.com/qiskit-community/qiskit-community-tutorials/blob/master/algorithms/bernstein_vazirani.ipynb
 
-from qiskit import QuantumCircuit
+from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+from qiskit.circuit import CircuitInstruction
+from qiskit.circuit.library import CXGate
+
+# Oracle constructions, all give the same phase oracle
+LINEAR = "linear"       # One CX from each set bit to the ancilla (depth grows with the number of set bits)
+TREE = "tree"           # Parity of the set bits gathered by a tree of CXs, depth O(log w) for w set bits
+COUPLING = "coupling"   # Parity gathered along a spanning tree of the device coupling map, so every CX is between neighbours
+VARIANTS = [LINEAR, TREE, COUPLING]
 
 # Adds appropriate gates to construct a quantum oracle controlled by the given secrete to qc
 # It is assumed that qc has the correct number of qubits and classical bit
 # secret number should be in big endian notation
-def add_secret_oracle(qc:QuantumCircuit, secret: str):
-    # iterate through secret from LSB to MSB
-    for i, bin_digit in enumerate(reversed(secret)):
-        if bin_digit == '1':
-            qc.cx(i,len(secret)) # The bit after the secret number will be the oracle output
+# `variant` picks the construction (see above). COUPLING needs the device's `coupling_map` (list of physical qubit pairs)
+# and the `layout` of the circuit's qubits on the device (layout[i] is the physical qubit of circuit qubit i)
+def add_secret_oracle(qc:QuantumCircuit, secret: str, variant:str = LINEAR, coupling_map:list = None, layout:list = None):
+    n = len(secret) # The bit after the secret number will be the oracle output
+    ones = [i for i, bin_digit in enumerate(reversed(secret)) if bin_digit == '1']
+    if variant == LINEAR:
+        # iterate through secret from LSB to MSB
+        for i in ones:
+            qc.cx(i, n)
+        return qc
+    elif variant == TREE:
+        cxs = parity_tree_cxs(ones)
+        root = ones[:1]
+    elif variant == COUPLING:
+        if coupling_map == None:
+            raise ValueError("The coupling oracle needs a coupling map")
+        cxs = coupling_tree_cxs(ones, n, coupling_map, layout)
+        root = [] # The tree ends in CXs into the ancilla
+    else:
+        raise ValueError("Unknown oracle variant: " + variant)
 
+    # Gather the parity, kick it back as a phase from the ancilla, then undo the gathering
+    for control, target in cxs:
+        qc.cx(control, target)
+    for control in root:
+        qc.cx(control, n)
+    for control, target in reversed([cx for cx in cxs if cx[1] != n]):
+        qc.cx(control, target)
     return qc
 
+# CXs that gather the parity of the given qubits onto the first of them, pairing qubits up in each round
+def parity_tree_cxs(qubits:list[int])->list[tuple]:
+    cxs = []
+    level = list(qubits)
+    while len(level) > 1:
+        cxs += [(level[k+1], level[k]) for k in range(0, len(level)-1, 2)]
+        level = level[::2]
+    return cxs
+
+# CXs that gather the parity of the `ones` qubits along a breadth first spanning tree of the coupling map rooted at
+# the ancilla, so every CX is between neighbouring physical qubits. A qubit that is not in `ones` but passes on its
+# children's parity sends its own value to its parent twice (before and after its children), which cancels out.
+# Circuit qubit i is on physical qubit layout[i] (circuit qubits are physical qubits if no layout is given)
+def coupling_tree_cxs(ones:list[int], ancilla:int, coupling_map:list, layout:list = None)->list[tuple]:
+    layout = list(range(ancilla+1)) if layout == None else layout
+    circuit_qubit = {physical: i for i, physical in enumerate(layout)}
+    neighbours = {i: [] for i in circuit_qubit.values()}
+    for a, b in coupling_map:
+        if a in circuit_qubit and b in circuit_qubit and circuit_qubit[b] not in neighbours[circuit_qubit[a]]:
+            neighbours[circuit_qubit[a]].append(circuit_qubit[b])
+            neighbours[circuit_qubit[b]].append(circuit_qubit[a])
+
+    parent = {ancilla: None}
+    order = [ancilla]
+    for q in order:
+        for nb in sorted(neighbours[q]):
+            if nb not in parent:
+                parent[nb] = q
+                order.append(nb)
+    if any(q not in parent for q in ones):
+        raise ValueError("The secret's qubits are not connected to the ancilla on the coupling map")
+
+    # Qubits whose subtree contains a set bit
+    needed = set()
+    for q in ones:
+        while q != ancilla and q not in needed:
+            needed.add(q)
+            q = parent[q]
+    # Relays first send their own value (parents before children, so each still holds only its own value),
+    # then every qubit sends its value to its parent once its children have sent theirs (deepest first)
+    relays = [q for q in order if q in needed and q not in ones]
+    senders = [q for q in reversed(order) if q in needed]
+    return [(q, parent[q]) for q in relays] + [(q, parent[q]) for q in senders]
+
+# Shared parts of all test circuits with an n-bit secret. Only the oracle CX gates differ between secrets,
+# so the rest of the circuit is built once and each secret's circuit is stamped out from it.
+class SecretTestTemplate:
+    def __init__(self, n:int):
+        self.n = n
+
+        # Create appropratle sized quatum circuit
+        self.head = QuantumCircuit(n+1,n)
+        # Place H-gates on all oracle inputs
+        self.head.h(range(n))
+        # Add and X-gate and H-gate to oracle output qibit
+        self.head.x(n)
+        self.head.h(n)
+
+        self.head.barrier()
+
+        # One oracle CX for each possible secret bit, from LSB to MSB
+        cx = CXGate()
+        self.oracle_cxs = [CircuitInstruction(cx, (self.head.qubits[i], self.head.qubits[n])) for i in range(n)]
+
+        tail = QuantumCircuit(n+1,n)
+        tail.barrier()
+        # place H-gates on output
+        tail.h(range(n))
+        tail.barrier()
+        # Measure quantum and classical register
+        tail.measure(range(n),range(n))
+        self.tail = list(tail.data)
+
+    # Builds the test circuit for the given secret (big endian binary string of length n)
+    # with the given oracle variant (arguments as for add_secret_oracle)
+    def build(self, secret:str, variant:str = LINEAR, coupling_map:list = None, layout:list = None)->QuantumCircuit:
+        assert(len(secret) == self.n)
+        qc = self.head.copy()
+        if variant == LINEAR:
+            # Instructions are prebuilt for this circuit's bits so qiskit's checks can be skipped
+            for i, bin_digit in enumerate(reversed(secret)):
+                if bin_digit == '1':
+                    qc._append(self.oracle_cxs[i])
+        else:
+            add_secret_oracle(qc, secret, variant, coupling_map, layout)
+        for inst in self.tail:
+            qc._append(inst)
+        return qc
+
+_templates = {} # SecretTestTemplate for each secret length used so far
+
+# Returns the (cached) test circuit template for n-bit secrets
+def get_template(n:int)->SecretTestTemplate:
+    if not n in _templates:
+        _templates[n] = SecretTestTemplate(n)
+    return _templates[n]
+
 # Creates a qiskit quantum circuit used to test a quantum oracle with the following secret
 # secret should be given as a binary string in bin endian format 
-def secret_test_qc(secret:str):
+# `variant` picks the oracle construction (see add_secret_oracle)
+def secret_test_qc(secret:str, variant:str = LINEAR, coupling_map:list = None, layout:list = None):
+    return get_template(len(secret)).build(secret, variant, coupling_map, layout)
 
-    # The number of inputs to oracle 
+# Creates test circuits for many secrets, in the same order as the secrets are given
+def secret_test_qcs(secrets, variant:str = LINEAR, coupling_map:list = None, layout:list = None)->list[QuantumCircuit]:
+    return [secret_test_qc(secret, variant, coupling_map, layout) for secret in secrets]
+
+# Number of two qubit gates in a circuit
+def two_qubit_gates(qc:QuantumCircuit)->int:
+    return sum(1 for inst in qc.data if inst.operation.num_qubits == 2 and inst.operation.name != "barrier")
+
+# Returns the placement of the test circuit for an n-bit secret on a backend used by the COUPLING variant:
+# a compact connected region of the device with the ancilla at its centre (layout[i] is the device qubit of circuit qubit i)
+# and the device's coupling map, or (None, None) if there is no backend
+def device_layout(n:int, backend=None)->tuple:
+    if backend == None:
+        return None, None
+    from packing import find_region # Only imported when needed as packing imports this module
+    coupling_map = [tuple(edge) for edge in backend.target.build_coupling_map().get_edges()]
+    region = find_region(coupling_map, backend.num_qubits, n+1, set())
+    if region == None:
+        raise ValueError("No connected group of " + str(n+1) + " qubits on " + backend.name)
+    return region[1:] + region[:1], coupling_map
+
+# Returns the depth and two qubit gate count of the test circuit for the secret with each oracle variant, as a list of
+# (variant, depth, two qubit gates). With a backend the circuits are transpiled for it, all placed on the same qubits.
+# Without one the COUPLING variant assumes qubits are connected in a line with the ancilla at the end.
+def oracle_report(secret:str, backend=None, variants:list[str] = VARIANTS, seed:int = 0)->list[tuple]:
     n = len(secret)
-    # Create appropratle sized quatum circuit
-    qc = QuantumCircuit(n+1,n)
-    # Place H-gates on all oracle inputs
+    layout, coupling_map = device_layout(n, backend)
+    report = []
+    for variant in variants:
+        if variant == COUPLING and backend == None:
+            qc = secret_test_qc(secret, variant, [(i, i+1) for i in range(n)])
+        else:
+            qc = secret_test_qc(secret, variant, coupling_map, layout)
+        if backend != None:
+            from qiskit import transpile # Imported here as transpiling is only needed for a backend
+            qc = transpile(qc, backend, initial_layout=layout, seed_transpiler=seed)
+        report.append((variant, qc.depth(), two_qubit_gates(qc)))
+    return report
+
+# Returns the oracle variant giving the shallowest test circuit for the secret (fewest two qubit gates on a tie)
+def best_oracle(secret:str, backend=None, variants:list[str] = VARIANTS)->str:
+    return min(oracle_report(secret, backend, variants), key=lambda row: (row[1], row[2]))[0]
+
+# Creates one circuit testing several secrets that share a single oracle output (ancilla) qubit.
+# The ancilla stays in the |-> state, so each secret's oracle only adds a phase to its own input qubits.
+# Secret j is measured into classical register "c<j>" (its inputs follow those of the secrets before it and the ancilla is last)
+def shared_ancilla_test_qc(secrets:list[str])->QuantumCircuit:
+    n = sum(len(secret) for secret in secrets)
+    cregs = [ClassicalRegister(len(secret), "c" + str(j)) for j, secret in enumerate(secrets)]
+    qc = QuantumCircuit(QuantumRegister(n+1, "q"), *cregs)
     qc.h(range(n))
-    # Add and X-gate and H-gate to oracle output qibit
     qc.x(n)
     qc.h(n)
-
     qc.barrier()
-
-    # Place oracle on secret
-    qc = add_secret_oracle(qc, secret)
-
+    offset = 0
+    for secret in secrets:
+        for i, bin_digit in enumerate(reversed(secret)):
+            if bin_digit == '1':
+                qc.cx(offset+i, n)
+        offset += len(secret)
     qc.barrier()
-
-    # place H-gates on output
     qc.h(range(n))
-
     qc.barrier()
+    offset = 0
+    for secret, creg in zip(secrets, cregs):
+        qc.measure(range(offset, offset+len(secret)), creg)
+        offset += len(secret)
+    return qc
 
-    # Measure quantum and classical register
-    qc.measure(range(n),range(n))
-
-    return qc
\ No newline at end of file
+# Prints the depth and two qubit gate count of each oracle variant for a secret, optionally transpiled for a qiskit fake backend
+# Usage: python make_qc_oracle.py <secret> [<fake-backend-name>]
+if __name__ == "__main__":
+    from sys import argv
+    backend = None
+    if len(argv) > 2:
+        from qiskit_ibm_runtime import fake_provider # Only imported when needed as qiskit_ibm_runtime is slow to import
+        backend = getattr(fake_provider, argv[2])()
+    print("oracle, depth, two_qubit_gates")
+    for row in oracle_report(argv[1], backend):
+        print(*row, sep=", ")
+    print("Best:", best_oracle(argv[1], backend))
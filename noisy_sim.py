@@ -0,0 +1,132 @@
+# Fast noisy simulator for offline accuracy studies of BV circuits (and other circuits supported by stabilizer_sim).
+# Noise is modelled with readout errors, depolarizing errors after each CX (and optionally after single qubit gates)
+# and, if a device coupling map is given, extra CX error for qubits that are not connected (standing in for SWAPs).
+#
+# All shots are simulated together as Pauli frames: arrays of X and Z error bits with one row per shot.
+# Frames are pushed through the circuit gate by gate and the X part at each measurement gives the flipped outputs,
+# which are applied to a noiseless reference sample from stabilizer_sim.
+
+import numpy as np
+from qiskit import QuantumCircuit
+
+import stabilizer_sim
+
+NAME = "noisy_simulator"
+
+# Error rates used by the noisy simulator
+# `coupling_map` is a list of connected physical qubit pairs and `layout` maps circuit qubits to physical qubits
+class NoiseModel:
+    def __init__(self, readout_error:float=0.02, cx_error:float=0.01, sq_error:float=0.0, coupling_map:list=None, layout:list=None, name:str=NAME):
+        self.readout_error = readout_error
+        self.cx_error = cx_error
+        self.sq_error = sq_error
+        self.coupling_map = coupling_map
+        self.layout = layout
+        self.name = name
+        self._distances = None
+
+    # Builds a noise model with the average error rates and the coupling map of a qiskit backend (e.g. a fake device)
+    @classmethod
+    def from_backend(cls, backend, layout:list=None):
+        target = backend.target
+        readout = [props.error for props in target["measure"].values() if props != None and props.error != None]
+        two_qubit = "cx" if "cx" in target else "ecr" if "ecr" in target else "cz"
+        cx = [props.error for props in target[two_qubit].values() if props != None and props.error != None]
+        sq = [props.error for props in target["sx"].values() if props != None and props.error != None] if "sx" in target else []
+        coupling_map = [list(edge) for edge in target.build_coupling_map().get_edges()]
+        return cls(float(np.mean(readout)) if len(readout) > 0 else 0.0,
+                   float(np.mean(cx)) if len(cx) > 0 else 0.0,
+                   float(np.mean(sq)) if len(sq) > 0 else 0.0,
+                   coupling_map, layout, NAME + "(" + backend.name + ")")
+
+    # Number of CX gates a CX between two circuit qubits costs on the device: 1 if connected, plus 3 per SWAP otherwise
+    def cx_cost(self, a:int, b:int)->int:
+        if self.coupling_map == None:
+            return 1
+        if self._distances == None:
+            self._distances = _distances(self.coupling_map)
+        if self.layout != None:
+            a, b = self.layout[a], self.layout[b]
+        return 1 + 3*max(0, self._distances[a][b] - 1)
+
+# Simulates the circuit with noise and returns qiskit style counts
+def simulate_counts(qc:QuantumCircuit, shots:int, noise:NoiseModel, seed=None)->dict:
+    rng = np.random.default_rng(seed)
+    ops, measures = stabilizer_sim.instructions(qc)
+    reference = stabilizer_sim.reference_sample(qc, seed=rng.integers(2**32))
+
+    n = qc.num_qubits
+    x = np.zeros((n, shots), dtype=bool)
+    # Random Z frames on |0> change nothing but make random measurement outcomes random across shots
+    z = rng.random((n, shots)) < 0.5
+
+    for name, qubits in ops:
+        if name == "h":
+            a = qubits[0]
+            x[a], z[a] = z[a].copy(), x[a].copy()
+        elif name == "cx":
+            c, t = qubits
+            x[t] ^= x[c]
+            z[c] ^= z[t]
+        elif name == "cz":
+            c, t = qubits
+            z[c] ^= x[t]
+            z[t] ^= x[c]
+        elif name == "swap":
+            a, b = qubits
+            x[[a, b]] = x[[b, a]]
+            z[[a, b]] = z[[b, a]]
+        # X, Y and Z gates only change signs, which are already in the reference sample
+
+        if len(qubits) == 2 and name != "swap":
+            p = 1 - (1 - noise.cx_error)**noise.cx_cost(*qubits)
+            _depolarize(x, z, qubits, p, rng)
+        elif len(qubits) == 1 and noise.sq_error > 0:
+            _depolarize(x, z, qubits, noise.sq_error, rng)
+
+    # An X (or Y) error on a measured qubit flips its output, as does a readout error
+    measured = [q for q, _ in measures]
+    flips = x[measured].T ^ (rng.random((shots, len(measures))) < noise.readout_error)
+    outcomes = flips ^ reference
+
+    rows, freqs = stabilizer_sim.unique_outcomes(outcomes)
+    return stabilizer_sim.counts_from_outcomes(qc, [clbit for _, clbit in measures], rows, freqs)
+
+# Applies a random non-identity Pauli to the qubits (all together) with probability p, independently for each shot
+def _depolarize(x, z, qubits:list, p:float, rng):
+    if p <= 0:
+        return
+    shots = x.shape[1]
+    hit = np.flatnonzero(rng.random(shots) < p)
+    if len(hit) == 0:
+        return
+    k = len(qubits)
+    # Pauli index 1..4^k-1, two bits (x, z) per qubit
+    paulis = rng.integers(1, 4**k, size=len(hit))
+    for i, q in enumerate(qubits):
+        x[q, hit] ^= ((paulis >> (2*i)) & 1).astype(bool)
+        z[q, hit] ^= ((paulis >> (2*i+1)) & 1).astype(bool)
+
+# All pairs shortest path lengths (in edges) between physical qubits of a coupling map
+def _distances(coupling_map:list)->list[list[int]]:
+    size = max(max(edge) for edge in coupling_map) + 1
+    neighbours = [[] for _ in range(size)]
+    for a, b in coupling_map:
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+
+    distances = []
+    for start in range(size):
+        dist = [size] * size # unreachable qubits are treated as being as far apart as possible
+        dist[start] = 0
+        frontier = [start]
+        while len(frontier) > 0:
+            next_frontier = []
+            for q in frontier:
+                for nb in neighbours[q]:
+                    if dist[nb] > dist[q] + 1:
+                        dist[nb] = dist[q] + 1
+                        next_frontier.append(nb)
+            frontier = next_frontier
+        distances.append(dist)
+    return distances
@@ -0,0 +1,131 @@
+# Packs several BV test circuits side by side on disjoint qubits of one device, so that many small secrets can be
+# run in a single job instead of one job each.
+#
+# Each instance (one secret, or a group of secrets sharing an ancilla) is given a connected region of free qubits
+# on the device's coupling map, with the ancilla at the centre of the region. The instance is transpiled on its
+# region only, so routing never touches another instance's qubits, and the routed instances are combined into one
+# circuit that needs no further transpiling. Secret j of a packed circuit is measured into classical register "c<j>"
+# and `split_counts` recovers its counts from the joint counts of the circuit.
+
+from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister, transpile
+from qiskit.transpiler import CouplingMap
+
+from make_qc_oracle import secret_test_qc, shared_ancilla_test_qc
+
+# A circuit containing several packed instances
+# `secrets` are the indices (in the list given to pack_circuits) of the secrets in each classical register, in order,
+# and `instance_qcs` are the routed instance circuits (on their own region's qubits) each secret belongs to.
+class PackedCircuit:
+    def __init__(self, qc:QuantumCircuit, secrets:list[int], instance_qcs:list[QuantumCircuit], regions:list[list[int]]):
+        self.qc = qc
+        self.secrets = secrets
+        self.instance_qcs = instance_qcs
+        self.regions = regions
+
+# Packs test circuits for all secrets onto as few device circuits as possible
+# `share` secrets are tested with each ancilla (1 gives every secret its own ancilla)
+# `max_instances` limits the instances in each circuit (None packs as many as fit)
+# Returns a list of PackedCircuit ready to be run on the backend
+def pack_circuits(secrets:list[str], backend, share:int=1, max_instances:int=None, seed:int=0)->list[PackedCircuit]:
+    edges = [tuple(edge) for edge in backend.target.build_coupling_map().get_edges()]
+    basis_gates = list(backend.target.operation_names)
+    num_qubits = backend.num_qubits
+
+    groups = [list(range(i, min(i+share, len(secrets)))) for i in range(0, len(secrets), share)]
+    packed = []
+    used = set()
+    instances = [] # (secret indices, routed instance circuit, region) in the circuit being filled
+    for group in groups:
+        size = sum(len(secrets[i]) for i in group) + 1
+        region = None
+        if max_instances == None or len(instances) < max_instances:
+            region = find_region(edges, num_qubits, size, used)
+        if region == None and len(instances) > 0:
+            # The circuit is full, start a new one
+            packed.append(combine(instances, num_qubits))
+            instances = []
+            used = set()
+            region = find_region(edges, num_qubits, size, used)
+        if region == None:
+            raise ValueError("No connected group of " + str(size) + " qubits on " + backend.name)
+
+        used.update(region)
+        instances.append((group, route_instance([secrets[i] for i in group], region, edges, basis_gates, seed), region))
+    if len(instances) > 0:
+        packed.append(combine(instances, num_qubits))
+    return packed
+
+# Finds `size` connected qubits that are not in `used`, as compact as possible
+# Returns the qubits with the centre (used for the ancilla) first, or None if there is no such group
+def find_region(edges:list[tuple], num_qubits:int, size:int, used:set)->list[int]:
+    neighbours = [[] for _ in range(num_qubits)]
+    for a, b in edges:
+        if b not in neighbours[a]:
+            neighbours[a].append(b)
+            neighbours[b].append(a)
+
+    best = None
+    best_score = None
+    for start in range(num_qubits):
+        if start in used:
+            continue
+        # Grow a region outwards from `start`, closest qubits first
+        region = [start]
+        distance = {start: 0}
+        frontier = 0
+        while frontier < len(region) and len(region) < size:
+            for nb in sorted(neighbours[region[frontier]]):
+                if nb not in distance and nb not in used:
+                    distance[nb] = distance[region[frontier]] + 1
+                    region.append(nb)
+                    if len(region) == size:
+                        break
+            frontier += 1
+        if len(region) < size:
+            continue
+        score = sum(distance[q] for q in region)
+        if best == None or score < best_score:
+            best = region
+            best_score = score
+    return best
+
+# Transpiles the test circuit for the secrets on the given region of the device, with the ancilla on the region's centre
+# The returned circuit's qubit i is device qubit region[i]
+def route_instance(secrets:list[str], region:list[int], edges:list[tuple], basis_gates:list[str], seed:int=0)->QuantumCircuit:
+    if len(secrets) == 1:
+        qc = secret_test_qc(secrets[0])
+    else:
+        qc = shared_ancilla_test_qc(secrets)
+    local = {q: i for i, q in enumerate(region)}
+    local_edges = [[local[a], local[b]] for a, b in edges if a in local and b in local]
+    # Circuit qubit n (the ancilla) goes on the centre, the secret's qubits on the rest of the region
+    layout = list(range(1, len(region))) + [0]
+    return transpile(qc, basis_gates=basis_gates, coupling_map=CouplingMap(local_edges), initial_layout=layout, seed_transpiler=seed)
+
+# Combines routed instances into one circuit on all qubits of the device with one classical register per secret
+def combine(instances:list, num_qubits:int)->PackedCircuit:
+    secrets = []
+    instance_qcs = []
+    cregs = []
+    for group, tqc, _ in instances:
+        for i, creg in zip(group, tqc.cregs):
+            cregs.append(ClassicalRegister(creg.size, "c" + str(len(cregs))))
+            secrets.append(i)
+            instance_qcs.append(tqc)
+
+    qc = QuantumCircuit(QuantumRegister(num_qubits, "q"), *cregs)
+    slot = 0
+    for group, tqc, region in instances:
+        clbits = [bit for creg in cregs[slot:slot+len(group)] for bit in creg]
+        qc.compose(tqc, qubits=region, clbits=clbits, inplace=True)
+        slot += len(group)
+    return PackedCircuit(qc, secrets, instance_qcs, [region for _, _, region in instances])
+
+# Returns the counts of the secret measured into classical register `slot` from the joint counts of a packed circuit
+# (qiskit writes each register separated by a space, last register first)
+def split_counts(counts:dict, slot:int)->dict:
+    split = {}
+    for output, freq in counts.items():
+        part = output.split(' ')[-1-slot]
+        split[part] = split.get(part, 0) + freq
+    return split
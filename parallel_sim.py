@@ -0,0 +1,110 @@
+# Validates BV test circuits by local simulation, optionally spread over a pool of worker processes.
+# Secrets are split into chunks; each worker builds and simulates the circuits for a chunk and returns compact
+# results (no circuits), and results are handed back in the same order as the secrets whatever the number of workers.
+# Only the calling process writes results, and a ValidationReport collects every failure instead of stopping at the first.
+
+import os
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 64     # Secrets simulated by a worker at a time
+MAX_AHEAD = 2       # Chunks waiting in the pool for each worker, so long secret streams are not read all at once
+
+# Raised when simulated circuits do not find their secret
+class ValidationError(Exception):
+    pass
+
+# Pass/fail tally of simulated secrets
+class ValidationReport:
+    def __init__(self):
+        self.passed = 0
+        self.failed = []    # (secret, accuracy) of circuits that did not always find the secret
+        self.skipped = []   # Secrets whose circuits were too large to simulate
+
+    def add(self, secret:str, data):
+        if data == None:
+            self.skipped.append(secret)
+        elif data.accuracy() == 1.0:
+            self.passed += 1
+        else:
+            self.failed.append((secret, data.accuracy()))
+
+    def ok(self)->bool:
+        return len(self.failed) == 0
+
+    def summary(self)->str:
+        lines = ["Validation: " + str(self.passed) + " passed, " + str(len(self.failed)) + " failed, " + str(len(self.skipped)) + " skipped"]
+        for secret, accuracy in self.failed:
+            lines.append("  FAILED " + secret + " (accuracy " + str(accuracy) + ")")
+        return "\n".join(lines)
+
+# Simulates the test circuit for each secret and yields (secret, ResultData or None if too large to simulate)
+# in the same order as `secrets`. Results have no circuit attached (qc is None) and keep their counts compact.
+# `workers` is the number of processes (1 simulates in this process, 0 uses every core).
+# With a `seed`, the results do not depend on the number of workers (but do depend on `chunk_size`).
+# With a `cache` (result_cache.ResultCache), secrets simulated before with the same shots are not simulated again
+# and new results are added to it.
+def simulate_secrets(secrets, shots:int=4000, workers:int=1, chunk_size:int=CHUNK_SIZE, method:str="auto", seed:int=None, cache=None):
+    chunks = _chunks(iter(secrets), chunk_size)
+    if workers == 1:
+        for i, chunk in enumerate(chunks):
+            cached, missing = _lookup(cache, chunk, shots)
+            yield from zip(chunk, _merge(cache, cached, simulate_chunk(missing, shots, method, _chunk_seed(seed, i))))
+        return
+
+    workers = os.cpu_count() if workers == 0 else workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for i, chunk in enumerate(chunks):
+            cached, missing = _lookup(cache, chunk, shots)
+            pending.append((chunk, cached, pool.submit(simulate_chunk, missing, shots, method, _chunk_seed(seed, i))))
+            if len(pending) >= workers * MAX_AHEAD:
+                chunk, cached, future = pending.popleft()
+                yield from zip(chunk, _merge(cache, cached, future.result()))
+        while len(pending) > 0:
+            chunk, cached, future = pending.popleft()
+            yield from zip(chunk, _merge(cache, cached, future.result()))
+
+# Builds and simulates the circuits for a list of secrets (run in the worker processes)
+def simulate_chunk(secrets:list[str], shots:int, method:str="auto", seed=None)->list:
+    import numpy as np
+    from make_qc_oracle import secret_test_qc
+    from run_bv import run_local_sim
+    rng = np.random.default_rng(seed)
+    results = []
+    for secret in secrets:
+        data = run_local_sim(secret_test_qc(secret), secret, shots, method, seed=int(rng.integers(2**32)))
+        if data != None:
+            data.qc = None # Circuits are rebuilt by the caller if needed rather than sent between processes
+            data.compact()
+        results.append(data)
+    return results
+
+# Returns the cached result (or None) for each secret in a chunk and the secrets that still need simulating
+def _lookup(cache, chunk:list[str], shots:int)->tuple:
+    if cache == None:
+        return [None] * len(chunk), chunk
+    from result_cache import SIM, SIM_BACKEND # Only imported when needed as the cache is optional
+    from make_qc_oracle import LINEAR
+    entries = cache.lookup(SIM, chunk, LINEAR, SIM_BACKEND, shots)
+    cached = [None if entry == None else entry.result() for entry in entries]
+    return cached, [secret for secret, data in zip(chunk, cached) if data == None]
+
+# Fills the gaps in a chunk's cached results with the new simulation results (adding those to the cache)
+def _merge(cache, cached:list, simulated:list)->list:
+    if cache != None:
+        from make_qc_oracle import LINEAR
+        cache.add_sims([data for data in simulated if data != None], LINEAR)
+    simulated = iter(simulated)
+    return [next(simulated) if data == None else data for data in cached]
+
+def _chunks(secrets, chunk_size:int):
+    while True:
+        chunk = list(islice(secrets, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def _chunk_seed(seed, i:int):
+    return None if seed == None else [seed, i]
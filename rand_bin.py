@@ -1,7 +1,10 @@
 import secrets
 from math import ceil
+from itertools import combinations
 from sys import argv
 
+CHUNK = 4096 # Secrets generated at a time by the iterators
+
 # Genrates a random n-bit binary stream as a string
 def rand_bits(n:int):
     len = ceil(n/8)
@@ -9,7 +12,96 @@ def rand_bits(n:int):
     random_bit = bin(int.from_bytes(random_byte, byteorder='big'))[2:].zfill(8*len)
     return random_bit[0:n]
 
+# Generates `count` random n-bit secrets in one call as a (count, ceil(n/8)) uint8 array, one packed secret per row
+# (first bit of the secret in the most significant bit of the first byte, unused bits are 0).
+# A seed gives the same secrets every time. With `unique` no secret is repeated.
+def rand_bits_packed(count:int, n:int, seed=None, unique:bool=False):
+    import numpy as np # Imported here as numpy is slow to import and rand_bits does not need it
+    rng = np.random.default_rng(seed)
+    if unique and count > 2**n:
+        raise ValueError("There are only " + str(2**n) + " different " + str(n) + "-bit secrets")
+    packed = _random_rows(rng, count, n)
+    if unique:
+        packed = _unique_rows(packed)
+        while len(packed) < count:
+            packed = _unique_rows(np.concatenate([packed, _random_rows(rng, count - len(packed), n)]))
+    return packed
+
+def _random_rows(rng, count:int, n:int):
+    import numpy as np
+    packed = rng.integers(0, 256, size=(count, ceil(n/8)), dtype=np.uint8)
+    if n % 8 != 0:
+        packed[:, -1] &= np.uint8((0xFF << (8 - n % 8)) & 0xFF)
+    return packed
+
+# Removes repeated rows, keeping the first of each in order
+def _unique_rows(packed):
+    import numpy as np
+    keys = np.ascontiguousarray(packed).view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, first = np.unique(keys, return_index=True)
+    return packed[np.sort(first)]
+
+# Converts packed secrets (from rand_bits_packed) back to strings
+def packed_to_strs(packed, n:int)->list[str]:
+    import numpy as np
+    bits = np.unpackbits(packed, axis=1)[:, :n] + ord('0')
+    text = bits.tobytes().decode("ascii")
+    return [text[i*n:(i+1)*n] for i in range(len(packed))]
+
+# Lazily yields `count` random n-bit secrets as strings, generating them in chunks
+# With `unique` no secret is repeated (the secrets seen so far are kept in packed form)
+def iter_rand_bits(count:int, n:int, seed=None, unique:bool=False, chunk:int=CHUNK):
+    import numpy as np
+    if unique and count > 2**n:
+        raise ValueError("There are only " + str(2**n) + " different " + str(n) + "-bit secrets")
+    rng = np.random.default_rng(seed)
+    seen = set()
+    done = 0
+    while done < count:
+        packed = _random_rows(rng, min(chunk, count - done), n)
+        if unique:
+            packed = _unique_rows(packed)
+            new = [i for i, row in enumerate(packed) if row.tobytes() not in seen]
+            packed = packed[new]
+            seen.update(row.tobytes() for row in packed)
+        for secret in packed_to_strs(packed, n):
+            yield secret
+        done += len(packed)
+
+# Lazily yields n-bit secrets with exactly `weight` ones.
+# If `count` is None every such secret is yielded once (ones placed as far left as possible first),
+# otherwise `count` random secrets are yielded.
+def iter_weight(n:int, weight:int, count:int=None, seed=None, chunk:int=CHUNK):
+    if weight < 0 or weight > n:
+        raise ValueError("Hamming weight must be between 0 and " + str(n))
+    if count == None:
+        for ones in combinations(range(n), weight):
+            bits = ['0'] * n
+            for i in ones:
+                bits[i] = '1'
+            yield ''.join(bits)
+        return
+
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    done = 0
+    while done < count:
+        size = min(chunk, count - done)
+        # The `weight` smallest of n random keys pick the positions of the ones
+        order = np.argsort(rng.random((size, n)), axis=1)[:, :weight]
+        bits = np.full((size, n), ord('0'), dtype=np.uint8)
+        np.put_along_axis(bits, order, ord('1'), axis=1)
+        text = bits.tobytes().decode("ascii")
+        for i in range(size):
+            yield text[i*n:(i+1)*n]
+        done += size
+
+# Lazily yields every n-bit secret in counting order (000, 001, 010, ...)
+def iter_all(n:int):
+    for i in range(2**n):
+        yield format(i, "0" + str(n) + "b")
+
 
 if __name__ == "__main__":
     random_bit = rand_bits(int(argv[1]))
-    print(random_bit)
\ No newline at end of file
+    print(random_bit)
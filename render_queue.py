@@ -0,0 +1,255 @@
+# Renders result figures (histograms, result summaries and circuit diagrams) for write_results.
+# Rendering is slow, so instead of drawing straight away (MODE = SYNC) figures can be drawn by a background
+# process pool (MODE = BACKGROUND) or saved to a queue on disk and drawn later (MODE = LATER) by running:
+#   python render_queue.py [-w <workers>]
+# A manifest records the inputs each figure was drawn from, so figures whose inputs have not changed are skipped.
+
+import os
+import json
+import pickle
+import hashlib
+import atexit
+from threading import BoundedSemaphore, Lock
+from concurrent.futures import ProcessPoolExecutor
+from sys import argv
+
+import tracing
+
+SYNC = "sync"
+BACKGROUND = "background"
+LATER = "later"
+MODES = [SYNC, BACKGROUND, LATER]
+
+MODE = SYNC
+WORKERS = 2         # Processes used to render in the background or when rendering the queue
+MAX_PENDING = 16    # Most figures waiting in the background pool before adding another blocks
+
+FOLDER = "results" # Same as write_results.FOLDER
+QUEUE_FOLDER = "render_queue"   # Figures waiting to be rendered (MODE = LATER)
+MANIFEST_FILE = "render_manifest.json"
+
+# Kinds of figures
+HIST = "hist"           # data is a counts dict
+SUMMARY = "summary"     # data is a result summary dict (see write_results.ResultData.summary)
+QC_LATEX = "qc_latex"   # data is a QuantumCircuit
+QC_MPL = "qc_mpl"       # data is a QuantumCircuit
+
+# A figure to be drawn from `data` and saved to `filename`
+class RenderTask:
+    def __init__(self, kind:str, data, filename:str):
+        self.kind = kind
+        self.data = data
+        self.filename = filename
+
+    # Hash of the figure's inputs, used to tell if an existing figure is up to date
+    def key(self)->str:
+        if self.kind == HIST or self.kind == SUMMARY:
+            text = json.dumps(self.data, sort_keys=True)
+        else:
+            try:
+                from qiskit import qasm2
+                text = qasm2.dumps(self.data)
+            except Exception:
+                text = repr(self.data.data)
+        return hashlib.sha1((self.kind + "\n" + text).encode()).hexdigest()
+
+# Draws the figure (runs in worker processes in the background and later modes)
+def render(task:RenderTask):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    if task.kind == HIST:
+        from qiskit.visualization import plot_histogram
+        fig = plot_histogram(task.data)
+        fig.savefig(task.filename)
+        plt.close(fig)
+    elif task.kind == SUMMARY:
+        fig = plot_summary(task.data)
+        fig.savefig(task.filename)
+        plt.close(fig)
+    elif task.kind == QC_LATEX:
+        task.data.draw('latex_source', filename=task.filename)
+    elif task.kind == QC_MPL:
+        fig = task.data.draw(output='mpl', filename=task.filename)
+        plt.close(fig)
+    return task.filename
+
+# Draws a result summary: the most common outputs, the shots at each Hamming distance from the secret and each
+# qubit's error rate with Wilson 95% intervals. Long outputs are labelled by the qubits that differ from the secret.
+def plot_summary(summary:dict):
+    import matplotlib.pyplot as plt
+    from analytics import wilson
+    secret = summary["secret"]
+    shots = summary["shots"]
+    n = len(secret)
+    fig, (top_ax, hamming_ax, qubit_ax) = plt.subplots(3, 1, figsize=(8, 10))
+    fig.suptitle(summary["backend"] + ", " + str(n) + "-bit secret, " + str(shots) + " shots")
+
+    labels = []
+    for output, _ in summary["top"]:
+        if n <= 16:
+            labels.append(output)
+        else:
+            wrong = [str(n-1-i) for i in range(n) if output[i] != secret[i]]
+            labels.append("secret" if len(wrong) == 0 else "q" + ",".join(wrong[:4]) + (",..." if len(wrong) > 4 else ""))
+    colours = ["tab:green" if output == secret else "tab:blue" for output, _ in summary["top"]]
+    top_ax.barh(range(len(labels)), [freq/shots for _, freq in summary["top"]], color=colours)
+    top_ax.set_yticks(range(len(labels)), labels, fontsize=8)
+    top_ax.invert_yaxis()
+    top_ax.set_xlabel("Probability")
+    top_ax.set_title("Most common outputs")
+
+    hamming_ax.bar(range(n+1), [count/shots for count in summary["hamming"]])
+    hamming_ax.set_xlabel("Hamming distance from secret")
+    hamming_ax.set_ylabel("Probability")
+
+    rates = [flips/shots for flips in summary["flips"]]
+    intervals = [wilson(flips, shots) for flips in summary["flips"]]
+    # Rounding can put a bound a tiny bit past the rate (e.g. for qubits that never or always flip)
+    errors = [[max(0.0, rate - low) for rate, (low, _) in zip(rates, intervals)], [max(0.0, high - rate) for rate, (_, high) in zip(rates, intervals)]]
+    qubit_ax.errorbar(range(n), rates, yerr=errors, fmt="o", markersize=3, capsize=2)
+    qubit_ax.set_xlabel("Qubit")
+    qubit_ax.set_ylabel("Error rate")
+    fig.tight_layout()
+    return fig
+
+_manifest = None    # filename -> key of the inputs the file was drawn from
+_lock = Lock()
+_pool = None
+_slots = None       # Limits the number of figures waiting in the pool
+_submitted = {}     # filename -> key of figures submitted by this process that may not be drawn yet
+
+def manifest_path()->str:
+    return os.path.join(FOLDER, MANIFEST_FILE)
+
+def get_manifest()->dict:
+    global _manifest
+    if _manifest == None:
+        _manifest = {}
+        if os.path.isfile(manifest_path()):
+            with open(manifest_path(), "r") as file:
+                _manifest = json.load(file)
+    return _manifest
+
+def save_manifest():
+    if _manifest == None:
+        return
+    with _lock:
+        if not os.path.isdir(FOLDER):
+            os.mkdir(FOLDER)
+        with open(manifest_path(), "w") as file:
+            json.dump(_manifest, file)
+
+def record(filename:str, key:str):
+    with _lock:
+        get_manifest()[filename] = key
+
+# Returns True if the figure already exists (or is being drawn) with the same inputs
+def up_to_date(task:RenderTask, key:str)->bool:
+    if _submitted.get(task.filename) == key:
+        return True
+    return os.path.isfile(task.filename) and get_manifest().get(task.filename) == key
+
+# Draws the figure, hands it to the background pool or adds it to the queue on disk depending on MODE
+def submit(task:RenderTask):
+    key = task.key()
+    if up_to_date(task, key):
+        return
+    _submitted[task.filename] = key
+
+    if MODE == SYNC:
+        # A figure that can not be drawn should not stop the result it belongs to being saved
+        try:
+            with tracing.span("render", kind=task.kind):
+                render(task)
+        except Exception as e:
+            print("Failed to render " + task.filename + ": " + str(e))
+            del _submitted[task.filename]
+            return
+        record(task.filename, key)
+    elif MODE == BACKGROUND:
+        _slots_acquire()
+        future = get_pool().submit(render, task)
+        future.add_done_callback(lambda f: _background_done(f, task.filename, key))
+    elif MODE == LATER:
+        folder = os.path.join(FOLDER, QUEUE_FOLDER)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        name = hashlib.sha1((task.filename + key).encode()).hexdigest() + ".pkl"
+        with open(os.path.join(folder, name), "wb") as file:
+            pickle.dump(task, file)
+    else:
+        raise ValueError("Unknown render mode: " + MODE)
+
+def get_pool()->ProcessPoolExecutor:
+    global _pool
+    if _pool == None:
+        _pool = ProcessPoolExecutor(max_workers=WORKERS)
+        atexit.register(wait)
+    return _pool
+
+def _slots_acquire():
+    global _slots
+    if _slots == None:
+        _slots = BoundedSemaphore(MAX_PENDING)
+    _slots.acquire()
+
+def _background_done(future, filename:str, key:str):
+    _slots.release()
+    if future.exception() != None:
+        print("Failed to render " + filename + ": " + str(future.exception()))
+    else:
+        record(filename, key)
+
+# Waits for all background rendering to finish and saves the manifest
+def wait():
+    global _pool
+    if _pool != None:
+        _pool.shutdown(wait=True)
+        _pool = None
+    save_manifest()
+
+# Renders all figures in the queue on disk, skipping any that are already up to date
+# Returns the number of figures drawn
+def render_pending(workers:int=WORKERS)->int:
+    folder = os.path.join(FOLDER, QUEUE_FOLDER)
+    if not os.path.isdir(folder):
+        return 0
+    queued = []     # (queue file, task, key) for figures that need drawing
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        with open(path, "rb") as file:
+            task = pickle.load(file)
+        key = task.key()
+        if up_to_date(task, key):
+            os.remove(path)
+        else:
+            _submitted[task.filename] = key
+            queued.append((path, task, key))
+
+    drawn = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render, task) for _, task, _ in queued]
+        for (path, task, key), future in zip(queued, futures):
+            # Figures that fail stay in the queue to be tried again
+            if future.exception() != None:
+                print("Failed to render " + task.filename + ": " + str(future.exception()))
+                continue
+            record(task.filename, key)
+            os.remove(path)
+            drawn += 1
+    save_manifest()
+    return drawn
+
+atexit.register(save_manifest)
+
+if __name__ == "__main__":
+    workers = WORKERS
+    for i in range(1, len(argv)):
+        if argv[i] == "-h" or argv[i] == "--help":
+            print("Usage: ", argv[0], " [-w <workers>]")
+            print("Renders all figures queued by runs with `--render later`")
+            exit()
+        elif argv[i] == "-w":
+            workers = int(argv[i+1])
+    print("Rendered", render_pending(workers), "figures")
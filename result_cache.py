@@ -0,0 +1,302 @@
+# Persistent cache of BV results, so secrets that have already been simulated or run are not simulated or submitted again.
+# Entries are content addressed: the key is a hash of the secret, the oracle construction (make_qc_oracle.VARIANTS),
+# the backend and the number of shots, which together decide the circuit that is run.
+#
+# Simulation results are served straight from the cache. Jobs submitted to quantum computers are added when they are
+# submitted (without counts) and their counts are filled in by load_results.py, so a secret that is already queued or
+# done on a backend is reported and skipped by run_bv.py unless a rerun is forced. The entries of jobs that fail are
+# removed when the failure is found, so their secrets can be submitted again.
+# Entries older than `max_age` are removed, then the least recently used until the cache is below `max_bytes`. This is
+# done when the cache is opened and whenever it grows past `max_bytes`, reducing it to EVICT_TARGET of `max_bytes`.
+# Hits and misses are counted for each kind of entry and added to the totals kept with the cache when the cache is
+# closed or summarised (and when the process exits, for the shared cache).
+#
+# Usage: python result_cache.py [--clear] [--evict] [--max-mb <int>] [--max-days <float>]
+
+import os
+import atexit
+import sqlite3
+import time
+import hashlib
+from sys import argv
+
+import tracing
+import write_results
+from write_results import ResultData
+from results_db import pack_counts, unpack_counts
+
+DB_FILE = "cache.db" # Saved in write_results.FOLDER
+MAX_BYTES = 256 * 2**20     # Largest size of the cached counts
+MAX_AGE = 90 * 24 * 3600    # Seconds an entry is kept for
+EVICT_TARGET = 0.9          # Fraction of max_bytes a full cache is reduced to, so it is not full again straight away
+
+SIM = "sim"             # Local simulation of the test circuit (any simulator)
+HARDWARE = "hardware"   # Job on a quantum computer
+SIM_BACKEND = "local"   # Backend name used in the keys of simulation entries
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    secret TEXT NOT NULL,
+    oracle TEXT NOT NULL,
+    shots INTEGER NOT NULL,
+    job_id TEXT,
+    counts BLOB,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_job ON cache(job_id, secret);
+CREATE INDEX IF NOT EXISTS cache_used ON cache(used);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    kind TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL,
+    misses INTEGER NOT NULL
+);
+"""
+
+# Key of the result of running the test circuit for `secret` built with `oracle` on `backend` with `shots` shots
+def cache_key(kind:str, secret:str, oracle:str, backend:str, shots:int)->str:
+    return hashlib.sha256("/".join((kind, secret, oracle, backend, str(shots))).encode()).hexdigest()
+
+# A cached result. `counts` is None for a hardware job whose results have not been loaded yet
+class CacheEntry:
+    def __init__(self, kind:str, backend:str, secret:str, shots:int, job_id:str, counts:dict):
+        self.kind = kind
+        self.backend = backend
+        self.secret = secret
+        self.shots = shots
+        self.job_id = job_id
+        self.counts = counts
+
+    def result(self, tag:str="")->ResultData:
+        return ResultData(self.backend, self.secret, self.shots, self.counts, id=self.job_id or "", tag=tag).compact()
+
+# Result cache backed by a SQLite database
+class ResultCache:
+    def __init__(self, filename:str=None, max_bytes:int=MAX_BYTES, max_age:float=MAX_AGE):
+        if filename == None:
+            if not os.path.isdir(write_results.FOLDER):
+                os.mkdir(write_results.FOLDER)
+            filename = os.path.join(write_results.FOLDER, DB_FILE)
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = {SIM: 0, HARDWARE: 0}   # Counted in this process
+        self.misses = {SIM: 0, HARDWARE: 0}
+        self.unsaved = {}                   # kind -> [hits, misses] not yet added to the saved totals
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(SCHEMA)
+        self.evict() # Also counts the size of the cached counts
+
+    def close(self):
+        self.save_stats()
+        self.conn.close()
+
+    # Looks up the entries for several secrets at once, returns a list with the entry or None for each secret
+    @tracing.timed("cache.lookup")
+    def lookup(self, kind:str, secrets:list[str], oracle:str, backend:str, shots:int)->list[CacheEntry]:
+        keys = [cache_key(kind, secret, oracle, backend, shots) for secret in secrets]
+        found = {}
+        for i in range(0, len(keys), 500): # SQLite limits the number of parameters
+            part = keys[i:i+500]
+            rows = self.conn.execute("SELECT key, backend, secret, shots, job_id, counts FROM cache WHERE key IN (" + ",".join("?" * len(part)) + ")", part)
+            for key, entry_backend, secret, entry_shots, job_id, counts in rows:
+                found[key] = CacheEntry(kind, entry_backend, secret, entry_shots, job_id, unpack_counts(counts))
+        entries = [found.get(key) for key in keys]
+        hits = sum(1 for entry in entries if entry != None)
+        self._count(kind, hits, len(keys) - hits)
+        if hits > 0:
+            with self.conn:
+                self.conn.executemany("UPDATE cache SET used = ? WHERE key = ?", [(time.time(), key) for key in found])
+        return entries
+
+    # Adds simulation results (ResultData with counts) for test circuits built with `oracle`
+    @tracing.timed("cache.add")
+    def add_sims(self, results:list[ResultData], oracle:str):
+        now = time.time()
+        rows = []
+        for result in results:
+            blob = pack_counts(result.counts)
+            rows.append((cache_key(SIM, result.secret, oracle, SIM_BACKEND, result.shots), SIM, result.backend, result.secret, oracle, result.shots, None, blob, len(blob), now, now))
+        self._insert(rows)
+
+    # Adds hardware jobs that have just been submitted (their counts are added by add_counts once loaded)
+    def add_jobs(self, secrets:list[str], oracle:str, backend:str, shots:int, job_id:str):
+        now = time.time()
+        rows = [(cache_key(HARDWARE, secret, oracle, backend, shots), HARDWARE, backend, secret, oracle, shots, job_id, None, 0, now, now) for secret in secrets]
+        self._insert(rows)
+
+    # Fills in the counts of a submitted job's secret. Returns False if the job is not in the cache
+    def add_counts(self, job_id:str, secret:str, counts:dict)->bool:
+        blob = pack_counts(counts)
+        with self.conn:
+            updated = self.conn.execute("UPDATE cache SET counts = ?, size = ? WHERE job_id = ? AND secret = ?", (blob, len(blob), job_id, secret)).rowcount
+        self._grow(updated * len(blob))
+        return updated > 0
+
+    # Removes the entries of a submitted job whose counts have not been loaded (e.g. because the job failed)
+    # Returns the number of entries removed
+    def drop_job(self, job_id:str)->int:
+        with self.conn:
+            return self.conn.execute("DELETE FROM cache WHERE job_id = ? AND counts IS NULL", (job_id,)).rowcount
+
+    # Removes entries older than max_age, then the least recently used entries until the cache is below `target`
+    # (max_bytes if not given). Returns the number of entries removed
+    def evict(self, target:int=None)->int:
+        target = self.max_bytes if target == None else target
+        with self.conn:
+            removed = self.conn.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.max_age,)).rowcount
+            total = self.size()
+            if total > target:
+                # Walk from the least recently used entry until enough space is freed. Submitted jobs whose counts have
+                # not been loaded take no space and are kept, so they are still skipped by run_bv.skip_cached
+                cutoff = None
+                freed = 0
+                for used, size in self.conn.execute("SELECT used, size FROM cache WHERE size > 0 ORDER BY used"):
+                    freed += size
+                    cutoff = used
+                    if total - freed <= target:
+                        break
+                removed += self.conn.execute("DELETE FROM cache WHERE used <= ? AND size > 0", (cutoff,)).rowcount
+                total = self.size()
+        self._size = total
+        return removed
+
+    # Total size of the cached counts in bytes
+    def size(self)->int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM cache")
+            self.conn.execute("DELETE FROM cache_stats")
+        self._size = 0
+        self.unsaved = {}
+
+    # Returns {kind: (entries, hits, misses)} with the hits and misses of every process that has used the cache
+    def stats(self)->dict:
+        self.save_stats()
+        stats = {kind: [0, 0, 0] for kind in (SIM, HARDWARE)}
+        for kind, entries in self.conn.execute("SELECT kind, COUNT(*) FROM cache GROUP BY kind"):
+            stats.setdefault(kind, [0, 0, 0])[0] = entries
+        for kind, hits, misses in self.conn.execute("SELECT kind, hits, misses FROM cache_stats"):
+            stats.setdefault(kind, [0, 0, 0])[1:] = [hits, misses]
+        return {kind: tuple(values) for kind, values in stats.items()}
+
+    # Hits and misses in this process, e.g. "cache: 12 hits, 3 misses". Also saves them with the cache
+    def summary(self)->str:
+        self.save_stats()
+        return "cache: " + str(sum(self.hits.values())) + " hits, " + str(sum(self.misses.values())) + " misses"
+
+    def _insert(self, rows:list[tuple]):
+        if len(rows) == 0:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO cache VALUES (?,?,?,?,?,?,?,?,?,?,?)", rows)
+        self._grow(sum(row[8] for row in rows))
+
+    # Adds to the running size of the cached counts, evicting once it is over max_bytes. Replaced entries are not
+    # taken off, so the running size can be too high, but it is counted again exactly whenever entries are evicted
+    def _grow(self, size:int):
+        self._size += size
+        if self._size > self.max_bytes:
+            self.evict(int(self.max_bytes * EVICT_TARGET))
+
+    def _count(self, kind:str, hits:int, misses:int):
+        self.hits[kind] += hits
+        self.misses[kind] += misses
+        tracing.count("cache_hits", hits)
+        tracing.count("cache_misses", misses)
+        unsaved = self.unsaved.setdefault(kind, [0, 0])
+        unsaved[0] += hits
+        unsaved[1] += misses
+
+    # Adds the hits and misses counted since the last save to the totals kept with the cache
+    def save_stats(self):
+        if len(self.unsaved) == 0:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT INTO cache_stats VALUES (?,?,?) ON CONFLICT (kind) DO UPDATE SET "
+                                  "hits = hits + excluded.hits, misses = misses + excluded.misses",
+                                  [(kind, hits, misses) for kind, (hits, misses) in self.unsaved.items()])
+        self.unsaved = {}
+
+_cache = None # Cache shared by everything in this process
+
+# Returns the default result cache (results/cache.db), opening it on first use
+def get_cache()->ResultCache:
+    global _cache
+    if _cache == None:
+        _cache = ResultCache()
+        atexit.register(_cache.save_stats)
+    return _cache
+
+# Fills in the counts of a loaded job if the job was submitted with the cache in use (does nothing if there is no cache)
+def add_loaded_counts(job_id:str, secret:str, counts:dict):
+    if _cache == None and not os.path.isfile(os.path.join(write_results.FOLDER, DB_FILE)):
+        return
+    get_cache().add_counts(job_id, secret, counts)
+
+# Removes the entries of jobs that failed or were cancelled so their secrets are not skipped (does nothing if there is no cache)
+def drop_failed_jobs(job_ids:list[str]):
+    if len(job_ids) == 0 or (_cache == None and not os.path.isfile(os.path.join(write_results.FOLDER, DB_FILE))):
+        return
+    for job_id in set(job_ids):
+        get_cache().drop_job(job_id)
+
+
+def print_instructions():
+    print("Usage: ", argv[0]," <options>")
+    print(" ")
+    print("Options:")
+    print("-h \t\t\t View Instructions")
+    print("--clear \t\tRemove every entry and the hit/miss counts")
+    print("--evict \t\tRemove old entries now")
+    print("--max-mb <int> \t\tLargest size of the cache when evicting\t[Default = " + str(MAX_BYTES // 2**20) + "]")
+    print("--max-days <float> \tAge after which entries are removed when evicting\t[Default = " + str(MAX_AGE // (24*3600)) + "]")
+    print(" ")
+    print("Prints the number of entries, hits and misses of each kind of result")
+
+if __name__ == "__main__":
+    clear = False
+    evict = False
+    max_bytes = MAX_BYTES
+    max_age = MAX_AGE
+    help_flag = False
+    # Process arguments
+    skip_flag = False
+    for i in range(1, len(argv)):
+        if skip_flag:
+            skip_flag =False
+            continue
+        opt = argv[i]
+        if opt == "-h" or opt == "--help":
+            print_instructions()
+            help_flag = True
+            break
+        elif opt == "--clear":
+            clear = True
+        elif opt == "--evict":
+            evict = True
+        elif opt == "--max-mb":
+            max_bytes = int(argv[i+1]) * 2**20
+            skip_flag = True
+        elif opt == "--max-days":
+            max_age = float(argv[i+1]) * 24 * 3600
+            skip_flag = True
+        else:
+            print("Option ", opt, " is not defined.")
+            help_flag = True
+    if not help_flag:
+        cache = ResultCache(max_bytes=max_bytes, max_age=max_age)
+        if clear:
+            cache.clear()
+        if evict:
+            print("Removed", cache.evict(), "entries")
+        print("kind, entries, hits, misses")
+        for kind, (entries, hits, misses) in cache.stats().items():
+            print(kind, entries, hits, misses, sep=", ")
+        print("size:", round(cache.size() / 2**20, 2), "MB")
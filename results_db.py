@@ -0,0 +1,207 @@
+# Indexed local store for test results, kept in a SQLite database alongside the csv files in the results folder.
+# Results can be queried by job id, backend, secret, size, tag and time without re-reading the csv files,
+# and csv files in the results_accuracy.csv format can be exported from (or imported into) the store.
+
+import os
+import csv
+import json
+import sqlite3
+import time
+import uuid
+import zlib
+from sys import argv
+
+import write_results
+from write_results import ResultData
+
+DB_FILE = "results.db" # Saved in write_results.FOLDER
+ACCURACY_HEADER = ["backend", "secret", "accuracy", "size", "tag", "shots"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    job_id TEXT,
+    backend TEXT NOT NULL,
+    secret TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    shots INTEGER,
+    accuracy REAL NOT NULL,
+    tag TEXT NOT NULL DEFAULT '',
+    created REAL,
+    counts BLOB
+);
+CREATE INDEX IF NOT EXISTS results_job_id ON results(job_id);
+CREATE INDEX IF NOT EXISTS results_backend ON results(backend);
+CREATE INDEX IF NOT EXISTS results_secret ON results(secret);
+CREATE INDEX IF NOT EXISTS results_size ON results(size);
+CREATE INDEX IF NOT EXISTS results_created ON results(created);
+CREATE INDEX IF NOT EXISTS results_tag_backend_size ON results(tag, backend, size);
+"""
+
+# Counts are stored as compressed json, bitstring keys compress well
+def pack_counts(counts:dict)->bytes:
+    return zlib.compress(json.dumps(counts, separators=(',', ':')).encode())
+
+def unpack_counts(blob:bytes)->dict:
+    if blob == None:
+        return None
+    return json.loads(zlib.decompress(blob).decode())
+
+# Results store backed by a SQLite database
+class ResultStore:
+    def __init__(self, filename:str=None):
+        if filename == None:
+            if not os.path.isdir(write_results.FOLDER):
+                os.mkdir(write_results.FOLDER)
+            filename = os.path.join(write_results.FOLDER, DB_FILE)
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # Adds results in a single transaction. Results already in the store (same id and secret) are skipped.
+    # Returns the number of results added
+    def add(self, results:list[ResultData])->int:
+        now = time.time()
+        rows = []
+        for result in results:
+            if result.counts == None:
+                continue
+            # Results without a job id are always new
+            key = (result.id if result.id != "" else uuid.uuid4().hex) + "/" + result.secret
+            rows.append((key, result.id, result.backend, result.secret, result.secret_len(), result.shots,
+                         result.accuracy(), result.tag, now, pack_counts(result.counts)))
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO results VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+            return self.conn.total_changes - before
+
+    # Builds the WHERE clause for the given filters (None matches anything)
+    def _where(self, size:int=None, backend:str=None, tag:str=None, secret:str=None, job_id:str=None):
+        clauses = []
+        params = []
+        for column, value in (("size", size), ("backend", backend), ("tag", tag), ("secret", secret), ("job_id", job_id)):
+            if value != None:
+                clauses.append(column + " = ?")
+                params.append(value)
+        if len(clauses) == 0:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    # Returns all results matching the filters as ResultData, oldest first
+    # Counts are returned in compact (array) form, see ResultData.compact
+    def query(self, size:int=None, backend:str=None, tag:str=None, secret:str=None, job_id:str=None)->list[ResultData]:
+        where, params = self._where(size, backend, tag, secret, job_id)
+        rows = self.conn.execute("SELECT backend, secret, shots, counts, job_id, tag FROM results" + where + " ORDER BY rowid", params)
+        results = []
+        for backend, secret, shots, counts, job_id, tag in rows:
+            result = ResultData(backend, secret, shots, unpack_counts(counts), id=job_id or "", tag=tag)
+            results.append(result if result.counts == None else result.compact())
+        return results
+
+    # Returns (backend, size, number of results, mean accuracy, min accuracy, max accuracy) for each backend and size
+    def accuracy_summary(self, size:int=None, backend:str=None, tag:str=None)->list[tuple]:
+        where, params = self._where(size, backend, tag)
+        return self.conn.execute("SELECT backend, size, COUNT(*), AVG(accuracy), MIN(accuracy), MAX(accuracy) FROM results"
+                                 + where + " GROUP BY backend, size ORDER BY backend, size", params).fetchall()
+
+    # Writes matching results to a csv in the same format as results_accuracy.csv
+    def export_accuracy_csv(self, filename:str, size:int=None, backend:str=None, tag:str=None):
+        where, params = self._where(size, backend, tag)
+        rows = self.conn.execute("SELECT backend, '0b' || secret, accuracy, size, tag, shots FROM results" + where + " ORDER BY rowid", params)
+        with open(filename, mode='w', encoding='UTF8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(ACCURACY_HEADER)
+            writer.writerows(rows)
+
+    # Loads results from a results_accuracy.csv file. These have no counts or job id, and rows written before the csv
+    # recorded shots have no shots either.
+    # Rows are keyed by file and line number, so importing the same file twice does not add duplicates.
+    # Returns the number of results added
+    def import_accuracy_csv(self, filename:str)->int:
+        source = os.path.basename(filename)
+        rows = []
+        with open(filename, mode='r', encoding='UTF8', newline='') as file:
+            reader = csv.reader(file)
+            next(reader) # Skip header
+            for i, row in enumerate(reader):
+                backend, secret, accuracy, size, tag = row[:5]
+                shots = int(row[5]) if len(row) > 5 and row[5] != "" else None
+                rows.append(("csv:" + source + ":" + str(i), None, backend, secret[2:], int(size), shots, float(accuracy), tag, None, None))
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO results VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+            return self.conn.total_changes - before
+
+_store = None # Store shared by all writers in this process
+
+# Returns the default results store (results/results.db), opening it on first use
+def get_store()->ResultStore:
+    global _store
+    if _store == None:
+        _store = ResultStore()
+    return _store
+
+
+def print_instructions():
+    print("Usage: ", argv[0]," <options>")
+    print(" ")
+    print("Options:")
+    print("-h \t\t\t View Instructions")
+    print("-n <int> \t\tNumber of bits\t\t[Default = any]")
+    print("-b <backend_name> \tSpecify quantum backend\t[Default = any]")
+    print("-t <tag> \t\tSpecify a tag that the results should have\t[Default = any]")
+    print("--import <csv> \t\tImport a results_accuracy.csv file into the store")
+    print("--export <csv> \t\tExport matching results in the results_accuracy.csv format")
+    print(" ")
+    print("Prints the accuracy of matching results by backend and size if no import or export is given")
+
+if __name__ == "__main__":
+    n = None
+    backend = None
+    tag = None
+    import_file = None
+    export_file = None
+    help_flag = False
+    # Process arguments
+    skip_flag = False
+    for i in range(1, len(argv)):
+        if skip_flag:
+            skip_flag =False
+            continue
+        opt = argv[i]
+        if opt == "-h" or opt == "--help":
+            print_instructions()
+            help_flag = True
+            break
+        elif opt == "-n":
+            n = int(argv[i+1])
+            skip_flag = True
+        elif opt == "-b" or opt == "--backend":
+            backend = argv[i+1]
+            skip_flag = True
+        elif opt == "-t" or opt == "--tag":
+            tag = argv[i+1]
+            skip_flag = True
+        elif opt == "--import":
+            import_file = argv[i+1]
+            skip_flag = True
+        elif opt == "--export":
+            export_file = argv[i+1]
+            skip_flag = True
+        else:
+            print("Option ", opt, " is not defined.")
+            help_flag = True
+    if not help_flag:
+        store = get_store()
+        if import_file != None:
+            print("Imported", store.import_accuracy_csv(import_file), "results")
+        if export_file != None:
+            store.export_accuracy_csv(export_file, n, backend, tag)
+            print("Exported results to", export_file)
+        if import_file == None and export_file == None:
+            print("backend, size, results, mean accuracy, min accuracy, max accuracy")
+            for row in store.accuracy_summary(n, backend, tag):
+                print(*row, sep=", ")
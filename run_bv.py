@@ -3,27 +3,83 @@
 from sys import argv
 
 from qiskit import QuantumCircuit, transpile
-from qiskit.providers.basic_provider import BasicSimulator
 
-from rand_bin import rand_bits
-from make_qc_oracle import secret_test_qc
-from set_service import get_service
+from itertools import chain, islice
+
+import rand_bin
+from make_qc_oracle import secret_test_qc, device_layout, best_oracle, LINEAR, COUPLING, VARIANTS
+import stabilizer_sim
+import noisy_sim
+import parallel_sim
+import adaptive
+import result_cache
+import scheduler
+import tracing
+import render_queue
 from write_results import save_result, ResultData
-from save_job import save_job_data, JobData
+from save_job import save_job_datas, JobData
+
+MAX_BASIC_SIM_QUBITS = 25 # Largest circuit the dense BasicSimulator is used for
+BEST_ORACLE = "best" # --oracle choice that picks the oracle giving the shallowest circuit on the backend
 
 # Function used to create and run BV quantum circuits based on the inputs specified 
-def run_bv(secrets:list[str], run:bool = True, sim:bool = True, shots:int = 4000, backend_name:str = None, save_sim = False, tag:str=""):
+# Circuits are transpiled together and submitted in jobs of up to `batch_size` circuits each.
+# `service` can be given to use something other than the saved IBM account (e.g. fake_service.FakeService)
+# If a `noise_model` (noisy_sim.NoiseModel) is given, circuits are run on the local noisy simulator instead of
+# a quantum computer and the results are saved straight away.
+# With `pack`, several secrets are placed side by side on disjoint qubits of each circuit (see packing.py),
+# `share` secrets at a time sharing one ancilla qubit.
+# `secrets` can be any iterable (e.g. from rand_bin.iter_rand_bits), so long simulation sweeps are streamed
+# rather than built as a list. Secrets are only collected into a list when running on a quantum computer.
+# Validation simulations are spread over `workers` processes (0 for every core) in chunks of `chunk_size` secrets.
+# If any simulation fails to find its secret, nothing is submitted and a parallel_sim.ValidationError is raised.
+# `oracle` picks the oracle construction (see oracle_test_qc). Circuits with other oracles than the linear one are
+# validated in this process, on the circuit that will be run.
+# With a `shot_policy` (adaptive.ShotPolicy), shots are spent in rounds until each secret is found with enough confidence
+# (see adaptive.py). This waits for the jobs to finish and saves the results; `shots` is then the most any secret gets.
+# With a `cache` (result_cache.ResultCache), secrets already simulated with the same shots are not simulated again, and
+# secrets already submitted to the backend with the same oracle and shots are reported and not submitted again unless
+# `force` is True (which also simulates every secret again).
+# With `spread`, jobs are spread across every backend with enough qubits by a scheduler.Scheduler instead of all going
+# to the least busy backend (or `backend_name`).
+def run_bv(secrets:list[str], run:bool = True, sim:bool = True, shots:int = 4000, backend_name:str = None, save_sim = False, tag:str="", batch_size:int = 1, service = None, noise_model:noisy_sim.NoiseModel = None, pack:bool = False, share:int = 1, workers:int = 1, chunk_size:int = parallel_sim.CHUNK_SIZE, oracle:str = LINEAR, shot_policy:adaptive.ShotPolicy = None, cache:result_cache.ResultCache = None, force:bool = False, spread:bool = False):
+
+    if noise_model != None:
+        print("Running on noisy simulator...")
+        run = False
+    if pack and oracle != LINEAR:
+        raise ValueError("Packed circuits use the linear oracle")
+    if pack and shot_policy != None:
+        raise ValueError("Adaptive shots can not be used with packed circuits")
+    if spread and (pack or shot_policy != None or oracle in (COUPLING, BEST_ORACLE)):
+        raise ValueError("Spread jobs use unpacked circuits with fixed shots and an oracle that does not depend on the backend")
+    if spread and backend_name != None:
+        raise ValueError("Spread jobs choose their own backends, a backend can not be given")
+    if run:
+        secrets = list(secrets) # Needed to find a large enough backend and to split secrets into jobs
+    if isinstance(secrets, (list, tuple)):
+        iters = len(secrets) # nuber of unique circuits
+    else:
+        # Look ahead to see if there is only one secret without building the whole list (iters is None for longer streams)
+        head = list(islice(secrets, 2))
+        secrets = chain(head, secrets)
+        iters = len(head) if len(head) < 2 else None
 
-    iters = len(secrets) # nuber of unique circuits 
     if run:
         print("Running on Quantum Computer...")
 
         # Load qiskit credentials
-        service = get_service()
-        print("Credentials loaded")
+        if service == None:
+            from set_service import get_service # Only imported when needed as qiskit_ibm_runtime is slow to import
+            service = get_service()
+            print("Credentials loaded")
 
         # Find backend
-        if backend_name == None:
+        if spread:
+            spread_scheduler = scheduler.Scheduler(service, len(min(secrets, key=len))+1)
+            backend = None # Chosen for each job
+            print("Spreading jobs across:", ", ".join(b.name for b in spread_scheduler.backends))
+        elif backend_name == None:
             n_max = len(max(secrets, key=len))+1 # Highest number of qubits required, used to choose sufficiently large backend 
             backend = service.least_busy(simulator=False, operational=True, min_num_qubits=n_max)
             print("Least busy backend:", backend)
@@ -31,66 +87,246 @@ def run_bv(secrets:list[str], run:bool = True, sim:bool = True, shots:int = 4000
             backend = service.get_backend(backend_name)
             print("Got backend:", backend)
 
-    for secret in secrets:
-        print("Secret: ", secret)
+    # Run simulation tests for validation (simulated ahead of this loop, in order, when using several workers)
+    if sim and oracle == LINEAR:
+        checked = parallel_sim.simulate_secrets(secrets, shots, workers, chunk_size, cache=None if force else cache)
+    else:
+        checked = ((secret, None) for secret in secrets)
+    report = parallel_sim.ValidationReport()
 
-        # Make oracle circuit
-        qc = secret_test_qc(secret)
+    qcs = [] # circuits waiting to be transpiled and submitted
+    layouts = [] # device qubits for each circuit (None lets the transpiler choose)
+    for secret, data in checked:
+        print("Secret: ", secret)
 
         n = len(secret)
+        qc = None
+        # Make oracle circuit (only if it will be used here)
+        if run or noise_model != None or save_sim or (n <= 8 and iters == 1) or (sim and oracle != LINEAR):
+            with tracing.span("secret_test_qc"):
+                qc, layout = oracle_test_qc(secret, oracle, backend if run else None, noise_model)
+            tracing.count("circuits")
+
         # Display oracle circuit for single secret if small enough
         if n <= 8 and iters == 1:
             print("Circuit:")
             print(qc.draw())
-        
-        # Run simulation tests for validation
-        if sim and n < 25:
-            data = run_local_sim(qc, secret)
-            print("Simulation accuracy: " + str(data.accuracy()))
-            if save_sim:
-                save_result(data)
-            assert(data.accuracy() == 1.0)
-
-        # Run on quntum computer
-        if run:
-            # Transpile qc for backend
-            transpiled_qc = transpile(qc, backend)
 
-            # Execute the transpiled circuit 
-            job = backend.run(transpiled_qc, shots=shots)
-            if tag != None and tag != "":
-                job.update_tags(["run_bv_"+secret, tag])
+        if sim:
+            if oracle != LINEAR:
+                data = run_local_sim(qc, secret, shots)
+            report.add(secret, data)
+            if data == None:
+                print("Circuit too large to simulate, validation skipped")
             else:
-                job.update_tags(["run_bv_"+secret])
+                print("Simulation accuracy: " + str(data.accuracy()))
+                if save_sim:
+                    data.qc = qc
+                    save_result(data)
 
-            print("Job ID:", job.job_id())
+        if noise_model != None:
+            data = run_noisy_sim(qc, secret, noise_model, shots, tag)
+            print("Noisy simulation accuracy: " + str(data.accuracy()))
+            save_result(data)
 
-            # Save job data to be retrieved later
-            data = JobData(job.job_id(), backend.name, secret, shots, tag)
-            save_job_data(data)
-            print("Job data saved")
+        if run:
+            qcs.append(qc)
+            layouts.append(layout)
 
-            # Save circuit traspile data to be used later
-            result_data = ResultData(backend.name, secret, shots, counts=None, qc=qc, tqc=transpiled_qc, id=job.job_id())
-            save_result(result_data)
+    if sim:
+        print(report.summary())
+        if not report.ok():
+            raise parallel_sim.ValidationError("Simulation did not find every secret, no jobs were submitted")
 
-    if not run:
+    if cache != None and run and not force and shot_policy == None:
+        for cached_backend in spread_scheduler.backends if spread else [backend]:
+            secrets, qcs, layouts = skip_cached(cache, cached_backend, secrets, qcs, layouts, oracle, shots)
+        iters = len(secrets)
+    # Printed after the lookups of secrets already submitted so the figures cover the whole run
+    if cache != None:
+        print(cache.summary())
+    if not run or iters == 0:
         return
+
+    if spread:
+        submit_spread(spread_scheduler, secrets, qcs, shots, tag, batch_size, oracle, cache)
+    elif pack:
+        # Each packed circuit is already routed for the backend
+        import packing
+        with tracing.span("pack_circuits", secrets=iters):
+            packed = packing.pack_circuits(secrets, backend, share)
+        print("Packed", iters, "secrets into", len(packed), "circuits")
+        for i in range(0, len(packed), batch_size):
+            job = submit_packed(backend, secrets, qcs, packed[i:i+batch_size], shots, tag)
+            if cache != None:
+                cache.add_jobs([secrets[k] for p in packed[i:i+batch_size] for k in p.secrets], oracle, backend.name, shots, job.job_id())
+    else:
+        # Transpile all circuits in one call so qiskit can spread the work across cores
+        transpiled_qcs = transpile_qcs(qcs, backend, layouts)
+
+        if shot_policy != None:
+            adaptive.run_adaptive(backend, secrets, qcs, transpiled_qcs, shot_policy, tag, batch_size)
+            return
+
+        # Run on quntum computer
+        for i in range(0, iters, batch_size):
+            job = submit_batch(backend, secrets[i:i+batch_size], qcs[i:i+batch_size], transpiled_qcs[i:i+batch_size], shots, tag)
+            if cache != None:
+                cache.add_jobs(secrets[i:i+batch_size], oracle, backend.name, shots, job.job_id())
           
     if iters > 1:
         print("All jobs queued. Rustles can be loaded once jobs are done.")
     else:
         print("Jobs queued. Rustles can be loaded once job is done.")
 
+# Builds the test circuit for the secret with the given oracle variant (one of make_qc_oracle.VARIANTS, or BEST_ORACLE for
+# the one giving the shallowest circuit on the backend). The coupling variant is built for a compact group of qubits on
+# the backend, or the noise model's coupling map, or qubits connected in a line if there is neither.
+# Returns the circuit and the backend qubits it must be transpiled onto (None if any will do)
+def oracle_test_qc(secret:str, oracle:str = LINEAR, backend = None, noise_model:noisy_sim.NoiseModel = None)->tuple:
+    if oracle == BEST_ORACLE:
+        oracle = best_oracle(secret, backend)
+        print("Oracle:", oracle)
+    if oracle != COUPLING:
+        return secret_test_qc(secret, oracle), None
+    if backend != None:
+        layout, coupling_map = device_layout(len(secret), backend)
+        return secret_test_qc(secret, COUPLING, coupling_map, layout), layout
+    if noise_model != None and noise_model.coupling_map != None:
+        return secret_test_qc(secret, COUPLING, noise_model.coupling_map, noise_model.layout), None
+    return secret_test_qc(secret, COUPLING, [(i, i+1) for i in range(len(secret))]), None
+
+# Leaves out secrets that have already been submitted to the backend with the same oracle and shots, printing the
+# job (and accuracy, if its results have been loaded) of each. Returns the remaining secrets, circuits and layouts
+def skip_cached(cache:result_cache.ResultCache, backend, secrets:list[str], qcs:list[QuantumCircuit], layouts:list, oracle:str, shots:int)->tuple:
+    entries = cache.lookup(result_cache.HARDWARE, secrets, oracle, backend.name, shots)
+    for secret, entry in zip(secrets, entries):
+        if entry == None:
+            continue
+        if entry.counts == None:
+            print("Secret " + secret + " was already submitted to " + backend.name + " as job " + entry.job_id + ", skipped (use --force to run again)")
+        else:
+            print("Secret " + secret + " already ran on " + backend.name + " as job " + entry.job_id + " with accuracy " + str(entry.result().accuracy()) + ", skipped (use --force to run again)")
+    keep = [i for i, entry in enumerate(entries) if entry == None]
+    return [secrets[i] for i in keep], [qcs[i] for i in keep], [layouts[i] for i in keep]
+
+# Transpiles circuits for the backend, each onto the backend qubits in `layouts` (None entries let the transpiler choose)
+def transpile_qcs(qcs:list[QuantumCircuit], backend, layouts:list = None)->list[QuantumCircuit]:
+    with tracing.span("transpile", circuits=len(qcs)):
+        if layouts == None or all(layout == None for layout in layouts):
+            return transpile(qcs, backend)
+        # Each circuit keeps the qubits its oracle was built for
+        return [transpile(qc, backend, initial_layout=layout) for qc, layout in zip(qcs, layouts)]
+
+# Submits transpiled circuits for the given secrets to the backend as a single job
+# Job data is saved for each secret along with its position in the job so results can be mapped back later
+def submit_batch(backend, secrets:list[str], qcs:list[QuantumCircuit], transpiled_qcs:list[QuantumCircuit], shots:int, tag:str=""):
+    with tracing.span("backend.run", circuits=len(secrets)):
+        if len(secrets) == 1:
+            job = backend.run(transpiled_qcs[0], shots=shots)
+        else:
+            job = backend.run(transpiled_qcs, shots=shots)
+    tracing.count("jobs")
+    tracing.count("shots", shots*len(secrets))
+
+    with tracing.span("job.update_tags"):
+        job.update_tags(get_job_tags(secrets, tag))
+
+    print("Job ID:", job.job_id())
+
+    # Save job data to be retrieved later
+    job_datas = []
+    for i, secret in enumerate(secrets):
+        index = None if len(secrets) == 1 else i
+        job_datas.append(JobData(job.job_id(), backend.name, secret, shots, tag, index))
+    save_job_datas(job_datas)
+
+    for i, secret in enumerate(secrets):
+        # Save circuit traspile data to be used later
+        result_data = ResultData(backend.name, secret, shots, counts=None, qc=qcs[i], tqc=transpiled_qcs[i], id=job.job_id())
+        save_result(result_data)
+    print("Job data saved")
+
+    return job
+
+# Submits the circuits in jobs of up to `batch_size` circuits, each transpiled for and submitted to the backend the
+# scheduler places it on. Placements are recorded in the job ledger.
+def submit_spread(spread_scheduler:scheduler.Scheduler, secrets:list[str], qcs:list[QuantumCircuit], shots:int, tag:str="", batch_size:int = 1, oracle:str = LINEAR, cache:result_cache.ResultCache = None):
+    for i in range(0, len(secrets), batch_size):
+        batch = secrets[i:i+batch_size]
+        with tracing.span("scheduler.place"):
+            backend, pending, expected = spread_scheduler.place(len(max(batch, key=len))+1)
+        print("Placed on " + backend.name + " (" + str(pending) + " pending jobs, expected to finish in " + str(round(expected)) + "s)")
+        transpiled_qcs = transpile_qcs(qcs[i:i+batch_size], backend)
+        job = submit_batch(backend, batch, qcs[i:i+batch_size], transpiled_qcs, shots, tag)
+        spread_scheduler.record(job, backend, len(batch), pending, expected)
+        if cache != None:
+            cache.add_jobs(batch, oracle, backend.name, shots, job.job_id())
+    print("Jobs placed:", spread_scheduler.summary())
+
+# Submits packed circuits (see packing.py) to the backend as a single job
+# Job data is saved for each secret with its circuit's position in the job and the classical register holding its output
+def submit_packed(backend, secrets:list[str], qcs:list[QuantumCircuit], packed:list, shots:int, tag:str=""):
+    with tracing.span("backend.run", circuits=len(packed)):
+        if len(packed) == 1:
+            job = backend.run(packed[0].qc, shots=shots)
+        else:
+            job = backend.run([p.qc for p in packed], shots=shots)
+    tracing.count("jobs")
+    tracing.count("shots", shots*len(packed))
+    with tracing.span("job.update_tags"):
+        job.update_tags(get_job_tags([secrets[k] for p in packed for k in p.secrets], tag))
+
+    print("Job ID:", job.job_id())
+
+    # Save job data to be retrieved later
+    job_datas = []
+    for i, p in enumerate(packed):
+        index = None if len(packed) == 1 else i
+        for slot, k in enumerate(p.secrets):
+            job_datas.append(JobData(job.job_id(), backend.name, secrets[k], shots, tag, index, slot=slot))
+    save_job_datas(job_datas)
+
+    for p in packed:
+        for k, tqc in zip(p.secrets, p.instance_qcs):
+            # Save each secret's circuit as routed on its part of the device
+            result_data = ResultData(backend.name, secrets[k], shots, counts=None, qc=qcs[k], tqc=tqc, id=job.job_id())
+            save_result(result_data)
+    print("Job data saved")
+
+    return job
+
+# Tags for a job: `run_bv_<secret>` for each secret and the run's tag, if any
+def get_job_tags(secrets:list[str], tag:str="")->list[str]:
+    job_tags = list(dict.fromkeys("run_bv_"+secret for secret in secrets))
+    if tag != None and tag != "":
+        job_tags.append(tag)
+    return job_tags
+
 
 # Run a local simulation of quantum circuit
-def run_local_sim(qc:QuantumCircuit,secret:str)->ResultData:
-    sim_backend = BasicSimulator()
-    sim_result = sim_backend.run(qc, shots=shots).result()
-    counts = sim_result.get_counts()
+# method is "stabilizer" (fast exact simulation of H/X/CX circuits), "basic" (qiskit BasicSimulator)
+# or "auto" which uses the stabilizer simulator when it supports the circuit.
+# Returns None if the circuit is too large for the BasicSimulator.
+@tracing.timed()
+def run_local_sim(qc:QuantumCircuit,secret:str, shots:int = 4000, method:str = "auto", seed = None)->ResultData:
+    if method == "auto":
+        method = "stabilizer" if stabilizer_sim.is_supported(qc) else "basic"
+
+    if method == "stabilizer":
+        backend_name = stabilizer_sim.NAME
+        counts = stabilizer_sim.simulate_counts(qc, shots, seed)
+    else:
+        if qc.num_qubits > MAX_BASIC_SIM_QUBITS:
+            return None
+        from qiskit.providers.basic_provider import BasicSimulator
+        sim_backend = BasicSimulator()
+        backend_name = sim_backend.name
+        sim_result = sim_backend.run(qc, shots=shots, seed_simulator=seed).result()
+        counts = sim_result.get_counts()
     # save result
     data = ResultData(
-        sim_backend.name,
+        backend_name,
         secret,
         shots,
         counts,
@@ -99,6 +335,12 @@ def run_local_sim(qc:QuantumCircuit,secret:str)->ResultData:
     
     return data
 
+# Run a simulation of quantum circuit with the noise in `noise_model`
+@tracing.timed()
+def run_noisy_sim(qc:QuantumCircuit, secret:str, noise_model:noisy_sim.NoiseModel, shots:int = 4000, tag:str = "", seed = None)->ResultData:
+    counts = noisy_sim.simulate_counts(qc, shots, noise_model, seed)
+    return ResultData(noise_model.name, secret, shots, counts, qc, tag=tag)
+
 # === Utilities ===
 
 # Generate a series of symbolic quantum register strings where all qubits are the `base_char` except for one target `sweep_char`.
@@ -119,6 +361,26 @@ def fill_quantum_reg(base_char:chr, sweep_char:chr, numb_bits:int):
         reg_list.append((sweep_char * i) + (base_char * (numb_bits-i)))
     return reg_list
 
+# Reads the --noise option: either "<readout>,<cx>" error rates or the name of a qiskit fake backend
+def parse_noise(opt:str)->noisy_sim.NoiseModel:
+    if opt.startswith("Fake"):
+        from qiskit_ibm_runtime import fake_provider
+        return noisy_sim.NoiseModel.from_backend(getattr(fake_provider, opt)())
+    readout, cx = (float(p) for p in opt.split(','))
+    return noisy_sim.NoiseModel(readout, cx)
+
+# Returns a lazy iterator over the secrets of size n chosen by the command line options
+def secret_iter(n:int, iters:int, sweep:bool=False, fill:bool=False, every:bool=False, weight:int=None, seed=None, unique:bool=False):
+    if sweep:
+        return iter(sweep_quantum_reg('0','1',n))
+    elif fill:
+        return iter(fill_quantum_reg('0','1',n))
+    elif every:
+        return rand_bin.iter_all(n)
+    elif weight != None:
+        return rand_bin.iter_weight(n, weight, iters, seed)
+    return rand_bin.iter_rand_bits(iters, n, seed, unique)
+
 # === Run from terminal info ===
 # prints script usage instructions to the terminal 
 def print_instructions():
@@ -128,12 +390,33 @@ def print_instructions():
     print("-h \t\t\t\t View Instructions")
     print("-n <number-of-bits> \t\t Specify secret length(s) in comma seperated list [Default = 4]")
     print("-i <number-of-secrets> \t\t Number of random secrets to generate [Default = 1]")
+    print("--seed <int> \t\t\t Seed for random secrets so the same secrets are generated every time")
+    print("--unique \t\t\t Do not repeat random secrets")
+    print("--weight <number-of-ones> \t Only generate secrets with this many 1s (all of them if -i is not given)")
+    print("--all \t\t\t\t Generate every possible secret of the given size(s)")
     print("-b <backend-name> \t\t Specify quantum backend")
     print("-s <binary-secrets> \t\t Specify binary secrets to us in a comman seperated list")
     print("-t <string> \t\t\t add a tag to jobs to help load them later")
     print("--sim \t\t\t\t Only run simulation, not quantum computer. Useful for debugging ")
     print("--shots <number-of-shots> \t Number of shots to run [default=4000]")
+    print("--noise <readout>,<cx> \t Run on the local noisy simulator with the given readout and CX error rates")
+    print("--noise <fake-backend> \t Run on the local noisy simulator with the error rates of a qiskit fake backend (e.g. FakeManilaV2)")
+    print("--batch <number-of-circuits> \t Number of circuits to submit in each job [default=1]")
+    print("-j <number-of-processes> \t Processes used to simulate circuits for validation, 0 for one per core [default=1]")
+    print("--chunk <number-of-secrets> \t Secrets given to a process at a time with -j [default=" + str(parallel_sim.CHUNK_SIZE) + "]")
+    print("--oracle <variant> \t\t Oracle construction: linear, tree (log depth), coupling (nearest neighbour CXs on the backend) or best [default=linear]")
+    print("--adaptive \t\t\t Run shots in rounds, stopping each secret once it is found with enough confidence (--shots is the most per secret)")
+    print("--first-shots <number-of-shots> With --adaptive, shots per secret in the first round [default=" + str(adaptive.FIRST_SHOTS) + "]")
+    print("--confidence <probability> \t With --adaptive, confidence needed in the most common outcome [default=" + str(adaptive.CONFIDENCE) + "]")
+    print("--width <probability> \t With --adaptive, also run until the accuracy's confidence interval is this narrow")
+    print("--no-cache \t\t\t Do not use or add to the result cache (results/cache.db)")
+    print("--force \t\t\t Simulate and submit secrets even if they are in the result cache")
+    print("--spread \t\t\t Spread jobs across every backend with enough qubits, weighing their queues, size and past throughput")
+    print("--pack \t\t\t\t Place as many secrets as fit side by side on the backend in each circuit")
+    print("--share <number-of-secrets> \t With --pack, number of secrets that share each ancilla qubit [default=1]")
     print("--sweep \t\t\t Generate all possible secrets where all qubits except one are a 0 for given size")
+    print("--render <sync|background|later>  Draw figures now, in background processes, or later with render_queue.py [default=sync]")
+    print("--trace <file> \t\t\t Time each stage and save a trace (Chrome format, or one JSON object per line for .jsonl files)")
     print("--fill \t\t\t\t Generate a series of secrets that begins with a secret containing only 0s and slowly fills it with 1s starting from the MSB")
 
 if __name__ == "__main__":
@@ -149,10 +432,29 @@ if __name__ == "__main__":
     backend_name = None
     help_flag = False
     tag = ""
+    batch_size = 1
+    noise_model = None
+    seed = None
+    unique = False
+    weight = None
 
     # Proseduaral options
     sweep = False
     fill = False
+    every = False
+    iters_given = False
+    pack = False
+    oracle = LINEAR
+    adaptive_shots = False
+    first_shots = adaptive.FIRST_SHOTS
+    confidence = adaptive.CONFIDENCE
+    width = None
+    use_cache = True
+    force = False
+    spread = False
+    share = 1
+    workers = 1
+    chunk_size = parallel_sim.CHUNK_SIZE
 
     # Process arguments
     skip_flag = False
@@ -175,7 +477,18 @@ if __name__ == "__main__":
             skip_flag = True
         elif opt == "-i":
             iters = int(argv[i+1])
+            iters_given = True
+            skip_flag = True
+        elif opt == "-seed" or opt == "--seed":
+            seed = int(argv[i+1])
             skip_flag = True
+        elif opt == "-unique" or opt == "--unique":
+            unique = True
+        elif opt == "-weight" or opt == "--weight":
+            weight = int(argv[i+1])
+            skip_flag = True
+        elif opt == "-all" or opt == "--all":
+            every = True
         elif opt == "-s" or opt == "--secrets":
             secrets = argv[i+1].split(',')
             skip_flag = True
@@ -185,6 +498,52 @@ if __name__ == "__main__":
         elif opt == "-shots" or opt == "--shots":
             shots = int(argv[i+1])
             skip_flag = True
+        elif opt == "-trace" or opt == "--trace":
+            tracing.enable(argv[i+1])
+            skip_flag = True
+        elif opt == "-render" or opt == "--render":
+            render_queue.MODE = argv[i+1]
+            skip_flag = True
+        elif opt == "-batch" or opt == "--batch":
+            batch_size = int(argv[i+1])
+            skip_flag = True
+        elif opt == "-j" or opt == "--workers":
+            workers = int(argv[i+1])
+            skip_flag = True
+        elif opt == "-chunk" or opt == "--chunk":
+            chunk_size = int(argv[i+1])
+            skip_flag = True
+        elif opt == "-oracle" or opt == "--oracle":
+            oracle = argv[i+1]
+            if oracle not in VARIANTS + [BEST_ORACLE]:
+                print("Oracle ", oracle, " is not defined.")
+                help_flag = True
+            skip_flag = True
+        elif opt == "-adaptive" or opt == "--adaptive":
+            adaptive_shots = True
+        elif opt == "-first-shots" or opt == "--first-shots":
+            first_shots = int(argv[i+1])
+            skip_flag = True
+        elif opt == "-confidence" or opt == "--confidence":
+            confidence = float(argv[i+1])
+            skip_flag = True
+        elif opt == "-width" or opt == "--width":
+            width = float(argv[i+1])
+            skip_flag = True
+        elif opt == "-no-cache" or opt == "--no-cache":
+            use_cache = False
+        elif opt == "-force" or opt == "--force":
+            force = True
+        elif opt == "-spread" or opt == "--spread":
+            spread = True
+        elif opt == "-pack" or opt == "--pack":
+            pack = True
+        elif opt == "-share" or opt == "--share":
+            share = int(argv[i+1])
+            skip_flag = True
+        elif opt == "-noise" or opt == "--noise":
+            noise_model = parse_noise(argv[i+1])
+            skip_flag = True
         elif opt == "-sweep" or opt == "--sweep":
             sweep = True
         elif opt == "-fill" or opt == "--fill":
@@ -209,13 +568,8 @@ if __name__ == "__main__":
 
     if not help_flag:
         if secrets == None:
-            secrets = []
-            for n in ns:
-                if sweep:
-                    secrets = secrets + sweep_quantum_reg('0','1',n)
-                elif fill:
-                    secrets = secrets + fill_quantum_reg('0','1',n)
-                else:
-                    for i in range(iters):
-                        secrets.append(rand_bits(n))
-        run_bv(secrets=secrets, run=run, sim=sim, shots=shots, backend_name=backend_name, save_sim=save_sim, tag=tag)
\ No newline at end of file
+            # Secrets are generated lazily as they are needed
+            secrets = chain.from_iterable(secret_iter(n, iters if iters_given or weight == None else None, sweep, fill, every, weight, seed, unique) for n in ns)
+        cache = result_cache.get_cache() if use_cache else None
+        shot_policy = adaptive.ShotPolicy(shots, first_shots, confidence, width=width) if adaptive_shots else None
+        run_bv(secrets=secrets, run=run, sim=sim, shots=shots, backend_name=backend_name, save_sim=save_sim, tag=tag, batch_size=batch_size, noise_model=noise_model, pack=pack, share=share, workers=workers, chunk_size=chunk_size, oracle=oracle, shot_policy=shot_policy, cache=cache, force=force, spread=spread)
\ No newline at end of file
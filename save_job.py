@@ -1,56 +1,271 @@
-# Script use to save and load job id to Retrieve past qiskit jobs from IBM quantum computers 
+# Script use to save and load job id to Retrieve past qiskit jobs from IBM quantum computers
+# Jobs are kept in a ledger (SQLite database) that tracks the state of each job so only new results are loaded.
+# A plain text log of all jobs is also kept in jobs.txt.
 
 import os
+import json
+import sqlite3
+import time
+
+import tracing
 
 JOB_FOLDER = ".qiskit_jobs"
 JOB_TXT = "jobs.txt"
+JOB_DB = "jobs.db"
+
+# Job states
+QUEUED = "queued"       # Submitted, results not yet available
+DONE = "done"           # Finished on the backend, results not yet saved
+INGESTED = "ingested"   # Results have been saved
+FAILED = "failed"       # Job failed or was cancelled
+PENDING = [QUEUED, DONE] # States of jobs that still need to be loaded
+
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    slot INTEGER NOT NULL DEFAULT -1,
+    backend TEXT NOT NULL,
+    secret TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    shots INTEGER NOT NULL,
+    tag TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL,
+    updated REAL,
+    PRIMARY KEY (job_id, idx, slot)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state);
+CREATE INDEX IF NOT EXISTS jobs_backend ON jobs(backend);
+CREATE INDEX IF NOT EXISTS jobs_size ON jobs(size);
+CREATE INDEX IF NOT EXISTS jobs_tag ON jobs(tag);
+CREATE TABLE IF NOT EXISTS shot_rounds (
+    run_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    backend TEXT NOT NULL,
+    secret TEXT NOT NULL,
+    tag TEXT NOT NULL DEFAULT '',
+    rounds INTEGER NOT NULL,
+    shots INTEGER NOT NULL,
+    counts TEXT NOT NULL,
+    job_ids TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated REAL,
+    PRIMARY KEY (run_id, idx)
+);
+CREATE TABLE IF NOT EXISTS placements (
+    job_id TEXT PRIMARY KEY,
+    backend TEXT NOT NULL,
+    circuits INTEGER NOT NULL,
+    pending INTEGER NOT NULL,
+    expected REAL NOT NULL,
+    placed REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS placements_backend ON placements(backend);
+"""
 
 # Class used to store useful Job info
+# `index` is the position of the secret's circuit in a multi-circuit job (None if the job has one circuit)
+# `slot` is the classical register holding the secret's output when several secrets are packed in one circuit (see packing.py)
 class JobData:
-    def __init__(self, job_id:str, backend:str, secret:str, shots:int, tag=""):
+    def __init__(self, job_id:str, backend:str, secret:str, shots:int, tag="", index:int=None, state:str=QUEUED, slot:int=None):
         self.job_id = job_id
         self.backend = backend
         self.secret = secret
         self.shots = shots
         self.tag = tag
+        self.index = index
+        self.state = state
+        self.slot = slot
 
-# Save qiksit job data so that it can be retrieved once a job is completed 
-def save_job_data(job_data:JobData):
-    if not os.path.isdir(JOB_FOLDER):
-        os.mkdir(JOB_FOLDER)
+# Counts of one secret combined over the rounds of an adaptive run (see adaptive.py)
+# `index` is the secret's position in the run, `shots` and `counts` are totals over all rounds so far
+# and `job_ids` are the jobs of each round. The state is QUEUED while more rounds may be run.
+class RoundData:
+    def __init__(self, run_id:str, index:int, backend:str, secret:str, tag:str="", rounds:int=0, shots:int=0, counts:dict=None, job_ids:list[str]=None, state:str=QUEUED):
+        self.run_id = run_id
+        self.index = index
+        self.backend = backend
+        self.secret = secret
+        self.tag = tag
+        self.rounds = rounds
+        self.shots = shots
+        self.counts = {} if counts == None else counts
+        self.job_ids = [] if job_ids == None else job_ids
+        self.state = state
 
-    filename = os.path.join(JOB_FOLDER,JOB_TXT)
+    # Adds the counts of another round
+    def add_round(self, job_id:str, counts:dict):
+        for output, freq in counts.items():
+            self.counts[output] = self.counts.get(output, 0) + freq
+        self.shots += sum(counts.values())
+        self.rounds += 1
+        self.job_ids.append(job_id)
 
-    mode = "a"
-    if not os.path.isfile(filename):
-        mode = "w" # Write new file if it does not exist
+_ledger = None # Open connection to the job ledger
 
-    with open(filename, mode=mode) as file:
-        file.write(job_data.job_id+","+job_data.backend+","+job_data.secret+","+str(job_data.shots)+","+job_data.tag+"\n")
+# Returns a connection to the job ledger, creating it (and importing jobs.txt) if required
+def get_ledger()->sqlite3.Connection:
+    global _ledger
+    if _ledger == None:
+        if not os.path.isdir(JOB_FOLDER):
+            os.mkdir(JOB_FOLDER)
+        new_ledger = not os.path.isfile(os.path.join(JOB_FOLDER,JOB_DB))
+        _ledger = sqlite3.connect(os.path.join(JOB_FOLDER,JOB_DB))
+        add_slot_column(_ledger)
+        _ledger.executescript(LEDGER_SCHEMA)
+        add_finished_column(_ledger)
+        if new_ledger:
+            import_job_txt(_ledger)
+    return _ledger
 
-# Load data for all jobs that have been saved and run
-def load_job_datas(size:int=None, query_backend:str=None, query_tag:str=None)->list[JobData]:
-    job_datas = []
+# Ledgers made before circuits could be packed have no slot column (and a key without it), so the table is rebuilt
+def add_slot_column(ledger:sqlite3.Connection):
+    columns = [row[1] for row in ledger.execute("PRAGMA table_info(jobs)")]
+    if len(columns) == 0 or "slot" in columns:
+        return
+    with ledger:
+        ledger.execute("ALTER TABLE jobs RENAME TO jobs_old")
+        for index in ("jobs_state", "jobs_backend", "jobs_size", "jobs_tag"):
+            ledger.execute("DROP INDEX IF EXISTS " + index)
+        ledger.executescript(LEDGER_SCHEMA)
+        ledger.execute("INSERT INTO jobs (job_id, idx, backend, secret, size, shots, tag, state, updated) "
+                       "SELECT job_id, idx, backend, secret, size, shots, tag, state, updated FROM jobs_old ORDER BY rowid")
+        ledger.execute("DROP TABLE jobs_old")
+
+# Placements recorded before finishing times were kept have no finished column
+def add_finished_column(ledger:sqlite3.Connection):
+    columns = [row[1] for row in ledger.execute("PRAGMA table_info(placements)")]
+    if "finished" not in columns:
+        with ledger:
+            ledger.execute("ALTER TABLE placements ADD COLUMN finished REAL")
+
+# Adds jobs saved in jobs.txt (e.g. by older versions of this script) to the ledger as queued jobs
+def import_job_txt(ledger:sqlite3.Connection):
     filename = os.path.join(JOB_FOLDER,JOB_TXT)
     if not os.path.isfile(filename):
-        print("No Jobs Found.")
-        return job_datas
+        return
     with open(filename, "r") as file:
-        lines = file.readlines()
-        for line in lines:
-            job_id, backend, secret, shots, tag = line.split(',')
-            tag = tag.strip()
-            data = JobData(job_id, backend, secret, int(shots),tag)
-
-            # Filter based on backend, size and tag
-            if (not size == None) and size != len(secret):
-                continue
-            if (not query_backend == None) and query_backend != backend:
-                continue
-            if (not query_tag == None) and query_tag != tag:
-                continue
-            job_datas.append(data)
-        
-        file.close()
-    
-    return job_datas
\ No newline at end of file
+        job_datas = [parse_job_line(line) for line in file if line.strip() != ""]
+    add_to_ledger(ledger, job_datas)
+
+# Reads a line of jobs.txt
+def parse_job_line(line:str)->JobData:
+    job_id, backend, secret, shots, tag, *index = line.strip().split(',')
+    slot = int(index[1]) if len(index) > 1 else None
+    index = int(index[0]) if len(index) > 0 and index[0] != "" else None
+    return JobData(job_id, backend, secret, int(shots), tag, index, slot=slot)
+
+def add_to_ledger(ledger:sqlite3.Connection, job_datas:list[JobData]):
+    now = time.time()
+    rows = [(d.job_id, -1 if d.index == None else d.index, -1 if d.slot == None else d.slot, d.backend, d.secret, len(d.secret), d.shots, d.tag, d.state, now) for d in job_datas]
+    with ledger:
+        ledger.executemany("INSERT OR IGNORE INTO jobs VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+
+# Save qiksit job data so that it can be retrieved once a job is completed
+def save_job_data(job_data:JobData):
+    save_job_datas([job_data])
+
+# Save data for several jobs at once (a single ledger transaction)
+@tracing.timed()
+def save_job_datas(job_datas:list[JobData]):
+    ledger = get_ledger()
+
+    filename = os.path.join(JOB_FOLDER,JOB_TXT)
+    with open(filename, mode="a") as file:
+        for job_data in job_datas:
+            line = job_data.job_id+","+job_data.backend+","+job_data.secret+","+str(job_data.shots)+","+job_data.tag
+            if job_data.index != None or job_data.slot != None:
+                line += ","+("" if job_data.index == None else str(job_data.index))
+            if job_data.slot != None:
+                line += ","+str(job_data.slot)
+            file.write(line+"\n")
+
+    add_to_ledger(ledger, job_datas)
+
+# Load data for all jobs that have been saved and run
+# `states` limits the jobs to those in the given states, e.g. PENDING for jobs that have not been loaded yet
+@tracing.timed()
+def load_job_datas(size:int=None, query_backend:str=None, query_tag:str=None, states:list[str]=None)->list[JobData]:
+    if not os.path.isfile(os.path.join(JOB_FOLDER,JOB_DB)) and not os.path.isfile(os.path.join(JOB_FOLDER,JOB_TXT)):
+        print("No Jobs Found.")
+        return []
+
+    # Filter based on backend, size, tag and state
+    clauses = []
+    params = []
+    for column, value in (("size", size), ("backend", query_backend), ("tag", query_tag)):
+        if value != None:
+            clauses.append(column + " = ?")
+            params.append(value)
+    if states != None:
+        clauses.append("state IN (" + ",".join("?" * len(states)) + ")")
+        params += states
+    where = "" if len(clauses) == 0 else " WHERE " + " AND ".join(clauses)
+
+    rows = get_ledger().execute("SELECT job_id, backend, secret, shots, tag, idx, state, slot FROM jobs" + where + " ORDER BY rowid", params)
+    return [JobData(job_id, backend, secret, shots, tag, None if idx == -1 else idx, state, None if slot == -1 else slot)
+            for job_id, backend, secret, shots, tag, idx, state, slot in rows]
+
+# Saves the combined counts of adaptive runs, replacing what was saved for the same secrets before
+@tracing.timed()
+def save_round_datas(round_datas:list[RoundData]):
+    now = time.time()
+    rows = [(d.run_id, d.index, d.backend, d.secret, d.tag, d.rounds, d.shots, json.dumps(d.counts), ",".join(d.job_ids), d.state, now) for d in round_datas]
+    with get_ledger() as ledger:
+        # Updated in place so rows stay in the order the secrets were first saved
+        ledger.executemany("INSERT INTO shot_rounds VALUES (?,?,?,?,?,?,?,?,?,?,?) ON CONFLICT (run_id, idx) DO UPDATE SET "
+                           "rounds = excluded.rounds, shots = excluded.shots, counts = excluded.counts, "
+                           "job_ids = excluded.job_ids, state = excluded.state, updated = excluded.updated", rows)
+
+# Loads the combined counts of an adaptive run (or of every run), optionally only those in the given states
+def load_round_datas(run_id:str=None, states:list[str]=None)->list[RoundData]:
+    clauses = []
+    params = []
+    if run_id != None:
+        clauses.append("run_id = ?")
+        params.append(run_id)
+    if states != None:
+        clauses.append("state IN (" + ",".join("?" * len(states)) + ")")
+        params += states
+    where = "" if len(clauses) == 0 else " WHERE " + " AND ".join(clauses)
+    rows = get_ledger().execute("SELECT run_id, idx, backend, secret, tag, rounds, shots, counts, job_ids, state FROM shot_rounds" + where + " ORDER BY rowid", params)
+    return [RoundData(run_id, idx, backend, secret, tag, rounds, shots, json.loads(counts), job_ids.split(",") if job_ids != "" else [], state)
+            for run_id, idx, backend, secret, tag, rounds, shots, counts, job_ids, state in rows]
+
+# Records which backend the scheduler placed a job on (see scheduler.py), with the backend's queue length at the time
+# and the expected seconds until the job finishes
+def save_placement(job_id:str, backend:str, circuits:int, pending:int, expected:float):
+    with get_ledger() as ledger:
+        ledger.execute("INSERT OR REPLACE INTO placements VALUES (?,?,?,?,?,?,?)", (job_id, backend, circuits, pending, expected, time.time(), None))
+
+# Returns the ids of the given jobs that were placed by the scheduler and have no finishing time yet
+def unfinished_placements(job_ids:list[str])->set:
+    placed = set()
+    for i in range(0, len(job_ids), 500): # SQLite limits the number of parameters
+        part = job_ids[i:i+500]
+        rows = get_ledger().execute("SELECT job_id FROM placements WHERE finished IS NULL AND job_id IN (" + ",".join("?" * len(part)) + ")", part)
+        placed.update(job_id for job_id, in rows)
+    return placed
+
+# Records when placed jobs finished running on their backend, from a list of (job id, seconds since the epoch)
+def save_placements_finished(finished:list[tuple]):
+    with get_ledger() as ledger:
+        ledger.executemany("UPDATE placements SET finished = ? WHERE job_id = ?", [(when, job_id) for job_id, when in finished])
+
+# Returns (seconds from placement until the job finished on the backend, queue length at placement) for the last
+# `limit` placed jobs on the backend that have finished, newest first
+def placement_history(backend:str, limit:int=50)->list[tuple]:
+    rows = get_ledger().execute("SELECT finished - placed, pending FROM placements WHERE backend = ? AND finished IS NOT NULL "
+                                "ORDER BY placed DESC LIMIT ?", (backend, limit))
+    return rows.fetchall()
+
+# Updates the state of the given jobs in the ledger
+@tracing.timed()
+def set_job_state(job_datas:list[JobData], state:str):
+    now = time.time()
+    for job_data in job_datas:
+        job_data.state = state
+    rows = [(state, now, d.job_id, -1 if d.index == None else d.index, -1 if d.slot == None else d.slot) for d in job_datas]
+    with get_ledger() as ledger:
+        ledger.executemany("UPDATE jobs SET state = ?, updated = ? WHERE job_id = ? AND idx = ? AND slot = ?", rows)
@@ -0,0 +1,87 @@
+# Spreads jobs across every quantum computer with enough qubits instead of sending them all to the least busy one.
+# Each job goes to the backend where it is expected to finish first:
+#   expected seconds = (pending jobs + jobs placed here since the queues were read + 1) * seconds per job * size penalty
+# Pending jobs are read from the backends' live status and read again every `refresh` seconds, so later jobs move to
+# other backends as queues grow or drain. Backends whose status can not be read, or that are not operational, are left
+# out until their status is read successfully. Seconds per job is the backend's past throughput, estimated from the jobs
+# placed on it before (see save_job.placement_history). The size penalty prefers the smallest backend with enough
+# qubits, leaving larger ones for larger secrets.
+# Every placement is recorded in the job ledger (save_job.save_placement).
+#
+# Runs offline against fake_service.FakeService with simulated queues (fake_service.FakeQueue).
+
+import time
+from statistics import median
+
+from save_job import save_placement, placement_history
+
+JOB_SECONDS = 60.0  # Seconds per job for backends with no past placements
+QUBIT_WEIGHT = 0.1  # Penalty for unused qubits, as a fraction of the backend's qubits
+REFRESH = 30.0      # Seconds before the backends' pending jobs are read again
+HISTORY = 50        # Past placements used to estimate each backend's throughput
+
+# Places jobs on the backends of `service` with at least `min_qubits` qubits
+class Scheduler:
+    def __init__(self, service, min_qubits:int, refresh:float=REFRESH, qubit_weight:float=QUBIT_WEIGHT):
+        self.backends = service.backends(simulator=False, operational=True, min_num_qubits=min_qubits)
+        if len(self.backends) == 0:
+            raise ValueError("No backend has " + str(min_qubits) + " qubits")
+        self.refresh = refresh
+        self.qubit_weight = qubit_weight
+        self.job_seconds = {backend.name: job_seconds(backend.name) for backend in self.backends}
+        self.placed = {backend.name: 0 for backend in self.backends}  # Jobs placed on each backend by this scheduler
+        self.read_queues()
+
+    # Reads the pending jobs of every backend (None for backends that can not take jobs), which from now on include
+    # the jobs placed so far
+    def read_queues(self):
+        self.pending = {backend.name: pending_jobs(backend) for backend in self.backends}
+        self.assigned = {backend.name: 0 for backend in self.backends}  # Jobs placed since the queues were read
+        self.read_time = time.time()
+
+    # Seconds until a new job needing `num_qubits` qubits would be expected to finish on the backend
+    def expected_seconds(self, backend, num_qubits:int)->float:
+        waiting = self.pending[backend.name] + self.assigned[backend.name] + 1
+        penalty = 1 + self.qubit_weight * (backend.num_qubits - num_qubits) / backend.num_qubits
+        return waiting * self.job_seconds[backend.name] * penalty
+
+    # Chooses the backend for a job needing `num_qubits` qubits and counts the job against its queue
+    # Returns the backend, its pending jobs and the expected seconds until the job finishes
+    def place(self, num_qubits:int)->tuple:
+        if time.time() - self.read_time >= self.refresh:
+            self.read_queues()
+        candidates = [backend for backend in self.backends if backend.num_qubits >= num_qubits and self.pending[backend.name] != None]
+        if len(candidates) == 0:
+            raise ValueError("No backend with " + str(num_qubits) + " qubits is available")
+        backend = min(candidates, key=lambda b: self.expected_seconds(b, num_qubits))
+        expected = self.expected_seconds(backend, num_qubits)
+        pending = self.pending[backend.name] + self.assigned[backend.name]
+        self.assigned[backend.name] += 1
+        self.placed[backend.name] += 1
+        return backend, pending, expected
+
+    # Records the job submitted after a call to place in the job ledger
+    def record(self, job, backend, circuits:int, pending:int, expected:float):
+        save_placement(job.job_id(), backend.name, circuits, pending, expected)
+
+    # Jobs placed on each backend, e.g. "ibm_a: 3, ibm_b: 1"
+    def summary(self)->str:
+        return ", ".join(name + ": " + str(count) for name, count in self.placed.items() if count > 0)
+
+# Pending jobs on the backend, None if its status can not be read or it is not operational
+def pending_jobs(backend)->int:
+    try:
+        status = backend.status()
+        if not getattr(status, "operational", True):
+            return None
+        return int(status.pending_jobs)
+    except Exception:
+        return None
+
+# Seconds the backend took to run each job in its past placements: the time from placement until the job finished
+# (recorded by load_results.py), shared between the job and the jobs queued ahead of it
+def job_seconds(backend_name:str)->float:
+    history = placement_history(backend_name, HISTORY)
+    if len(history) == 0:
+        return JOB_SECONDS
+    return max(1.0, median(turnaround / (pending + 1) for turnaround, pending in history))
@@ -1,8 +1,9 @@
 # Used to create a qikskit runtime service
-from qiskit_ibm_runtime import QiskitRuntimeService
+# qiskit_ibm_runtime is slow to import, so it is only imported when a service is needed
 
 # Set IBM Qiskit API token and credentials for future reference 
 def set_service():
+    from qiskit_ibm_runtime import QiskitRuntimeService
     print("Please input IBM Qiskist API token")
     token = input()
 
@@ -13,6 +14,7 @@ def set_service():
 
 # Return IBM service credentials, set new credentials with API token if required
 def get_service():
+    from qiskit_ibm_runtime import QiskitRuntimeService
     try:
         return QiskitRuntimeService()
     except:
@@ -0,0 +1,183 @@
+# Fast exact simulator for circuits made only of Clifford gates (H, X, Y, Z, CX, CZ, SWAP) with measurements at the end.
+# BV test circuits from make_qc_oracle only use H, X and CX, so they can be validated here for thousands of qubits
+# where a dense statevector simulator would need 2^n amplitudes.
+#
+# Each measured Z is propagated backwards through the circuit (Heisenberg picture) as a signed Pauli string.
+# A Pauli with no X/Y component has a fixed value on |0...0>, so the measured bit is just its sign.
+# Otherwise the measurement is random and outcomes are sampled uniformly from the allowed (affine) set.
+
+import numpy as np
+from qiskit import QuantumCircuit
+
+NAME = "stabilizer_simulator"
+SUPPORTED_GATES = {"h", "x", "y", "z", "cx", "cz", "swap", "id", "barrier", "measure"}
+
+# Returns True if the circuit can be simulated by this module
+def is_supported(qc:QuantumCircuit)->bool:
+    try:
+        instructions(qc)
+    except ValueError:
+        return False
+    return True
+
+# Simulates the circuit and returns qiskit style counts (clbit 0 is the rightmost character)
+def simulate_counts(qc:QuantumCircuit, shots:int, seed=None)->dict:
+    ops, measures = instructions(qc)
+    x, z, r = _measured_paulis(qc.num_qubits, ops, measures)
+    clbits = [clbit for _, clbit in measures]
+
+    if not x.any():
+        # Every measurement is deterministic, so all shots give the same output
+        return counts_from_outcomes(qc, clbits, r.reshape(1, -1), np.array([shots]))
+
+    rng = np.random.default_rng(seed)
+    outcomes = _sample_outcomes(x, z, r, shots, rng)
+    rows, freqs = unique_outcomes(outcomes)
+    return counts_from_outcomes(qc, clbits, rows, freqs)
+
+# Returns one sample of the measurement outcomes (in the order of `measures` from `instructions`)
+def reference_sample(qc:QuantumCircuit, seed=None)->np.ndarray:
+    ops, measures = instructions(qc)
+    x, z, r = _measured_paulis(qc.num_qubits, ops, measures)
+    if not x.any():
+        return r.copy()
+    return _sample_outcomes(x, z, r, 1, np.random.default_rng(seed))[0].astype(bool)
+
+# Lists the circuit's gates as (name, qubit indices) and its measurements as (qubit, clbit) in circuit order.
+# Raises a ValueError if the circuit cannot be simulated by this module
+def instructions(qc:QuantumCircuit):
+    qubit_index = {q: i for i, q in enumerate(qc.qubits)}
+    clbit_index = {c: i for i, c in enumerate(qc.clbits)}
+    ops = []
+    measures = []   # (qubit, clbit) in order
+    measured = set()
+    for inst in qc.data:
+        name = inst.operation.name
+        if name not in SUPPORTED_GATES:
+            raise ValueError("Gate '" + name + "' is not supported by the stabilizer simulator")
+        qubits = [qubit_index[q] for q in inst.qubits]
+        if name == "measure":
+            measures.append((qubits[0], clbit_index[inst.clbits[0]]))
+            measured.add(qubits[0])
+        elif name != "barrier" and name != "id":
+            if measured.intersection(qubits):
+                raise ValueError("Gates after a measurement are not supported by the stabilizer simulator")
+            ops.append((name, qubits))
+    return ops, measures
+
+# Propagates a Z for each measurement backwards to the start of the circuit.
+# Returns the x and z parts (qubits x measurements) and the sign of each Pauli.
+def _measured_paulis(n:int, ops:list, measures:list):
+    m = len(measures)
+    x = np.zeros((n, m), dtype=bool)
+    z = np.zeros((n, m), dtype=bool)
+    r = np.zeros(m, dtype=bool)
+    for j, (q, _) in enumerate(measures):
+        z[q, j] = True
+
+    # All gates are self inverse so conjugating backwards uses the usual tableau update rules
+    for name, qubits in reversed(ops):
+        if name == "h":
+            a = qubits[0]
+            r ^= x[a] & z[a]
+            x[a], z[a] = z[a].copy(), x[a].copy()
+        elif name == "x":
+            r ^= z[qubits[0]]
+        elif name == "z":
+            r ^= x[qubits[0]]
+        elif name == "y":
+            r ^= x[qubits[0]] ^ z[qubits[0]]
+        elif name == "cx":
+            c, t = qubits
+            r ^= x[c] & z[t] & ~(x[t] ^ z[c])
+            x[t] ^= x[c]
+            z[c] ^= z[t]
+        elif name == "cz":
+            c, t = qubits
+            r ^= x[c] & x[t] & (z[c] ^ z[t])
+            z[c] ^= x[t]
+            z[t] ^= x[c]
+        elif name == "swap":
+            a, b = qubits
+            x[[a, b]] = x[[b, a]]
+            z[[a, b]] = z[[b, a]]
+
+    return x, z, r
+
+# Samples outcomes of measurements whose Paulis do not all commute with Z on every qubit.
+# Gaussian elimination on the x parts splits the Paulis into independent random ones and fixed products.
+# Returns a (shots x measurements) array of outcome bits.
+def _sample_outcomes(x, z, r, shots, rng):
+    x = x.T.copy()  # one row per measurement
+    z = z.T.copy()
+    r = r.copy()
+    m, n = x.shape
+    T = np.eye(m, dtype=bool) # maps row outcomes back to measurement outcomes
+
+    random_rows = np.zeros(m, dtype=bool)
+    row = 0
+    for col in range(n):
+        if row == m:
+            break
+        pivots = np.flatnonzero(x[row:, col]) + row
+        if len(pivots) == 0:
+            continue
+        p = pivots[0]
+        if p != row:
+            x[[row, p]] = x[[p, row]]
+            z[[row, p]] = z[[p, row]]
+            r[[row, p]] = r[[p, row]]
+            T[:, [row, p]] = T[:, [p, row]]
+        others = np.flatnonzero(x[:, col])
+        others = others[others != row]
+        if len(others) > 0:
+            r[others] = _product_sign(x[others], z[others], r[others], x[row], z[row], r[row])
+            x[others] ^= x[row]
+            z[others] ^= z[row]
+            T[:, row] ^= np.bitwise_xor.reduce(T[:, others], axis=1)
+        random_rows[row] = True
+        row += 1
+
+    # Rows left with no x part are fixed by their sign, the rest are independent fair coins
+    v = np.broadcast_to(r, (shots, m)).copy()
+    v[:, random_rows] = rng.integers(0, 2, size=(shots, int(random_rows.sum()))).astype(bool)
+    return (v.astype(np.int64) @ T.T.astype(np.int64)) % 2
+
+# Sign of the products P_h * P_i for commuting Paulis (rowsum from Aaronson & Gottesman)
+def _product_sign(xh, zh, rh, xi, zi, ri):
+    xi = xi.astype(np.int64)
+    zi = zi.astype(np.int64)
+    xh = xh.astype(np.int64)
+    zh = zh.astype(np.int64)
+    g = np.where(xi & zi, zh - xh, 0)
+    g += np.where(xi & (1 - zi), zh * (2*xh - 1), 0)
+    g += np.where((1 - xi) & zi, xh * (1 - 2*zh), 0)
+    total = 2*rh.astype(np.int64) + 2*int(ri) + g.sum(axis=1)
+    return (total % 4) == 2
+
+# Returns the distinct rows of a (shots, bits) outcome array and how often each appears
+# Rows are packed into bytes first, which is much faster than np.unique(axis=0) for wide outcomes
+def unique_outcomes(outcomes:np.ndarray):
+    packed = np.ascontiguousarray(np.packbits(outcomes, axis=1))
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, first, freqs = np.unique(keys, return_index=True, return_counts=True)
+    return outcomes[first], freqs
+
+# Builds qiskit style counts from rows of measurement outcome bits (in the order of `clbits`) and their frequencies
+def counts_from_outcomes(qc:QuantumCircuit, clbits:list, rows:np.ndarray, freqs:np.ndarray)->dict:
+    values = np.zeros((len(rows), qc.num_clbits), dtype=np.uint8)
+    values[:, clbits] = rows
+    # Each register is written with its last bit first, with registers separated by spaces (last register first)
+    clbit_index = {c: i for i, c in enumerate(qc.clbits)}
+    columns = []
+    for creg in reversed(qc.cregs):
+        if len(columns) > 0:
+            columns.append(-1)
+        columns += [clbit_index[b] for b in reversed(creg)]
+    columns = np.array(columns, dtype=int)
+    bits = columns != -1
+    chars = np.full((len(rows), len(columns)), ord(' '), dtype=np.uint8)
+    chars[:, bits] = values[:, columns[bits]] + ord('0')
+    width = len(columns)
+    text = chars.tobytes().decode("ascii")
+    return {text[i*width:(i+1)*width]: int(freq) for i, freq in enumerate(freqs)}
@@ -0,0 +1,35 @@
+# Result summaries (write_results.ResultData.summary) and their figures (render_queue.plot_summary)
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+import render_queue
+import write_results
+from write_results import ResultData
+
+# Qubit 0 flips in every shot and the other qubits never flip, so their Wilson bounds are at 0 and 1
+def zero_and_all_flips()->ResultData:
+    return ResultData("fake_manila", "101", 4000, {"100": 4000})
+
+def test_summary_counts():
+    summary = zero_and_all_flips().summary()
+    assert summary["top"] == [["100", 4000]]
+    assert summary["hamming"] == [0, 4000, 0, 0]
+    assert summary["flips"] == [4000, 0, 0]
+
+def test_plot_summary_zero_and_all_flips():
+    fig = render_queue.plot_summary(zero_and_all_flips().summary())
+    plt.close(fig)
+
+def test_save_result_renders_summary(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(render_queue, "MODE", render_queue.SYNC)
+    monkeypatch.setattr(render_queue, "_manifest", None) # Kept in this folder and forgotten afterwards
+    monkeypatch.setattr(render_queue, "_submitted", {})
+    result = zero_and_all_flips()
+    write_results.save_result(result, store=False)
+    render_queue.wait()
+    folder = tmp_path / write_results.get_job_folder(result.secret)
+    assert (folder / "fake_manila_summary.json").is_file()
+    assert (folder / "fake_manila_summary.png").is_file()
@@ -0,0 +1,145 @@
+# Lightweight timing and tracing of the stages of run_bv and load_results.
+# Stages are timed with `with tracing.span("name"):` or the `@tracing.timed()` decorator and totals (circuits, shots,
+# bytes written, ...) are kept with `tracing.count("name", value)`. Nothing is recorded unless tracing is enabled,
+# in which case a trace file is written and a summary table printed when the program exits:
+#   python run_bv.py --trace run.json           # Chrome trace, open in chrome://tracing or https://ui.perfetto.dev
+#   python load_results.py --trace load.jsonl   # one JSON object per span and counter
+# When disabled a span or counter costs one function call and a check of ENABLED.
+
+import os
+import json
+import time
+import atexit
+import threading
+from functools import wraps
+
+ENABLED = False
+CHROME = "chrome"   # {"traceEvents": [...]} format read by Chrome and Perfetto
+JSON = "json"       # One JSON object per line
+
+_events = []    # Completed spans as (name, start, duration, thread id, args)
+_counters = {}  # name -> total
+_lock = threading.Lock()
+_start = None
+_filename = None
+_format = None
+
+# A timed stage, recorded when the `with` block ends
+class Span:
+    def __init__(self, name:str, args:dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type != None:
+            self.args["error"] = exc_type.__name__
+        _events.append((self.name, self.start, end - self.start, threading.get_ident(), self.args))
+        return False
+
+# Stands in for Span when tracing is disabled
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_null_span = NullSpan()
+
+# Returns a context manager that times the stage `name`; keyword arguments are saved with the span in the trace
+def span(name:str, **args):
+    if not ENABLED:
+        return _null_span
+    return Span(name, args)
+
+# Decorator that times every call of a function as a span (named after the function unless `name` is given)
+def timed(name:str=None):
+    def decorate(fn):
+        span_name = fn.__name__ if name == None else name
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with Span(span_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# Adds `value` to the counter `name`
+def count(name:str, value:int=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+# Starts recording. If a filename is given the trace is written to it at exit, in Chrome format unless the
+# filename ends in .jsonl or `fmt` is JSON. A summary table is printed at exit either way.
+def enable(filename:str=None, fmt:str=None):
+    global ENABLED, _start, _filename, _format
+    if ENABLED:
+        return
+    ENABLED = True
+    _start = time.perf_counter()
+    _filename = filename
+    _format = fmt if fmt != None else (JSON if filename != None and filename.endswith(".jsonl") else CHROME)
+    atexit.register(finish)
+
+# Stops recording, writes the trace file (if any) and prints the summary
+def finish():
+    global ENABLED
+    if not ENABLED:
+        return
+    ENABLED = False
+    if _filename != None:
+        write_trace(_filename, _format)
+        print("Trace written to", _filename)
+    print(summary())
+
+# Clears everything recorded so far
+def reset():
+    global _start
+    with _lock:
+        _events.clear()
+        _counters.clear()
+    _start = time.perf_counter()
+
+def write_trace(filename:str, fmt:str=CHROME):
+    pid = os.getpid()
+    start = _start if _start != None else 0.0
+    with open(filename, "w") as file:
+        if fmt == CHROME:
+            events = [{"name": name, "ph": "X", "ts": (t - start)*1e6, "dur": d*1e6, "pid": pid, "tid": tid, "args": args}
+                      for name, t, d, tid, args in list(_events)]
+            end = (time.perf_counter() - start)*1e6
+            events += [{"name": name, "ph": "C", "ts": end, "pid": pid, "args": {name: value}} for name, value in _counters.items()]
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        else:
+            for name, t, d, tid, args in list(_events):
+                file.write(json.dumps({"span": name, "start": t - start, "seconds": d, "thread": tid, "args": args}) + "\n")
+            for name, value in _counters.items():
+                file.write(json.dumps({"counter": name, "value": value}) + "\n")
+
+# Returns (name, calls, total seconds, max seconds) for each stage, slowest total first
+def stage_totals()->list[tuple]:
+    totals = {}
+    for name, _, d, _, _ in list(_events):
+        calls, total, longest = totals.get(name, (0, 0.0, 0.0))
+        totals[name] = (calls + 1, total + d, max(longest, d))
+    return sorted(((name,) + t for name, t in totals.items()), key=lambda row: -row[2])
+
+# Table of time spent in each stage and the counters
+def summary()->str:
+    wall = time.perf_counter() - _start if _start != None else 0.0
+    lines = [f"{'stage':28s} {'calls':>8s} {'total s':>10s} {'mean ms':>10s} {'max ms':>10s} {'% run':>7s}"]
+    for name, calls, total, longest in stage_totals():
+        share = 100*total/wall if wall > 0 else 0.0
+        lines.append(f"{name:28s} {calls:8d} {total:10.3f} {1000*total/calls:10.3f} {1000*longest:10.3f} {share:7.1f}")
+    lines.append(f"{'run':28s} {'':8s} {wall:10.3f}")
+    for name, value in sorted(_counters.items()):
+        lines.append(f"{name:28s} {value:>8}")
+    return "\n".join(lines)
@@ -2,21 +2,45 @@
 
 import os
 import csv
+import json
+import hashlib
+import uuid
+from typing import TYPE_CHECKING
 
-import matplotlib
-from qiskit.visualization import plot_histogram
-from qiskit import QuantumCircuit
+import render_queue
+import analytics
+import tracing
+from render_queue import RenderTask
+
+# matplotlib and qiskit.visualization are slow to import so they are only imported when a figure is drawn (see render_queue)
+if TYPE_CHECKING:
+    from qiskit import QuantumCircuit
 
 FOLDER = "results"
 SUB_FOLDER = "secrets"
 TXT_FILE = "results"    # Stores a log of all tests and results 
 QC_FILE = "qc"         # latex code and svg for undtraspiled circuit
 HIST_FIG = "hist"   # svg for result histrogram
+SUMMARY_FIG = "summary" # png and json of the result summary (see ResultData.summary)
+HIST_MAX_BITS = 6   # Longest secret drawn as a full histogram
+TOP_K = 10          # Most common outputs kept in result summaries
 CSV_FILE ="results"     # CSV contining all results for jobs with a certian size
+MAX_FOLDER_SECRET = 128 # Longest secret written out in full in a folder name
+SPARSE_SUFFIX = "_sparse" # Added to CSV_FILE name for long format results
+SPARSE_HEADER = ["id", "backend", "secret", "shots", "output", "frequency"]
+DENSE_CSV_MAX_BITS = 10 # Largest secret written as one column per possible output
+SIM_BACKENDS = ["basic_simulator", "stabilizer_simulator"] # Local simulators with perfectly accurate results
 
 # Contains important info for a given test result
+# Counts are kept either as a dict of output bitstrings (qiskit's format) or, after `compact()`, as arrays:
+# `outcomes` holds one distinct output per row packed into bytes (first character in the most significant bit of
+# the first byte, as in rand_bin.rand_bits_packed) and `freqs` how many shots gave it. The arrays use much less
+# memory than the dict and the error analysis methods work on them directly. Reading `counts` turns them back
+# into the dict form, so writers that use counts work with either form.
 class ResultData:
-    def __init__(self, backend:str, secret:str, shots:int, counts=None, qc:QuantumCircuit=None, tqc:QuantumCircuit=None, id:str="", tag:str=""):
+    __slots__ = ("backend", "secret", "shots", "_counts", "_outcomes", "_freqs", "_width", "qc", "tqc", "id", "tag")
+
+    def __init__(self, backend:str, secret:str, shots:int, counts=None, qc:"QuantumCircuit"=None, tqc:"QuantumCircuit"=None, id:str="", tag:str=""):
         self.backend = backend
         self.secret = secret
         self.shots = shots
@@ -25,32 +49,174 @@ class ResultData:
         self.tqc = tqc
         self.id = id
         self.tag = tag
-    
+
+    # Makes a result from outcome arrays (see above), `width` is the number of characters in each output
+    @classmethod
+    def from_arrays(cls, backend:str, secret:str, shots:int, outcomes, freqs, width:int=None, id:str="", tag:str="")->"ResultData":
+        result = cls(backend, secret, shots, id=id, tag=tag)
+        result._outcomes = outcomes
+        result._freqs = freqs
+        result._width = len(secret) if width == None else width
+        return result
+
+    @property
+    def counts(self)->dict:
+        if self._counts == None and self._outcomes is not None:
+            self._counts = arrays_to_counts(self._outcomes, self._freqs, self._width)
+            self._outcomes = self._freqs = self._width = None
+        return self._counts
+
+    @counts.setter
+    def counts(self, counts:dict):
+        self._counts = counts
+        self._outcomes = self._freqs = self._width = None
+
+    # Replaces the counts dict with outcome arrays to save memory
+    def compact(self)->"ResultData":
+        if self._counts != None:
+            self._outcomes, self._freqs, self._width = counts_to_arrays(self._counts)
+            self._counts = None
+        return self
+
+    # Returns the (outcomes, freqs) arrays without changing how the counts are stored
+    def arrays(self):
+        if self._counts != None:
+            outcomes, freqs, _ = counts_to_arrays(self._counts)
+            return outcomes, freqs
+        return self._outcomes, self._freqs
+
     def secret_len(self):
         return len(self.secret)
-    
-    # Find success rate 
+
+    # Find success rate
     def accuracy(self):
+        if self._counts == None and self._outcomes is not None:
+            import numpy as np
+            hits = np.all(self._outcomes == pack_output(self.secret), axis=1)
+            return int(self._freqs[hits].sum())/self.shots
         if self.secret in self.counts.keys():
             return self.counts[self.secret]/self.shots
         else:
             return 0.0
 
+    # Fraction of shots in which each qubit's output differed from the secret, indexed by qubit (qubit 0 is the last bit)
+    def flip_rates(self):
+        return self.flip_counts() / self.shots
+
+    # Number of shots in which each qubit's output differed from the secret, indexed by qubit (qubit 0 is the last bit)
+    # `errors` can be given from error_bits so that the counts are not converted again
+    def flip_counts(self, errors:tuple=None):
+        bits, freqs = self.error_bits() if errors == None else errors
+        return (freqs @ bits)[::-1]
+
+    # Fraction of shots whose output was at each Hamming distance (0 to n) from the secret
+    def error_spectrum(self):
+        return self.hamming_counts() / self.shots
+
+    # Number of shots whose output was at each Hamming distance (0 to n) from the secret
+    # `errors` can be given from error_bits so that the counts are not converted again
+    def hamming_counts(self, errors:tuple=None):
+        import numpy as np
+        bits, freqs = self.error_bits() if errors == None else errors
+        return np.bincount(bits.sum(axis=1), weights=freqs, minlength=self.secret_len()+1)
+
+    # Returns a (distinct outputs, n) array of 0/1 values where each output differs from the secret, and the shots of
+    # each output. `arrays` can be given from arrays() so that the counts are not converted again
+    def error_bits(self, arrays:tuple=None)->tuple:
+        import numpy as np
+        outcomes, freqs = self.arrays() if arrays == None else arrays
+        return np.unpackbits(outcomes ^ pack_output(self.secret), axis=1)[:, :self.secret_len()], freqs
+
+    # Counts of the outputs of the given qubits only (qubit 0 is the last bit), written with the last listed qubit first
+    def marginal(self, qubits:list[int])->dict:
+        import numpy as np
+        outcomes, freqs = self.arrays()
+        n = self.secret_len()
+        columns = [n-1-q for q in reversed(qubits)]
+        bits = np.unpackbits(outcomes, axis=1)[:, columns]
+        rows, inverse = np.unique(np.packbits(bits, axis=1), axis=0, return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=freqs).astype(np.int64)
+        return arrays_to_counts(rows, totals, len(qubits))
+
+    # Summary of the result that can be made for any size of secret, in one pass over the distinct outputs:
+    # the `k` most common outputs with their counts, the number of shots at each Hamming distance (0 to n) from the
+    # secret (hamming_counts), and the number of shots in which each qubit's output was wrong (flip_counts)
+    def summary(self, k:int=TOP_K)->dict:
+        import numpy as np
+        from rand_bin import packed_to_strs
+        outcomes, freqs = self.arrays()
+        n = self.secret_len()
+        errors = self.error_bits((outcomes, freqs))
+        hamming = self.hamming_counts(errors)
+        flips = self.flip_counts(errors)
+        top = np.argpartition(-freqs, k)[:k] if len(freqs) > k else np.arange(len(freqs))
+        top = top[np.argsort(-freqs[top], kind="stable")]
+        return {"backend": self.backend, "secret": self.secret, "shots": self.shots,
+                "top": [[output, int(freq)] for output, freq in zip(packed_to_strs(outcomes[top], n), freqs[top])],
+                "hamming": [int(count) for count in hamming], "flips": [int(count) for count in flips]}
+
+# Packs an output bitstring into bytes in the same layout as ResultData outcomes
+def pack_output(output:str):
+    import numpy as np
+    bits = np.frombuffer(output.encode("ascii"), dtype=np.uint8) - ord('0')
+    return np.packbits(bits)
+
+# Converts a counts dict to (outcomes, freqs, width) arrays. All outputs must be bitstrings of the same length
+def counts_to_arrays(counts:dict):
+    import numpy as np
+    outputs = list(counts.keys())
+    width = len(outputs[0]) if len(outputs) > 0 else 0
+    text = "".join(outputs).encode("ascii")
+    if len(text) != width*len(outputs):
+        raise ValueError("Counts outputs must all have the same length")
+    bits = np.frombuffer(text, dtype=np.uint8).reshape(len(outputs), width) - ord('0')
+    if bits.size > 0 and bits.max() > 1:
+        raise ValueError("Counts outputs must be bitstrings")
+    return np.packbits(bits, axis=1), np.fromiter(counts.values(), dtype=np.int64, count=len(outputs)), width
+
+# Converts outcome arrays back to a counts dict, in the same order
+def arrays_to_counts(outcomes, freqs, width:int)->dict:
+    import rand_bin
+    return dict(zip(rand_bin.packed_to_strs(outcomes, width), (int(f) for f in freqs)))
+
 
 # Save the given result to a text file
-def save_result(result:ResultData):
+# Results with counts are also added to the results store unless `store` is False
+@tracing.timed()
+def save_result(result:ResultData, store:bool=True):
 
     # make a result folder if it does not yet exist
     if not os.path.isdir(FOLDER):
         os.mkdir(FOLDER)
 
+    if store:
+        write_to_store([result])
     if not result.counts == None:
         write_to_hist(result)
+        write_to_summary(result)
         write_to_csv(result)
         write_to_gen_csv(result)
     if not result.qc == None:
         write_qc(result)
 
+# Save a batch of results, adding them all to the results store in a single transaction
+@tracing.timed()
+def save_results(results:list[ResultData]):
+    if not os.path.isdir(FOLDER):
+        os.mkdir(FOLDER)
+
+    write_to_store(results)
+    for result in results:
+        save_result(result, store=False)
+
+# Add results with counts to the indexed results store (see results_db.py)
+@tracing.timed()
+def write_to_store(results:list[ResultData]):
+    import results_db # Imported here as results_db imports this module
+    results = [result for result in results if result.counts != None and not result.backend in SIM_BACKENDS]
+    if len(results) > 0:
+        results_db.get_store().add(results)
+
 # Depricated and not used 
 def write_to_txt(result:ResultData):
     filename = os.path.join(FOLDER, TXT_FILE)+".txt"
@@ -62,28 +228,34 @@ def write_to_txt(result:ResultData):
         file.close()
 
 # Write results to csv containing backen, secret and frequncy of all classical outputs
-def write_to_csv(result:ResultData, id:str=None):
-    if result.backend == "basic_simulator":
+# Secrets longer than DENSE_CSV_MAX_BITS (or any secret if sparse is True) are written with write_to_sparse_csv instead
+@tracing.timed()
+def write_to_csv(result:ResultData, id:str=None, sparse:bool=None):
+    if result.backend in SIM_BACKENDS:
         return # There is no point in writng perfectly accuate results to csv
     n = result.secret_len()
+    if sparse == None:
+        sparse = n > DENSE_CSV_MAX_BITS
+    if sparse:
+        write_to_sparse_csv(result, id)
+        return
+
     f = CSV_FILE + "_" + str(n) + ".csv"
     if not id == None:
         f = id + "_" + f
     filename = os.path.join(FOLDER, f)
-    if not os.path.exists(filename):
-        with open(filename, mode='w', encoding='UTF8', newline='') as file:
-            writer = csv.writer(file)
+    bins = get_bins(n)
+
+    with open(filename, mode='a', encoding='UTF8', newline='') as file:
+        writer = csv.writer(file)
+        opened = file.tell()
 
-            # Write the header row
+        # Write the header row to new files
+        if file.tell() == 0:
             header = ["backend", "secret", "accuracy"]
-            header = header + get_bins(n)           
+            header = header + bins
             writer.writerow(header)
 
-            file.close()
-
-    with open(filename, mode='a', encoding='UTF8', newline='') as file:
-        writer = csv.writer(file)
-        bins = get_bins(n)
         # Write the data row
         line = [result.backend, '0b'+result.secret, result.accuracy()]
         for bin in bins:
@@ -92,54 +264,119 @@ def write_to_csv(result:ResultData, id:str=None):
             else:
                 line.append(0.0)
         writer.writerow(line)
-        file.close()
+        tracing.count("bytes_written", file.tell() - opened)
+
+# Write results to a long format csv with one row per observed output: (result id, backend, secret, shots, output, frequency)
+# Only outputs that were measured are written so the file size does not depend on 2^n
+@tracing.timed()
+def write_to_sparse_csv(result:ResultData, id:str=None):
+    n = result.secret_len()
+    f = CSV_FILE + "_" + str(n) + SPARSE_SUFFIX + ".csv"
+    if not id == None:
+        f = id + "_" + f
+    filename = os.path.join(FOLDER, f)
+
+    # Results without a job id still need a unique id to group their rows
+    result_id = result.id if result.id != "" else uuid.uuid4().hex
+
+    with open(filename, mode='a', encoding='UTF8', newline='') as file:
+        writer = csv.writer(file)
+        opened = file.tell()
+
+        # Write the header row to new files
+        if file.tell() == 0:
+            writer.writerow(SPARSE_HEADER)
 
-# Write to csv contining backend, secret, accurcy, secret lenght and job tag, if any
+        secret = '0b'+result.secret
+        writer.writerows([result_id, result.backend, secret, result.shots, '0b'+out, count/result.shots] for out, count in result.counts.items())
+        tracing.count("bytes_written", file.tell() - opened)
+
+# Reads a csv written by write_to_sparse_csv back into a list of ResultData (in the order they were written)
+def read_sparse_csv(filename:str)->list[ResultData]:
+    results = {}
+    with open(filename, mode='r', encoding='UTF8', newline='') as file:
+        reader = csv.reader(file)
+        next(reader) # Skip header
+        for result_id, backend, secret, shots, out, freq in reader:
+            if not result_id in results:
+                results[result_id] = ResultData(backend, secret[2:], int(shots), counts={}, id=result_id)
+            result = results[result_id]
+            result.counts[out[2:]] = round(float(freq)*result.shots)
+    return list(results.values())
+
+# Expands a result's counts to the dense view used by write_to_csv: the frequency of every output in get_bins order
+def dense_frequencies(result:ResultData)->list[float]:
+    freqs = [0.0] * (2**result.secret_len())
+    for out, count in result.counts.items():
+        freqs[int(out, 2)] = count/result.shots
+    return freqs
+
+# Write to csv contining backend, secret, accurcy, secret lenght, job tag, if any, and shots
+@tracing.timed()
 def write_to_gen_csv(result:ResultData):
-    if result.backend == "basic_simulator":
+    if result.backend in SIM_BACKENDS:
         return # There is no point in writng perfectly accuate results to csv
     n = result.secret_len()
     f = CSV_FILE + "_accuracy.csv"
 
     filename = os.path.join(FOLDER, f)
-    if not os.path.exists(filename):
-        with open(filename, mode='w', encoding='UTF8', newline='') as file:
-            writer = csv.writer(file)
+    with open(filename, mode='a', encoding='UTF8', newline='') as file:
+        writer = csv.writer(file)
+        opened = file.tell()
 
-            # Write the header row
-            header = ["backend", "secret", "accuracy", "size","tag"]        
+        # Write the header row
+        if file.tell() == 0:
+            header = ["backend", "secret", "accuracy", "size","tag", "shots"]
             writer.writerow(header)
 
-            file.close()
-
-    with open(filename, mode='a', encoding='UTF8', newline='') as file:
-        writer = csv.writer(file)
         # Write the data row
-        line = [result.backend, '0b'+result.secret, result.accuracy(), result.secret_len(), result.tag]
+        start = file.tell()
+        line = [result.backend, '0b'+result.secret, result.accuracy(), result.secret_len(), result.tag, result.shots]
         writer.writerow(line)
-        file.close()
+        end = file.tell()
+        tracing.count("bytes_written", end - opened)
+
+    # Update the running accuracy statistics (see analytics.py)
+    analytics.add_result(result, start, end)
 
 # Print a histogram for circuit outputs
+@tracing.timed()
 def write_to_hist(result:ResultData):
-    if result.secret_len() > 6:
-        # There is no point in printing a histogram of this size
+    if result.secret_len() > HIST_MAX_BITS:
+        # There is no point in printing a histogram of this size, see write_to_summary
         return
-    f = result.backend + "_" + HIST_FIG + ".png"
-    filename = os.path.join(get_job_folder(result.secret), f)
+    filename = get_figure_name(result, HIST_FIG, ".png")
+    render_queue.submit(RenderTask(render_queue.HIST, result.counts, filename))
+
+# Saves the result's summary (see ResultData.summary) as json and draws it: the most common outputs, the
+# distribution of Hamming distance to the secret and each qubit's error rate with 95% confidence intervals
+@tracing.timed()
+def write_to_summary(result:ResultData):
+    summary = result.summary()
+    # Named after the json, which is written straight away even if the figure is drawn later
+    filename = get_figure_name(result, SUMMARY_FIG, ".json")
+    with open(filename, "w") as file:
+        json.dump(summary, file)
+    render_queue.submit(RenderTask(render_queue.SUMMARY, summary, filename[:-len(".json")] + ".png"))
+
+# Returns the file name for a figure of the result, adding the result's id if the backend already has one for the secret
+def get_figure_name(result:ResultData, figure:str, extension:str)->str:
+    filename = os.path.join(get_job_folder(result.secret), result.backend + "_" + figure + extension)
     if os.path.isfile(filename):
-        filename = os.path.join(get_job_folder(result.secret), result.backend + "_" + result.id + "_" + HIST_FIG + ".png")
-    sim_hist = plot_histogram(result.counts)
-    sim_hist.savefig(filename)
-    matplotlib.pyplot.close()
+        filename = os.path.join(get_job_folder(result.secret), result.backend + "_" + result.id + "_" + figure + extension)
+    return filename
 
 # Retruns a folter to save job in (based on secret)
+# Secrets too long for a folder name are identified by their length and a hash instead
 def get_job_folder(secret:str)->str:
     sub_dir = "secret_" + secret
+    if len(secret) > MAX_FOLDER_SECRET:
+        sub_dir = "secret_" + str(len(secret)) + "b_" + hashlib.sha1(secret.encode()).hexdigest()[:16]
     dir = os.path.join(FOLDER, SUB_FOLDER, sub_dir)
 
     # Make foleder if it does not yet exist
     if not os.path.isdir(dir):
-        os.mkdir(dir)
+        os.makedirs(dir)
     return dir
 
 # makes a list of all possible binary outputs for the given qc size to be used in csv    
@@ -152,13 +389,14 @@ def get_bins(n:int):
     return arr
 
 # Writes result's quntum circuit to a .tex file and .png to be viewed later
+@tracing.timed()
 def write_qc(result:ResultData):
     f = QC_FILE
     filename = os.path.join(get_job_folder(result.secret), f)
     if not result.qc == None and not os.path.isfile(filename+".tex"):
-        result.qc.draw('latex_source', filename=(filename+".tex"))
-        result.qc.draw(output = 'mpl', filename=(filename+".png"))
+        render_queue.submit(RenderTask(render_queue.QC_LATEX, result.qc, filename+".tex"))
+        render_queue.submit(RenderTask(render_queue.QC_MPL, result.qc, filename+".png"))
     if not result.tqc == None:
         if os.path.isfile(filename+"_transpiled("+result.backend+").tex"):
             filename = filename + "_" + result.id
-        result.tqc.draw('latex_source', filename=(filename+"_transpiled("+result.backend+").tex"))
\ No newline at end of file
+        render_queue.submit(RenderTask(render_queue.QC_LATEX, result.tqc, filename+"_transpiled("+result.backend+").tex"))
\ No newline at end of file